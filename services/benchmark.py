@@ -0,0 +1,193 @@
+"""
+Benchmark of the data reduction, on synthetic archives and stand-in models (no network needed)
+Every number of workers is benchmarked in a fresh process, so peak RSS of one run never carries over to the next
+Synthetic archives have their own layout (syntheticScanSet), so archive loading (load_archive)
+is NOT the one of real RT4 archives, parsed by ncu_salsa_rt4.ScanSet
+Example:
+    python services/benchmark.py --archives 8 --scans 40 --workers 1 4
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import multiprocessing
+from data.dataReductorMultipleFiles import MultipleDataReductor
+from data.syntheticArchive import writeSyntheticArchive, syntheticScanSet
+from data.standInModels import buildStandInModels, saveStandInModels
+from data.timing import STAGE_LOAD
+DE_CAT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_arguments(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Benchmarks the data reduction on synthetic archives, with stand-in models")
+    parser.add_argument("--archives", type = int, default = 4,
+                        help = "number of synthetic archives (default: 4)")
+    parser.add_argument("--scans", type = int, default = 20,
+                        help = "number of scans in every archive (default: 20)")
+    parser.add_argument("--channels", type = int, default = 4096,
+                        help = "number of channels in every BBC (default: 4096)")
+    parser.add_argument("--rfi-rate", type = float, default = 0.2,
+                        help = "fraction of the scans with RFI (default: 0.2)")
+    parser.add_argument("--broken-rate", type = float, default = 0.05,
+                        help = "fraction of the broken scans (default: 0.05)")
+    parser.add_argument("--on-off", action = "store_true",
+                        help = "on-off archives and reduction (default: frequency-switch)")
+    parser.add_argument("-j", "--workers", type = int, nargs = "+", default = [1],
+                        help = "numbers of worker processes to benchmark (default: 1)")
+    parser.add_argument("--batched-baselines", action = "store_true",
+                        help = "fit baselines with one batched solve (default: fit_cheby scan by scan)")
+    parser.add_argument("--json", metavar = "FILE", default = None,
+                        help = "write the results to FILE as JSON")
+    parser.add_argument("--timings", metavar = "FILE", default = None,
+                        help = "append per-archive timings to FILE (JSON lines)")
+    parser.add_argument("--keep", metavar = "DIR", default = None,
+                        help = "write archives, models and results to DIR and keep them")
+    return parser.parse_args(argv)
+
+
+def peak_rss_mb(who = resource.RUSAGE_SELF) -> float:
+    '''
+    Peak resident set size in MB (ru_maxrss is in kB on Linux, in bytes on macOS)
+    '''
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_benchmark(args, archives: list[str], models, models_directory: str, output_directory: str, workers: int) -> dict:
+    '''
+    Reduces << archives >> with << workers >> worker processes, returns the measurements
+    Peak RSS is the one of the whole calling process - run it in a fresh process (run_benchmark_process)
+    '''
+    reductor = MultipleDataReductor(
+        archiveFilenames = archives,
+        data_tmp_directory = output_directory,
+        annotator_model = models[0],
+        broken_scans_detector_model = models[1],
+        final_scan_annotator_model = models[2],
+        software_path = DE_CAT,
+        isOnOff = args.on_off,
+        isCal = False,
+        workers = workers,
+        models_directory = models_directory,
+        timing = True,
+        timing_log = args.timings,
+        observation_loader = syntheticScanSet,
+        batched_baseline_fit = args.batched_baselines)
+    start = time.perf_counter()
+    reductor.performDataReduction()
+    elapsed = time.perf_counter() - start
+    stages = reductor.batchTimings()
+    # -- the reduction works on merged scans - syntheticScanSet merges pairs of raw scans --
+    merged_scans = len(archives) * (args.scans // 2)
+    return {
+        "workers": workers,
+        "batched_baselines": args.batched_baselines,
+        # -- synthetic archives are not parsed like RT4 archives - loading time says nothing about ScanSet --
+        "archive_loader": "syntheticScanSet",
+        "archives": len(archives),
+        "raw_scans": len(archives) * args.scans,
+        "merged_scans": merged_scans,
+        "seconds": elapsed,
+        "archives_per_second": len(archives) / elapsed,
+        "merged_scans_per_second": merged_scans / elapsed,
+        # -- mean duration of a single call and the sum over an archive, in seconds --
+        "stages": {
+            name: {
+                "per_call": stage["seconds"] / stage["count"],
+                "per_archive": stage["seconds"] / len(archives),
+            }
+            for name, stage in stages.items()
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_workers_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _benchmark_process(connection, args, archives: list[str], models_directory: str, output_directory: str, workers: int):
+    '''
+    Target of the benchmark process - sends result of run_benchmark through << connection >>
+    '''
+    try:
+        if workers > 1 and len(archives) > 1:
+            models = (None, None, None) # every worker process loads its own models
+        else:
+            models = buildStandInModels()
+        connection.send(run_benchmark(args, archives, models, models_directory, output_directory, workers))
+    finally:
+        connection.close()
+
+
+def run_benchmark_process(args, archives: list[str], models_directory: str, output_directory: str, workers: int) -> dict:
+    '''
+    Runs run_benchmark in a fresh (spawned) process, so ru_maxrss of the process and of its workers
+    covers this run only, not the earlier ones
+    '''
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex = False)
+    process = context.Process(
+        target = _benchmark_process,
+        args = (sender, args, archives, models_directory, output_directory, workers))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        raise RuntimeError(f"Benchmark with {workers} worker(s) failed (exit code {process.exitcode})")
+    return result
+
+
+def print_result(result: dict):
+    print(f"-----> {result['workers']} worker(s): {result['archives']} archives, {result['merged_scans']} merged scans "
+          f"({result['raw_scans']} raw) in {result['seconds']:.2f} s")
+    print(f"       {result['archives_per_second']:.3f} archives/s, {result['merged_scans_per_second']:.1f} merged scans/s")
+    print(f"       peak RSS: {result['peak_rss_mb']:.0f} MB (workers: {result['peak_rss_workers_mb']:.0f} MB)")
+    print(f"       baselines: {'batched fit' if result['batched_baselines'] else 'fit_cheby per scan'}, "
+          f"{STAGE_LOAD} reads synthetic archives - RT4 archive parsing (ScanSet) is NOT measured")
+    for name, stage in sorted(result["stages"].items(), key = lambda item: -item[1]["per_archive"]):
+        print(f"       {name:>22s}: {stage['per_archive'] * 1e3:10.2f} ms/archive, {stage['per_call'] * 1e3:10.2f} ms/call")
+
+
+def main(argv = None) -> int:
+    args = parse_arguments(argv)
+    work_directory = args.keep if args.keep is not None else tempfile.mkdtemp(prefix = "reductor_benchmark_")
+    os.makedirs(work_directory, exist_ok = True)
+    try:
+        archives = [
+            writeSyntheticArchive(
+                os.path.join(work_directory, f"synthetic_{i:03d}.tar.bz2"),
+                scans = args.scans,
+                channels = args.channels,
+                rfi_rate = args.rfi_rate,
+                broken_rate = args.broken_rate,
+                onOff = args.on_off,
+                seed = i,
+                sourcename = f"synthetic{i:03d}")
+            for i in range(args.archives)
+        ]
+        models_directory = saveStandInModels(os.path.join(work_directory, "models"))
+        results = []
+        for workers in args.workers:
+            output_directory = os.path.join(work_directory, f"reduced_{workers}")
+            os.makedirs(output_directory, exist_ok = True)
+            results.append(run_benchmark_process(args, archives, models_directory, output_directory, workers))
+            print_result(results[-1])
+        if args.json is not None:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent = 2)
+    finally:
+        if args.keep is None:
+            shutil.rmtree(work_directory, ignore_errors = True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
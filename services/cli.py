@@ -0,0 +1,138 @@
+"""
+Headless command-line entry point - reduces archives without Streamlit
+Example:
+    python services/cli.py "night/*.tar.bz2" -o reduced --bbc-lhc 1 --bbc-rhc 2 --workers 8
+"""
+
+import os
+import sys
+import glob
+import argparse
+from data.dataReductorMultipleFiles import MultipleDataReductor
+from data.modelLoader import load_models_from_directory, ensure_models
+from data.progress import terminalProgress
+from data.resultCache import resultCache, RESULT_CACHE_SIZE
+from data.fitsBundle import writeFitsBundle
+from data.tfliteBackend import INFERENCE_BACKENDS, QUANTIZATIONS, BACKEND_KERAS, QUANTIZATION_NONE
+DE_CAT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_arguments(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Reduces .tar.bz2 archives from the NCU 32 m radio telescope to .fits files")
+    parser.add_argument("archives", nargs = "+",
+                        help = "archive paths or glob patterns (quote them to let the reductor expand them)")
+    parser.add_argument("-o", "--output-dir", default = ".",
+                        help = "directory for the .fits files (default: current directory)")
+    parser.add_argument("--bbc-lhc", type = int, default = 1, choices = range(1, 5),
+                        help = "Base Band Converter for LHC (default: 1)")
+    parser.add_argument("--bbc-rhc", type = int, default = 2, choices = range(1, 5),
+                        help = "Base Band Converter for RHC (default: 2)")
+    parser.add_argument("--no-caltab", action = "store_true",
+                        help = "do not calibrate the data with caltabs")
+    parser.add_argument("--on-off", action = "store_true",
+                        help = "on-off reduction (default: frequency-switch)")
+    parser.add_argument("-j", "--workers", type = int, default = 1,
+                        help = "number of worker processes (default: 1)")
+    parser.add_argument("--offline-models", action = "store_true",
+                        help = "never download models, use the local model store only")
+    parser.add_argument("--require-pinned-models", action = "store_true",
+                        help = "refuse models without a pinned sha256 in modelPaths.ini")
+    parser.add_argument("--backend", choices = INFERENCE_BACKENDS, default = BACKEND_KERAS,
+                        help = f"inference backend of the models (default: {BACKEND_KERAS})")
+    parser.add_argument("--quantization", choices = QUANTIZATIONS, default = QUANTIZATION_NONE,
+                        help = f"quantization of the TFLite models (default: {QUANTIZATION_NONE})")
+    parser.add_argument("--batched-baselines", action = "store_true",
+                        help = "fit baselines of all scans with one batched solve, instead of fit_cheby scan by scan")
+    parser.add_argument("--no-uncalibrated", action = "store_true",
+                        help = "do not keep the spectra before calibration (UNCALIB extension), "
+                               "the files will not be recalibrated by recalibrate.py")
+    parser.add_argument("--no-cache", action = "store_true",
+                        help = "always reduce the archives, do not use the cache of reduced files")
+    parser.add_argument("--cache-dir", default = None,
+                        help = "directory of the cache of reduced files (default: user cache directory)")
+    parser.add_argument("--cache-size", type = int, default = RESULT_CACHE_SIZE // 1024**2,
+                        help = f"size limit of the cache of reduced files in MB (default: {RESULT_CACHE_SIZE // 1024**2})")
+    parser.add_argument("--timings", metavar = "FILE", default = None,
+                        help = "append durations of the reduction stages to FILE (JSON lines) and print the summary")
+    parser.add_argument("--bundle", metavar = "FILE", default = None,
+                        help = "write all observations to a single .fits FILE instead of one file per observation")
+    return parser.parse_args(argv)
+
+
+def expand_archives(patterns: list[str]) -> list[str]:
+    """
+    Expands glob patterns, keeps the order of the arguments and drops duplicates
+    """
+    archives = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for filename in matches:
+            filename = os.path.abspath(filename)
+            if filename not in archives:
+                archives.append(filename)
+    return archives
+
+
+def main(argv = None) -> int:
+    args = parse_arguments(argv)
+    archives = expand_archives(args.archives)
+    missing = [f for f in archives if not os.path.isfile(f)]
+    if len(missing) > 0 or len(archives) == 0:
+        for filename in missing:
+            print(f"-----> No such archive: {filename}", file = sys.stderr)
+        if len(archives) == 0:
+            print("-----> No archives to reduce", file = sys.stderr)
+        return 1
+    os.makedirs(args.output_dir, exist_ok = True)
+
+    models_directory = ensure_models(DE_CAT, offline = args.offline_models, require_pinned = args.require_pinned_models)
+    if args.workers > 1 and len(archives) > 1:
+        models = (None, None, None) # every worker process loads its own models
+    else:
+        models = load_models_from_directory(
+            models_directory, backend = args.backend, quantization = args.quantization, software_path = DE_CAT)
+
+    reductor = MultipleDataReductor(
+        archiveFilenames = archives,
+        data_tmp_directory = os.path.abspath(args.output_dir),
+        annotator_model = models[0],
+        broken_scans_detector_model = models[1],
+        final_scan_annotator_model = models[2],
+        software_path = DE_CAT,
+        isOnOff = args.on_off,
+        isCal = not args.no_caltab,
+        BBCLHC = args.bbc_lhc,
+        BBCRHC = args.bbc_rhc,
+        workers = args.workers,
+        models_directory = models_directory,
+        result_cache = None if args.no_cache else resultCache(args.cache_dir, args.cache_size * 1024**2),
+        timing_log = args.timings,
+        model_backend = args.backend,
+        model_quantization = args.quantization,
+        batched_baseline_fit = args.batched_baselines,
+        keep_uncalibrated = not args.no_uncalibrated)
+    saved_filenames = reductor.performDataReduction(progressCallback = terminalProgress())
+    if args.bundle is not None:
+        bundle_filename = writeFitsBundle(saved_filenames, os.path.abspath(args.bundle))
+        for filename in saved_filenames:
+            os.remove(filename)
+        saved_filenames = [bundle_filename]
+    for filename in saved_filenames:
+        print(filename)
+    if args.timings is not None:
+        print_timings(reductor.batchTimings())
+    return 0
+
+
+def print_timings(stages: dict):
+    """
+    Prints summed durations of the reduction stages, the longest first
+    """
+    print("-----> Timings:", file = sys.stderr)
+    for name, stage in sorted(stages.items(), key = lambda item: -item[1]["seconds"]):
+        print(f"{name:>22s}: {stage['seconds']:9.3f} s in {stage['count']} call(s)", file = sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
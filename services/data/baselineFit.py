@@ -0,0 +1,70 @@
+"""
+Batched polynomial baseline fitting
+Fits polynomials to many spectra at once - every spectrum has its own mask of channels
+used in the fit, the basis is built once and all of the weighted least-squares problems
+are solved in a single batched call
+"""
+
+import numpy as np
+
+BASIS_CHEBYSHEV = "chebyshev"
+BASIS_POLYNOMIAL = "polynomial"
+
+
+def rangesToMask(ranges_per_row: list, n_channels: int) -> np.ndarray:
+    '''
+    Converts [start, end) channel ranges (one list per row) to (n_rows, n_channels) boolean mask
+    Ranges follow python slicing, the same as data[start:end]
+    '''
+    delta = np.zeros((len(ranges_per_row), n_channels + 1), dtype=np.int32)
+    for row, ranges in enumerate(ranges_per_row):
+        ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        starts = np.clip(ranges[:, 0], 0, n_channels)
+        ends = np.clip(ranges[:, 1], 0, n_channels)
+        valid = ends > starts
+        np.add.at(delta[row], starts[valid], 1)
+        np.add.at(delta[row], ends[valid], -1)
+    return np.cumsum(delta, axis=1)[:, :n_channels] > 0
+
+
+def baselineBasis(n_channels: int, order: int, basis: str = BASIS_CHEBYSHEV) -> np.ndarray:
+    '''
+    Returns (n_channels, order + 1) basis, evaluated on channels mapped to [-1, 1]
+    '''
+    x = np.linspace(-1.0, 1.0, n_channels)
+    if basis == BASIS_CHEBYSHEV:
+        return np.polynomial.chebyshev.chebvander(x, order)
+    elif basis == BASIS_POLYNOMIAL:
+        return np.polynomial.polynomial.polyvander(x, order)
+    raise ValueError(f"Unknown basis {basis}")
+
+
+def fitBaselines(
+        data: np.ndarray,
+        fitMask: np.ndarray,
+        order: int,
+        weights: np.ndarray | None = None,
+        basis: str = BASIS_CHEBYSHEV) -> np.ndarray:
+    '''
+    Fits baseline of << order >> to every row of (n_rows, n_channels) << data >>,
+    using only channels where << fitMask >> is True (optionally weighted by << weights >>)
+    Returns (n_rows, n_channels) residuals: data - baseline
+    '''
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    n_rows, n_channels = data.shape
+    vander = baselineBasis(n_channels, order, basis)
+    w = np.asarray(fitMask, dtype=np.float64).reshape(n_rows, n_channels)
+    if weights is not None:
+        w = w * weights
+    # -- zero-weighted channels may hold anything (nan included) - keep them out of the sums --
+    fit_data = np.where(w > 0, data, 0.0)
+    # -- normal equations of all rows: (V^T W V) c = V^T W y --
+    weighted_vander = w[:, :, np.newaxis] * vander[np.newaxis, :, :]
+    lhs = np.matmul(weighted_vander.transpose(0, 2, 1), vander)
+    rhs = np.matmul(weighted_vander.transpose(0, 2, 1), fit_data[:, :, np.newaxis])
+    # pinv handles rows with too few channels to constrain the fit
+    coefficients = np.matmul(np.linalg.pinv(lhs, hermitian=True), rhs)
+    baselines = np.matmul(vander, coefficients)[:, :, 0]
+    return data - baselines
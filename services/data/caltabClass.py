@@ -3,11 +3,57 @@ Class that holds caltab
 There can be numerous caltab instances, so this should be taken into account
 '''
 
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import validators as valid
 import requests
+from requests.adapters import HTTPAdapter
 import os
 
+# (connect, read) timeouts of caltab requests, in seconds
+CALTAB_TIMEOUT = (5.0, 30.0)
+CALTAB_POOL_SIZE = 8
+
+_session = None
+_sessionLock = threading.Lock()
+
+
+def getHttpSession() -> requests.Session:
+    '''
+    Returns HTTP session shared by all caltab downloads of the process
+    Connections to the caltab server are pooled and reused
+    '''
+    global _session
+    with _sessionLock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=CALTAB_POOL_SIZE, pool_maxsize=CALTAB_POOL_SIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def downloadCaltabTable(url: str, headers: dict | None = None) -> requests.Response:
+    '''
+    Downloads caltab table using the shared session
+    Raises for error responses, 304 (not modified) is returned as is
+    '''
+    response = getHttpSession().get(url, headers=headers, allow_redirects=True, timeout=CALTAB_TIMEOUT)
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response
+
+
+def parseCaltabTable(content: bytes) -> np.ndarray:
+    '''
+    Parses caltab table straight from the downloaded bytes
+    Returns (2, N) array: MJD - 50000 and coefficients
+    '''
+    return np.loadtxt(io.BytesIO(content), usecols=(0,1), unpack=True)
+
+
 class caltab():
     def __init__(self, label = None, filename=None, freqRange = None):
         '''
@@ -23,38 +69,56 @@ class caltab():
             self.filenames = filename
             self.label=label
             self.__loadCaltab(self.filenames)
-            
+
+    @classmethod
+    def fromTables(cls, label, freqRange, lhcTable: np.ndarray, rhcTable: np.ndarray):
+        '''
+        Creates caltab from already parsed tables
+        << lhcTable >> and << rhcTable >> are (2, N) arrays: MJD - 50000 and coefficients,
+        the same as columns of CALTAB_L1 and CALTAB_R1 files
+        '''
+        instance = cls()
+        instance.label = label
+        instance.freqRange = freqRange
+        instance.filenames = [f'{label}:LHC', f'{label}:RHC']
+        instance.lhcMJDTab = lhcTable[0] + 50000.0
+        instance.lhcCoeffsTab = np.array(lhcTable[1], dtype=np.float64)
+        instance.rhcMJDTab = rhcTable[0] + 50000.0
+        instance.rhcCoeffsTab = np.array(rhcTable[1], dtype=np.float64)
+        return instance
+
+    def getTables(self):
+        '''
+        Returns (2, N) LHC and RHC tables in the format of CALTAB_L1 and CALTAB_R1 files
+        '''
+        return (np.vstack((self.lhcMJDTab - 50000.0, self.lhcCoeffsTab)),
+                np.vstack((self.rhcMJDTab - 50000.0, self.rhcCoeffsTab)))
+
     def __loadCaltab(self, filename):
         '''
         C'mon, it's pretty straightforward what it does, really xD
-        If filename[0] is an URL: download file and load, then remove temporary file
+        If filename[0] is an URL: download file and parse it from memory
         If it is NOT an URL: just load
+        LHC and RHC are downloaded at the same time
         Simple
         '''
-        # validating if these are URL
-        # LHC
-        if valid.url(filename[0]):
-            r = requests.get(filename[0], allow_redirects=True)
-            open('tmpCalTab', 'wb').write(r.content)
-            self.lhcMJDTab, self.lhcCoeffsTab = np.loadtxt('tmpCalTab', usecols=(0,1), unpack=True)
-            os.remove('tmpCalTab')
-        else:
-            self.lhcMJDTab, self.lhcCoeffsTab = np.loadtxt(filename[0], usecols=(0,1), unpack=True)
-        
-        
-        # RHC
-        if valid.url(filename[1]):
-            r = requests.get(filename[1], allow_redirects=True)
-            open('tmpCalTab', 'wb').write(r.content)
-            self.rhcMJDTab, self.rhcCoeffsTab = np.loadtxt('tmpCalTab', usecols=(0,1), unpack=True)
-            os.remove('tmpCalTab')
-        else:
-            self.rhcMJDTab, self.rhcCoeffsTab = np.loadtxt(filename[1], usecols=(0,1), unpack=True)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            lhc, rhc = executor.map(self.__loadTable, filename[:2])
+        self.lhcMJDTab, self.lhcCoeffsTab = lhc
+        self.rhcMJDTab, self.rhcCoeffsTab = rhc
         self.lhcMJDTab += 50000.0
         self.rhcMJDTab += 50000.0
 
         self.__print_message_upon_loading()
     
+    def __loadTable(self, path):
+        '''
+        Loads single table from URL or local file
+        '''
+        if valid.url(path):
+            return parseCaltabTable(downloadCaltabTable(path).content)
+        return np.loadtxt(path, usecols=(0,1), unpack=True)
+
     def __print_message_upon_loading(self):
         '''
         Simply prints message upon loading
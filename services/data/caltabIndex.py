@@ -0,0 +1,109 @@
+'''
+Vectorized queries of the caltabs
+Frequency ranges of the loaded caltabs are cut into elementary segments, each of them knows
+which caltab covers it, so finding caltabs for many frequencies is a single searchsorted.
+Coefficients of many epochs are interpolated with one np.interp per caltab and polarization.
+'''
+
+import numpy as np
+from .caltabClass import caltab
+
+NO_CALTAB = -1
+
+
+class caltabQueryResult:
+    def __init__(self, indices, lhc, rhc, found, inRange, extrapolated):
+        '''
+        Arrays with one entry per queried epoch:
+        << indices >> - index of the caltab (NO_CALTAB if none covers the frequency)
+        << lhc >>, << rhc >> - coefficients (1.0 without caltab)
+        << found >> - caltab covers the frequency
+        << inRange >> - epoch lies strictly inside the caltab (both polarizations)
+        << extrapolated >> - epoch lies outside the caltab (any polarization), so the coefficient at its edge was used
+        '''
+        self.indices = indices
+        self.lhc = lhc
+        self.rhc = rhc
+        self.found = found
+        self.inRange = inRange
+        self.extrapolated = extrapolated
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+class caltabIndex:
+    def __init__(self, caltabs: list[caltab]):
+        '''
+        Builds the frequency range index of << caltabs >>
+        Like findProperCaltabIndex, frequency belongs to a caltab if it lies strictly inside
+        its range, and if many caltabs cover it - the last one wins
+        '''
+        self.caltabs = caltabs
+        min_freqs = np.array([float(c.freqRange[0]) for c in caltabs], dtype = np.float64)
+        max_freqs = np.array([float(c.freqRange[1]) for c in caltabs], dtype = np.float64)
+        # -- elementary segments: boundaries themselves and open intervals between them --
+        self.boundaries = np.unique(np.concatenate((min_freqs, max_freqs)))
+        midpoints = np.concatenate((
+            [self.boundaries[0] - 1.0] if len(self.boundaries) > 0 else [],
+            (self.boundaries[:-1] + self.boundaries[1:]) / 2.0,
+            [self.boundaries[-1] + 1.0] if len(self.boundaries) > 0 else []))
+        self.boundaryOwners = self.__lastCovering(self.boundaries, min_freqs, max_freqs)
+        self.intervalOwners = self.__lastCovering(midpoints, min_freqs, max_freqs)
+        # -- epochs covered by both polarizations of every caltab --
+        self.minEpochs = np.array([max(c.lhcMJDTab.min(), c.rhcMJDTab.min()) for c in caltabs])
+        self.maxEpochs = np.array([min(c.lhcMJDTab.max(), c.rhcMJDTab.max()) for c in caltabs])
+
+    @staticmethod
+    def __lastCovering(frequencies: np.ndarray, min_freqs: np.ndarray, max_freqs: np.ndarray) -> np.ndarray:
+        if len(min_freqs) == 0:
+            return np.full(len(frequencies), NO_CALTAB, dtype = np.int64)
+        covered = (frequencies[:, np.newaxis] > min_freqs) & (frequencies[:, np.newaxis] < max_freqs)
+        last = len(min_freqs) - 1 - np.argmax(covered[:, ::-1], axis = 1)
+        return np.where(covered.any(axis = 1), last, NO_CALTAB)
+
+    def findCaltabIndices(self, frequencies_ghz) -> np.ndarray:
+        '''
+        Returns indices of the caltabs covering << frequencies_ghz >> (NO_CALTAB if none)
+        '''
+        frequencies = np.atleast_1d(np.asarray(frequencies_ghz, dtype = np.float64))
+        if len(self.boundaries) == 0:
+            return np.full(frequencies.shape, NO_CALTAB, dtype = np.int64)
+        positions = np.searchsorted(self.boundaries, frequencies, side = 'left')
+        on_boundary = (positions < len(self.boundaries)) & \
+            (self.boundaries[np.minimum(positions, len(self.boundaries) - 1)] == frequencies)
+        return np.where(
+            on_boundary,
+            self.boundaryOwners[np.minimum(positions, len(self.boundaries) - 1)],
+            self.intervalOwners[positions])
+
+    def query(self, mjds, rest_frequencies_mhz) -> caltabQueryResult:
+        '''
+        Finds LHC and RHC coefficients for every pair of << mjds >> and << rest_frequencies_mhz >>
+        '''
+        mjds = np.atleast_1d(np.asarray(mjds, dtype = np.float64))
+        frequencies = np.broadcast_to(np.asarray(rest_frequencies_mhz, dtype = np.float64) / 1000.0, mjds.shape)
+        return self.coefficients(mjds, self.findCaltabIndices(frequencies))
+
+    def coefficients(self, mjds, indices) -> caltabQueryResult:
+        '''
+        Finds LHC and RHC coefficients of << mjds >> in the already chosen caltabs << indices >>
+        '''
+        mjds = np.atleast_1d(np.asarray(mjds, dtype = np.float64))
+        indices = np.broadcast_to(np.asarray(indices, dtype = np.int64), mjds.shape)
+        lhc = np.ones(mjds.shape, dtype = np.float64)
+        rhc = np.ones(mjds.shape, dtype = np.float64)
+        for index in np.unique(indices[indices != NO_CALTAB]):
+            selected = indices == index
+            c = self.caltabs[index]
+            lhc[selected] = np.interp(mjds[selected], c.lhcMJDTab, c.lhcCoeffsTab)
+            rhc[selected] = np.interp(mjds[selected], c.rhcMJDTab, c.rhcCoeffsTab)
+        found = indices != NO_CALTAB
+        safe_indices = np.where(found, indices, 0)
+        if len(self.caltabs) > 0:
+            in_range = found & (mjds > self.minEpochs[safe_indices]) & (mjds < self.maxEpochs[safe_indices])
+            extrapolated = found & ((mjds < self.minEpochs[safe_indices]) | (mjds > self.maxEpochs[safe_indices]))
+        else:
+            in_range = np.zeros(mjds.shape, dtype = bool)
+            extrapolated = np.zeros(mjds.shape, dtype = bool)
+        return caltabQueryResult(indices, lhc, rhc, found, in_range, extrapolated)
@@ -0,0 +1,226 @@
+'''
+Persistent store of the caltabs
+Parsed tables are kept as .npy binaries in the config directory, next to the
+CALTAB_L1 / CALTAB_R1 text files (which stay compatible with SSDDR).
+Caltabs are loaded once per process and the same copy is shared by every observation.
+They are refreshed from caltabPaths.ini URLs only when TTL expires (or on request),
+using conditional requests, so unchanged tables are not downloaded again.
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+import validators as valid
+import platformdirs
+from .caltabClass import caltab, downloadCaltabTable, parseCaltabTable, CALTAB_POOL_SIZE
+from .caltabIndex import caltabIndex
+
+CALTAB_TTL = 24 * 3600.0 # seconds
+META_FILENAME = 'store_meta.json'
+
+# -- caltabs shared by the whole process, key: caltab directory --
+_sharedCaltabs: dict[str, list[caltab]] = {}
+_sharedIndices: dict[str, caltabIndex] = {}
+_storeLock = threading.RLock()
+# -- only one refresh downloads at a time, readers of the store do not wait for the server --
+_refreshLock = threading.Lock()
+
+
+class caltabStore:
+    def __init__(self, software_path: str, config_dir: str | None = None, ttl: float = CALTAB_TTL):
+        '''
+        << software_path >> is the directory with caltabPaths.ini
+        << config_dir >> defaults to the SSDDR config directory
+        '''
+        self.softwarePath = software_path
+        if config_dir is None:
+            config_dir = platformdirs.user_config_dir('ssddr')
+        self.caltabDirectory = os.path.join(config_dir, 'caltabs')
+        self.ttl = ttl
+        os.makedirs(self.caltabDirectory, exist_ok=True)
+
+    def getCaltabs(self) -> list[caltab]:
+        '''
+        Returns caltabs, loading them from the disk only on the first call in the process
+        '''
+        with _storeLock:
+            if self.caltabDirectory not in _sharedCaltabs:
+                _sharedCaltabs[self.caltabDirectory] = self.__readCaltabsFromDisk()
+            return _sharedCaltabs[self.caltabDirectory]
+
+    def getIndex(self) -> caltabIndex:
+        '''
+        Returns frequency range index of the caltabs, built once per process (and after every refresh)
+        '''
+        with _storeLock:
+            caltabs = self.getCaltabs()
+            index = _sharedIndices.get(self.caltabDirectory)
+            if index is None or index.caltabs is not caltabs:
+                index = _sharedIndices[self.caltabDirectory] = caltabIndex(caltabs)
+            return index
+
+    def needsRefresh(self) -> bool:
+        '''
+        True if caltabs were never downloaded or TTL has expired
+        '''
+        meta = self.__readMeta()
+        if 'fetched' not in meta:
+            return True
+        return time.time() - meta['fetched'] > self.ttl
+
+    def refresh(self, force: bool = False) -> bool:
+        '''
+        Refreshes caltabs from the addresses in caltabPaths.ini
+        Nothing happens if TTL did not expire, unless << force >> is set.
+        Tables, that the server reports as not modified, are not downloaded again.
+        Returns True if caltabs are up to date
+        '''
+        with _refreshLock:
+            if not force and not self.needsRefresh():
+                return True
+            meta = self.__readMeta()
+            validators_meta = meta.get('urls', {})
+            try:
+                confile = configparser.ConfigParser()
+                confile.read(os.path.join(self.softwarePath, 'caltabPaths.ini'))
+                # -- every section and both polarizations are fetched at the same time --
+                requested = []
+                for section in confile.sections():
+                    for path, name in ((confile[section]['lhcCaltab'], 'CALTAB_L1'),
+                                       (confile[section]['rhcCaltab'], 'CALTAB_R1')):
+                        requested.append((path, os.path.join(self.caltabDirectory, section, name)))
+                with ThreadPoolExecutor(max_workers=max(1, min(CALTAB_POOL_SIZE, len(requested)))) as executor:
+                    fetched = list(executor.map(
+                        lambda request: self.__fetchTable(request[0], request[1], validators_meta.get(request[0], {})),
+                        requested))
+                refreshed = []
+                for index, section in enumerate(confile.sections()):
+                    freq_ranges = [float(confile[section]['minFreq']), float(confile[section]['maxFreq'])]
+                    (lhcTable, lhcValidators), (rhcTable, rhcValidators) = fetched[2*index], fetched[2*index+1]
+                    validators_meta[requested[2*index][0]] = lhcValidators
+                    validators_meta[requested[2*index+1][0]] = rhcValidators
+                    refreshed.append(caltab.fromTables(section, freq_ranges, lhcTable, rhcTable))
+            except (requests.RequestException, OSError, ValueError, KeyError) as e:
+                print(f"-----> Could not refresh caltabs: {e}")
+                return False
+            # -- the store lock is held only to swap the new tables in --
+            with _storeLock:
+                for c in refreshed:
+                    self.__writeCaltab(c)
+                meta['fetched'] = time.time()
+                meta['urls'] = validators_meta
+                meta['version'] = self.__computeVersion(refreshed)
+                self.__writeMeta(meta)
+                _sharedCaltabs[self.caltabDirectory] = self.__readCaltabsFromDisk()
+            print("-----> Caltabs refreshed")
+            return True
+
+    def version(self) -> str:
+        '''
+        Returns checksum of the loaded caltab tables
+        '''
+        meta = self.__readMeta()
+        if 'version' in meta:
+            return meta['version']
+        return self.__computeVersion(self.getCaltabs())
+
+    def __fetchTable(self, path: str, local_filename: str, cached: dict):
+        '''
+        Returns (2, N) table from the URL (or local file) << path >> and its cache validators
+        If the server reports that the table did not change, local copy is used
+        '''
+        if not valid.url(path):
+            return np.loadtxt(path, usecols=(0,1), unpack=True), {}
+        headers = {}
+        if os.path.exists(local_filename + '.npy'):
+            if 'etag' in cached:
+                headers['If-None-Match'] = cached['etag']
+            if 'last_modified' in cached:
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = downloadCaltabTable(path, headers=headers)
+        if response.status_code == 304:
+            return np.load(local_filename + '.npy'), cached
+        validators = {}
+        if 'ETag' in response.headers:
+            validators['etag'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            validators['last_modified'] = response.headers['Last-Modified']
+        return parseCaltabTable(response.content), validators
+
+    def __readCaltabsFromDisk(self) -> list[caltab]:
+        '''
+        Reads caltabs from the config directory, preferring .npy binaries
+        Text tables without up-to-date binaries are parsed once and converted
+        '''
+        caltabs = []
+        print(f"-----> Searching for caltabs in {self.caltabDirectory}...")
+        for label in sorted(os.listdir(self.caltabDirectory)):
+            directory = os.path.join(self.caltabDirectory, label)
+            if not os.path.isdir(directory):
+                continue
+            try:
+                tables = [self.__readTable(os.path.join(directory, name)) for name in ('CALTAB_L1', 'CALTAB_R1')]
+                freq_ranges = np.loadtxt(os.path.join(directory, 'freq_ranges'))
+            except (OSError, ValueError) as e:
+                print(f"-----> Skipping caltab {label}: {e}")
+                continue
+            caltabs.append(caltab.fromTables(label, freq_ranges, tables[0], tables[1]))
+            print(f"-----> Caltab loaded: {label} ({freq_ranges[0]} - {freq_ranges[1]} Ghz)")
+        return caltabs
+
+    def __readTable(self, filename: str) -> np.ndarray:
+        binary_filename = filename + '.npy'
+        if os.path.exists(binary_filename) and (
+                not os.path.exists(filename) or os.path.getmtime(binary_filename) >= os.path.getmtime(filename)):
+            return np.load(binary_filename)
+        table = np.loadtxt(filename, usecols=(0,1), unpack=True)
+        # -- binary copy only speeds up the next start, the parsed table is used either way --
+        try:
+            np.save(binary_filename, table)
+        except OSError as e:
+            print(f"-----> Could not write binary caltab {binary_filename}: {e}")
+        return table
+
+    def __writeCaltab(self, c: caltab):
+        '''
+        Writes caltab as text tables, binary tables and frequency ranges
+        '''
+        target_dir = os.path.join(self.caltabDirectory, c.label)
+        os.makedirs(target_dir, exist_ok=True)
+        c.save_caltab(target_dir)
+        lhcTable, rhcTable = c.getTables()
+        np.save(os.path.join(target_dir, 'CALTAB_L1.npy'), lhcTable)
+        np.save(os.path.join(target_dir, 'CALTAB_R1.npy'), rhcTable)
+        with open(os.path.join(target_dir, 'freq_ranges'), 'w+') as freq_file:
+            freq_file.write(f"{c.freqRange[0]}\n")
+            freq_file.write(f"{c.freqRange[1]}")
+
+    def __computeVersion(self, caltabs: list[caltab]) -> str:
+        digest = hashlib.sha256()
+        for c in caltabs:
+            digest.update(c.label.encode())
+            for table in c.getTables():
+                digest.update(np.ascontiguousarray(table, dtype=np.float64).tobytes())
+        return digest.hexdigest()[:16]
+
+    def __readMeta(self) -> dict:
+        meta_filename = os.path.join(self.caltabDirectory, META_FILENAME)
+        if not os.path.exists(meta_filename):
+            return {}
+        try:
+            with open(meta_filename, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __writeMeta(self, meta: dict):
+        meta_filename = os.path.join(self.caltabDirectory, META_FILENAME)
+        with open(meta_filename + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_filename + '.tmp', meta_filename)
@@ -0,0 +1,50 @@
+"""
+Run-length encoding of the channel categories, predicted by the annotators
+Turns label arrays into [start, end] runs (end inclusive) of the chosen category
+"""
+
+import numpy as np
+
+# -- runs starting this close to either edge of the spectrum are ignored --
+EDGE_CHANNELS = 25
+
+
+def categoryRunsMatrix(labels: np.ndarray, category: int, edge: int = EDGE_CHANNELS) -> list[np.ndarray]:
+    '''
+    Finds runs of << category >> in every row of (n_rows, n_channels) << labels >>
+    Run that starts before << edge >> is cut to start at << edge >>,
+    runs starting at n_channels - << edge >> or later are dropped, ends are not cut
+    Returns list with (n_runs, 2) int array for every row
+    '''
+    labels = np.asarray(labels)
+    if labels.ndim == 1:
+        labels = labels.reshape(1, -1)
+    n_rows, n_channels = labels.shape
+    mask = np.zeros((n_rows, n_channels + 2), dtype=np.int8)
+    mask[:, 1:-1] = labels == category
+    changes = np.diff(mask, axis=1)
+    # runs alternate within each row, so starts and ends pair up in row-major order
+    start_rows, starts = np.nonzero(changes == 1)
+    ends = np.nonzero(changes == -1)[1] - 1
+    starts = np.maximum(starts, edge)
+    kept = (starts < n_channels - edge) & (ends >= starts)
+    start_rows, starts, ends = start_rows[kept], starts[kept], ends[kept]
+    runs = np.column_stack((starts, ends))
+    row_bounds = np.searchsorted(start_rows, np.arange(n_rows + 1))
+    return [runs[row_bounds[i]:row_bounds[i+1]] for i in range(n_rows)]
+
+
+def categoryRuns(labels: np.ndarray, category: int, edge: int = EDGE_CHANNELS) -> np.ndarray:
+    '''
+    Single-row version of categoryRunsMatrix, returns (n_runs, 2) int array
+    '''
+    return categoryRunsMatrix(np.asarray(labels).reshape(1, -1), category, edge)[0]
+
+
+def runsToRanges(runs) -> np.ndarray:
+    '''
+    Converts [start, end] runs (end inclusive) to [start, end) ranges, the same as data[start:end]
+    '''
+    ranges = np.array(runs, dtype=np.int64).reshape(-1, 2)
+    ranges[:, 1] += 1
+    return ranges
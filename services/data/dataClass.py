@@ -7,26 +7,69 @@ simpleSingleDishDataReductor
 import tarfile
 # from .scanObservation import observation
 from ncu_salsa_rt4 import ScanSet as observation
-from .caltabClass import caltab
+from .caltabStore import caltabStore
+from .caltabIndex import caltabIndex, NO_CALTAB
+from .polarizationContext import polarizationContext
+from .categoryBounds import categoryRuns, categoryRunsMatrix, runsToRanges
+from .baselineFit import fitBaselines, rangesToMask
+from .spectralAxes import spectralAxes, headerBand
+from .timing import (NULL_TIMER, stageTimer, STAGE_LOAD, STAGE_OUTLIERS, STAGE_BROKEN_SCANS, STAGE_ANNOTATOR,
+                     STAGE_FINAL_ANNOTATOR, STAGE_BASELINE_FIT, STAGE_CALIBRATION, STAGE_FITS_WRITE)
 import os
 import numpy as np
-import configparser
 from astropy.io import fits
 import platformdirs
 from sklearn.ensemble import IsolationForest
 
+# -- fixed seed of the total flux outlier finding, so cached and recomputed flags agree --
+OUTLIER_RANDOM_STATE = 0
+OUTLIER_CONTAMINATION = 0.2
+# -- order of the baselines fitted to the scans --
+FIT_ORDER = 10
+
+
+def _contextProperty(name: str):
+    '''
+    Attribute of the default polarization context, exposed on dataContainter
+    '''
+    return property(
+        lambda self: getattr(self.context, name),
+        lambda self, value: setattr(self.context, name, value))
+
 
 class dataContainter:
+    # -- state of the reduced polarization lives in the default context --
+    actualBBC = _contextProperty('actualBBC')
+    fitBoundsChannels = _contextProperty('fitBoundsChannels')
+    stack = _contextProperty('stack')
+    scansInStack = property(lambda self: self.context.scansInStack)
+    meanStack = _contextProperty('meanStack')
+    finalFitRes = _contextProperty('finalFitRes')
+    scans_proceed = _contextProperty('scans_proceed')
+
     def __init__(self,
                  software_path: str,
                  data_tmp_directory: str = ".",
                  target_filename: str | None = None,
-                 onOff: bool = False):
+                 onOff: bool = False,
+                 keepScanResiduals: bool = False,
+                 batchedBaselineFit: bool = False,
+                 keepUncalibrated: bool = True,
+                 timer: stageTimer | None = None,
+                 observation_loader = None):
         self.isOnOff = onOff
+        # -- class that parses the archive, ScanSet by default (or e.g. syntheticScanSet for benchmarks) --
+        self.observationLoader = observation_loader if observation_loader is not None else observation
+        # -- durations of the reduction stages (not recorded by default) --
+        self.timer = timer if timer is not None else NULL_TIMER
+        # -- residuals of every stacked scan are kept only if scans are removed later (deleteFromStack) or debugged --
+        self.keepScanResiduals = keepScanResiduals
         '''
         CHECK CONFIGURATION FILES
         '''
         self.caltabs = []
+        # -- index of caltabs that were set by hand (not the ones of the store) --
+        self.__localCaltabIndex = None
         self.DE_CAT = software_path
         self.configDir = platformdirs.user_config_dir('ssddr')
         self.__load_caltabs_wrapper()
@@ -36,21 +79,23 @@ class dataContainter:
         '''
         self.bbcs_used = []
         self.noOfBBC = 4
-        self.actualBBC = 1
-        self.fitOrder = 10
+        self.context = polarizationContext(bbc = 1, keepScans = keepScanResiduals)
+        self.fitOrder = FIT_ORDER
+        # -- fit baselines of the whole stack with one batched solve (baselineFit), instead of fit_cheby per scan --
+        # opt-in until fitBaselines is validated against ScanSet.fit_cheby on real archives
+        self.batchedBaselineFit = batchedBaselineFit
+        # -- calibrated files keep their spectra before calibration (UNCALIB extension), for data.recalibration --
+        self.keepUncalibrated = keepUncalibrated
         self.tmpDirName = '.tmpSimpleDataReductor'
-        self.fitBoundsChannels = [ 
-            [10, 824],
-            [1224, 2872],
-            [3272, 4086]
-        ]
         self.dataTmpDirectory = data_tmp_directory
         if target_filename is not None:
-            self.obs = observation(target_filename, self.isOnOff, debug=True)
+            with self.timer.span(STAGE_LOAD):
+                self.obs = self.observationLoader(target_filename, self.isOnOff, debug=True)
             self.zTab = self.__getZData()
             self.tsysTab = self.__getTsysData()
             self.totalFluxTab = self.__getTotalFluxData()
-            self.outlierTable = self.__getOutliers(self.totalFluxTab)
+            # -- outliers are found lazily, only for BBCs that are reduced --
+            self.__outliers = {}
             self.timeTab = self.__getTimeData()
             self.mergedTimeTab = self.__getMergedTimeData()
             self.velTab = self.__generateVelTab()
@@ -66,13 +111,13 @@ class dataContainter:
             [10,900],
             [1100, 2038]
         ]
-        self.stack = []
-        self.scansInStack = []
-        
-        self.meanStack = []
-        self.finalFitRes = []
         self.finalRHC = []
         self.finalLHC = []
+        # -- final spectra before calibration and the applied coefficients (None - not calibrated) --
+        self.uncalibratedLHC = []
+        self.uncalibratedRHC = []
+        self.appliedCalCoeffLHC = None
+        self.appliedCalCoeffRHC = None
         # --------------------
         # --- calibration ---
         self.calCoeffLHC = 1.0
@@ -82,80 +127,66 @@ class dataContainter:
         """
         Downloads caltabs from the server
         """
-        self.caltabs_backup = self.caltabs
-        self.caltabs = []
-        if self.__tryToLoadCaltabs():
+        if self.caltabStore.refresh(force = True):
             print("-----> Caltabs downloaded")
-            self.__copy_caltabs_to_config(os.path.join(self.configDir, 'caltabs'))
+            self.caltabs = self.caltabStore.getCaltabs()
+            self.caltabsLoaded = len(self.caltabs) > 0
             if self.loadedData:
                 self.properCaltabIndex = self.findProperCaltabIndex()
             else:
                 self.properCaltabIndex = 0
             return True
         else:
-            self.caltabs = self.caltabs_backup
             return False
         
     def __load_caltabs_wrapper(self):
         '''
         Loads the caltab files upon startup
+        The store parses them only once per process - this is just a lookup
         '''
-        self.caltabs = []
-        caldir = os.path.join(self.configDir, 'caltabs')
-        if not os.path.exists(caldir):
-            os.makedirs(caldir, exist_ok=True)
-        print(f"-----> Searching for caltabs in {os.path.join(self.configDir, 'caltabs')}...")
-        self.__read_caltabs_from_config(os.path.join(self.configDir, 'caltabs'))
+        self.caltabStore = caltabStore(self.DE_CAT, self.configDir)
+        self.caltabs = self.caltabStore.getCaltabs()
         if len(self.caltabs) == 0:
             self.caltabsLoaded = False
             print(f"-----> No caltabs found. I suggest to try download them.")
             print(f"--------> Just go to advanced -> download caltabs")
         else:
             self.caltabsLoaded = True
-        print("-----------------------------------------")
 
-    def __read_caltabs_from_config(self, directory: str):
-        '''
-        Simply reads the caltab from config files
-        '''
-        dirs = []
-        for root, dir, file in os.walk(directory):
-            for dir_single in dir:
-                dirs.append(os.path.join(directory, dir_single))
-        
-        for directory_single in dirs:
-            self.caltabs.append(caltab(os.path.basename(directory_single), 
-                                       [os.path.join(directory_single, 'CALTAB_L1'), os.path.join(directory_single, 'CALTAB_R1')],
-                                        np.loadtxt(os.path.join(directory_single, 'freq_ranges')) ) )
-        
-    def __copy_caltabs_to_config(self, directory):
+    def fitChebyForScan(self, bbc, order, scannr, fitBoundsChannels = None):
         '''
-        Copies the caltabs to the .config/ssddr directory
+        Fits polynomial for specified BBC, with specified order and for 
+        specified scan, returns tables X and Y with polynomial and fit residuals
         '''
-        for c in self.caltabs:
-            target_dir = os.path.join(directory, c.label)
-            if not os.path.exists(target_dir):
-                os.mkdir(target_dir)
-            c.save_caltab(target_dir)
-            with open(os.path.join(target_dir, 'freq_ranges'), 'w+') as freq_file:
-                freq_file.write(f"{c.freqRange[0]}\n")
-                freq_file.write(f"{c.freqRange[1]}")
+        if fitBoundsChannels is None:
+            fitBoundsChannels = self.fitBoundsChannels
+        with self.timer.span(STAGE_BASELINE_FIT):
+            polyTabX, polyTabY, polyTabResiduals = self.obs.mergedScans[scannr].fit_cheby(bbc, order, fitBoundsChannels)
+        if not self.isOnOff:
+            return polyTabX, polyTabY, self.__halveResiduals(polyTabResiduals)
+        else:
+            return polyTabX, polyTabY, polyTabResiduals#self.__halveResiduals(polyTabResiduals)
 
-    def fitChebyForScan(self, bbc, order, scannr):
+    def fitChebyForScans(self, scans, order, fitBoundsChannels) -> np.ndarray:
         '''
-        Fits polynomial for specified BBC, with specified order and for 
-        specified scan, returns tables X and Y with polynomial and fit residuals
+        Batched version of fitChebyForScan - fits baselines of many scans with one solve
+        << scans >> is a list of (bbc, scannr) pairs, << fitBoundsChannels >> holds fit bounds for each of them
+        ([start, end] runs, end inclusive, the same as for fit_cheby)
+        Returns (n_scans, n_channels) residuals matrix, ready for stacking
         '''
-        polyTabX, polyTabY, self.polyTabResiduals = self.obs.mergedScans[scannr].fit_cheby(bbc, order, self.fitBoundsChannels)
+        data = np.stack([self.obs.mergedScans[scannr].pols[bbc-1] for bbc, scannr in scans])
+        ranges = [runsToRanges(bounds) for bounds in fitBoundsChannels]
+        with self.timer.span(STAGE_BASELINE_FIT):
+            residuals = fitBaselines(data, rangesToMask(ranges, data.shape[1]), order)
         if not self.isOnOff:
-            return polyTabX, polyTabY, self.__halveResiduals(self.polyTabResiduals)
+            return self.__halveResiduals(residuals)
         else:
-            return polyTabX, polyTabY, self.polyTabResiduals#self.__halveResiduals(self.polyTabResiduals)
+            return residuals
 
     def __halveResiduals(self, residuals):
-        chanCnt = int(len(residuals) / 2)
-        self.tmpHalvedRes = (residuals[:chanCnt] - residuals[chanCnt:]) / 2.0
-        return self.tmpHalvedRes
+        residuals = np.asarray(residuals)
+        chanCnt = int(residuals.shape[-1] / 2)
+        return (residuals[..., :chanCnt] - residuals[..., chanCnt:]) / 2.0
 
     def __openTheArchive(self, tarName):
         """
@@ -224,10 +255,11 @@ class dataContainter:
         return np.asarray(tsystb)
 
     def __getTotalFluxData(self):
-        totalFlux = []
-        for i in range(self.noOfBBC):
-            totalFlux.append( [np.sum(np.sqrt(scan.pols[i] * scan.pols[i])) for scan in self.obs.mergedScans])
-        return np.asarray(totalFlux)
+        '''
+        Returns (n_bbc, n_scans) table with total flux of every merged scan
+        '''
+        pols = np.stack([np.asarray(scan.pols)[:self.noOfBBC] for scan in self.obs.mergedScans], axis = 1)
+        return np.abs(pols).sum(axis = -1)
 
     def __getTimeData(self):
         time = np.asarray([i.mjd for i in self.obs.scans])
@@ -240,11 +272,24 @@ class dataContainter:
         time *= 24
         return time
 
-    def __getOutliers(self, totalFluxTab):
-        outlier_table = []
-        for tab in totalFluxTab:
-            outlier_table.append(IsolationForest(contamination = 0.2).fit_predict(X = tab.reshape(-1,1), y = None))
-        return np.asarray(outlier_table)
+    def getOutliers(self, bbc: int) -> np.ndarray:
+        '''
+        Returns Isolation Forest labels (-1 for outliers, 1 otherwise) of the total flux of << bbc >>
+        Computed on the first access and cached
+        '''
+        if bbc not in self.__outliers:
+            with self.timer.span(STAGE_OUTLIERS):
+                self.__outliers[bbc] = IsolationForest(
+                    contamination = OUTLIER_CONTAMINATION,
+                    random_state = OUTLIER_RANDOM_STATE).fit_predict(X = self.totalFluxTab[bbc-1].reshape(-1,1), y = None)
+        return self.__outliers[bbc]
+
+    @property
+    def outlierTable(self) -> np.ndarray:
+        '''
+        Outlier labels of all BBCs, (n_bbc, n_scans)
+        '''
+        return np.asarray([self.getOutliers(bbc) for bbc in range(1, self.noOfBBC + 1)])
 
     def findBrokenScan(self,
                        scanIndex: int,
@@ -252,7 +297,7 @@ class dataContainter:
                        broken_scan_detector):
         """
         Asseses if the scan is broken, using Neural Network
-        And total flux outlier finding (computed upon creation of this object with Isolation Forest)
+        And total flux outlier finding (Isolation Forest, computed on the first use for the BBC)
         :param scanIndex:
         :param tmpScanData:
         :param broken_scan_detector:
@@ -261,7 +306,7 @@ class dataContainter:
         flag_network = self.checkIfBroken(
                 model = broken_scan_detector,
                 data = tmpScanData)
-        flag_outlier = self.outlierTable[self.actualBBC-1][scanIndex] == -1
+        flag_outlier = self.getOutliers(self.actualBBC)[scanIndex] == -1
         return flag_network or flag_outlier # return True if at least one of these is True
 
     def addToStack(
@@ -287,10 +332,114 @@ class dataContainter:
             model = annotator,
             data = tmp_scan_data
         )
+        self.__stackLabelledScan(scanIndex, channel_categories)
+
+    def newPolarizationContext(self, bbc: int) -> polarizationContext:
+        """
+        Creates independent reduction context for BBC << bbc >>
+        Contexts of different BBCs can be reduced at the same time
+        """
+        return polarizationContext(bbc = bbc, scansCount = len(self.obs.mergedScans), keepScans = self.keepScanResiduals)
 
+    def addScansToStack(
+            self,
+            scanIndices,
+            annotator,
+            broken_scan_detector,
+            context: polarizationContext | None = None):
+        """
+        Batched version of addToStack
+        Broken scan detector and channel annotator are run once each over
+        a (n_scans, n_channels, 1) tensor, instead of once per scan
+        :param scanIndices: indices of merged scans to be stacked
+        :param annotator: model that annotates channels
+        :param broken_scan_detector: model that detects broken scans
+        :param context: polarization context to stack into (default one if None)
+        """
+        if context is None:
+            context = self.context
+        self.stackPolarizations(
+            [context],
+            annotator = annotator,
+            broken_scan_detector = broken_scan_detector,
+            scanIndices = scanIndices)
+
+    def stackPolarizations(
+            self,
+            contexts: list[polarizationContext],
+            annotator,
+            broken_scan_detector,
+            scanIndices = None):
+        """
+        Stacks scans of all << contexts >> with one combined inference batch:
+        scans of every context go through the broken scan detector together,
+        then through the channel annotator together
+        :param contexts: polarization contexts to be reduced
+        :param annotator: model that annotates channels
+        :param broken_scan_detector: model that detects broken scans
+        :param scanIndices: indices of merged scans to be stacked (all if None)
+        """
+        if scanIndices is None:
+            scanIndices = range(len(self.obs.mergedScans))
+        if len({c.actualBBC for c in contexts}) < len(contexts):
+            # RFI removal of one context changes data of the other - they cannot share a batch
+            for context in contexts:
+                self.stackPolarizations([context], annotator, broken_scan_detector, scanIndices)
+            return
+        pending = [] # (context, scanIndex) pairs
+        for context in contexts:
+            for scanIndex in scanIndices:
+                if self.__checkIfStacked(scanIndex, context):
+                    print(f"-----> scan no. {scanIndex+1} is already stacked!")
+                else:
+                    pending.append((context, scanIndex))
+        if len(pending) == 0:
+            return
+        # -- check which scans are broken --
+        scans_data = np.stack([self.obs.mergedScans[i].pols[c.actualBBC-1] for c, i in pending])
+        flags_network = self.checkIfBrokenBatch(model = broken_scan_detector, data = scans_data)
+        flags_outlier = np.asarray([self.getOutliers(c.actualBBC)[i] == -1 for c, i in pending], dtype=bool)
+        scans_ok = ~(flags_network | flags_outlier)
+        if not scans_ok.any():
+            return
+        # -- label channels of the scans that are fine --
+        channel_categories = self.getFitBoundChannelsBatch(model = annotator, data = scans_data[scans_ok])
+        # -- RFI and fit bounds of all scans at once --
+        remove_tables = categoryRunsMatrix(channel_categories, 2)
+        fit_bounds = categoryRunsMatrix(channel_categories, 0)
+        scans_to_stack = [p for p, ok in zip(pending, scans_ok) if ok]
+        for (context, scanIndex), remove_table, bounds in zip(scans_to_stack, remove_tables, fit_bounds):
+            self.obs.mergedScans[scanIndex].remove_channels(context.actualBBC, remove_table.tolist())
+            context.fitBoundsChannels = bounds.tolist()
+            context.scans_proceed[scanIndex] = 'ADDED'
+        scans_bounds = [bounds.tolist() for bounds in fit_bounds]
+        # -- fit baselines --
+        if self.batchedBaselineFit:
+            residuals = self.fitChebyForScans(
+                [(c.actualBBC, i) for c, i in scans_to_stack],
+                self.fitOrder,
+                scans_bounds)
+        else:
+            residuals = [self.fitChebyForScan(c.actualBBC, self.fitOrder, i, bounds)[2]
+                         for (c, i), bounds in zip(scans_to_stack, scans_bounds)]
+        residuals = np.asarray(residuals)
+        for context in contexts:
+            rows = [k for k, (c, i) in enumerate(scans_to_stack) if c is context]
+            context.stack.addMany([scans_to_stack[k][1] for k in rows], residuals[rows])
+
+    def __stackLabelledScan(
+            self,
+            scanIndex: int,
+            channel_categories: np.ndarray,
+            context: polarizationContext | None = None):
+        """
+        Removes RFI, fits the baseline and stacks the scan with already labelled channels
+        """
+        if context is None:
+            context = self.context
         # remove RFI
         remove_table = self.extract_category_bounds(channel_categories, cat_to_bound = 2)
-        self.obs.mergedScans[scanIndex].remove_channels(self.actualBBC, remove_table)
+        self.obs.mergedScans[scanIndex].remove_channels(context.actualBBC, remove_table)
 
         # colors = {
         #     0: 'grey',
@@ -315,109 +464,143 @@ class dataContainter:
         # plt.close(fig)
         # # ----------------------------
 
-        self.fitBoundsChannels = self.extract_category_bounds(channel_categories, cat_to_bound = 0)
-        self.scans_proceed[scanIndex] = 'ADDED'
-        x,y,residuals, = self.fitChebyForScan(self.actualBBC, self.fitOrder, scanIndex)
-        self.stack.append(residuals)
-        self.scansInStack.append(scanIndex)
+        context.fitBoundsChannels = self.extract_category_bounds(channel_categories, cat_to_bound = 0)
+        context.scans_proceed[scanIndex] = 'ADDED'
+        x,y,residuals, = self.fitChebyForScan(context.actualBBC, self.fitOrder, scanIndex, context.fitBoundsChannels)
+        context.stack.add(scanIndex, residuals)
 
     def checkIfBroken(self, model, data: np.ndarray):
-        category_labels = model.predict(data.reshape(1, 4096, 1))
-        cat = [np.argmax(s) for s in category_labels]
-        if np.asarray(cat)[0] == 0:
-            return False # scan is ok
-        else:
+        if self.checkIfBrokenBatch(model, data.reshape(1, 4096))[0]:
             return True # scan is broken
+        else:
+            return False # scan is ok
+
+    def checkIfBrokenBatch(self, model, data: np.ndarray) -> np.ndarray:
+        """
+        Returns boolean array, True for every row of << data >> (n_scans, n_channels) classified as broken
+        """
+        with self.timer.span(STAGE_BROKEN_SCANS):
+            category_labels = model.predict(data.reshape(data.shape[0], data.shape[1], 1))
+        return np.argmax(category_labels, axis=-1) != 0
 
     def getFitBoundChannels(self, model, data: np.ndarray):
-        category_labels = model.predict(data.reshape(1, data.shape[0], 1))
-        category_table = np.asarray([int(np.argmax(s)) for s in category_labels[0]])
-        return category_table
+        return self.getFitBoundChannelsBatch(model, data.reshape(1, data.shape[0]))[0]
+
+    def getFitBoundChannelsBatch(self, model, data: np.ndarray, stage: str = STAGE_ANNOTATOR) -> np.ndarray:
+        """
+        Returns (n_scans, n_channels) array with channel categories for every row of << data >>
+        << stage >> names the model in the timings
+        """
+        with self.timer.span(stage):
+            category_labels = model.predict(data.reshape(data.shape[0], data.shape[1], 1))
+        return np.argmax(category_labels, axis=-1)
 
     def extract_category_bounds(self, category, cat_to_bound: int = 0):
-        new_bounds = []
-        i = 25
-        while i < len(category) - 25:
-            if category[i] == cat_to_bound:
-                start = i
-                while i < len(category) and category[i] == cat_to_bound:
-                    i += 1
-                end = i - 1
-                new_bounds.append([start, end])
-            else:
-                i += 1
-        return new_bounds
+        '''
+        Returns [start, end] (end inclusive) runs of << cat_to_bound >>, skipping 25 channels at the edges
+        '''
+        return categoryRuns(category, cat_to_bound).tolist()
 
     def discardFromStack(self, scanIndex):
         self.scans_proceed[scanIndex] = 'DISCARDED'
 
-    def calculateSpectrumFromStack(self):
-        if len(self.stack) == 0:
-            self.meanStack = np.zeros(2048).astype(float)
+    def calculateSpectrumFromStack(self, context: polarizationContext | None = None):
+        if context is None:
+            context = self.context
+        if len(context.stack) == 0:
+            context.meanStack = np.zeros(2048).astype(float)
         else:
-            self.meanStack = np.mean(self.stack, axis=0)
-        self.finalFitRes = self.meanStack.copy()
-        return self.finalFitRes
+            context.meanStack = context.stack.mean()
+        context.finalFitRes = context.meanStack.copy()
+        return context.finalFitRes
 
     def processFinalSpectrum(
             self,
             spectrum_data: np.ndarray,
-            final_scan_annotator) -> np.ndarray:
+            final_scan_annotator,
+            context: polarizationContext | None = None) -> np.ndarray:
         """
         Processes a final spectrum
         :param spectrum_data:  data with spectrum calculated from stack
         :param final_scan_annotator:  a model that annotates channels
+        :param context: polarization context the spectrum belongs to (default one if None)
         :return: processed spectrum
         """
+        if context is None:
+            context = self.context
+        return self.processFinalSpectra([spectrum_data], final_scan_annotator, [context])[0]
+
+    def processFinalSpectra(
+            self,
+            spectra_data: list[np.ndarray],
+            final_scan_annotator,
+            contexts: list[polarizationContext]) -> list[np.ndarray]:
+        """
+        Processes final spectra of many polarization contexts with one inference batch
+        :param spectra_data: spectra calculated from stacks, one per context
+        :param final_scan_annotator: a model that annotates channels
+        :param contexts: polarization contexts the spectra belong to
+        :return: processed spectra
+        """
         # discard this part if this is on-off data reduction
         if self.isOnOff:
-            return spectrum_data
-        channel_categories = self.getFitBoundChannels(
+            return spectra_data
+        channel_categories = self.getFitBoundChannelsBatch(
             model = final_scan_annotator,
-            data = spectrum_data
+            data = np.stack(spectra_data),
+            stage = STAGE_FINAL_ANNOTATOR
         )
-        fitBoundChannels = self.extract_category_bounds(channel_categories, cat_to_bound=0)
-        final_spectrum = self.fit_poly_for_data(spectrum_data=spectrum_data, fitBoundChannels=fitBoundChannels, poly_order=10)
-        self.finalFitRes = final_spectrum
-        return final_spectrum
+        fitBoundChannels = [bounds.tolist() for bounds in categoryRunsMatrix(channel_categories, 0)]
+        final_spectra = list(self.fit_poly_for_data(
+            spectrum_data = np.stack(spectra_data),
+            fitBoundChannels = fitBoundChannels,
+            poly_order = 10))
+        for final_spectrum, context in zip(final_spectra, contexts):
+            context.finalFitRes = final_spectrum
+        return final_spectra
 
 
     def fit_poly_for_data(self, spectrum_data, fitBoundChannels, poly_order: int = 7, ):
-        fitCHans, fitData = self.__getDataFromRangesD(spectrum_data, fitBoundChannels)
-        poly = np.polyfit(fitCHans, fitData, poly_order)
-        polyTabX = np.linspace(1, len(spectrum_data), len(spectrum_data))
-        polyTabY = np.polyval(poly, polyTabX)
-        polyTabResiduals = spectrum_data - polyTabY
-        return polyTabResiduals
-
-    def __getDataFromRangesD(self, spectrum_data, ranges):
-        fitData = []
-        fitChans = []
-        chans = np.linspace(1, len(spectrum_data), len(spectrum_data))
-        for i in ranges:
-            fitData.extend(spectrum_data[i[0]:i[1]])
-            fitChans.extend(chans[i[0]:i[1]])
-        return fitChans, fitData
+        '''
+        Fits polynomial through channels in << fitBoundChannels >> ([start, end) ranges) and returns residuals
+        << spectrum_data >> can also be (n_spectra, n_channels) matrix, with list of ranges for every spectrum
+        '''
+        spectrum_data = np.asarray(spectrum_data)
+        with self.timer.span(STAGE_BASELINE_FIT):
+            if spectrum_data.ndim == 1:
+                return fitBaselines(spectrum_data, rangesToMask([fitBoundChannels], len(spectrum_data)), poly_order)[0]
+            return fitBaselines(spectrum_data, rangesToMask(fitBoundChannels, spectrum_data.shape[1]), poly_order)
 
-    def deleteFromStack(self, scanIndex):
-        if not self.__checkIfStacked(scanIndex):
+    def deleteFromStack(
+            self,
+            scanIndex,
+            residuals: np.ndarray | None = None,
+            context: polarizationContext | None = None):
+        '''
+        Removes scan from the stack of << context >> (default one if None), subtracting its residuals
+        from the stack sum - << residuals >> if given, otherwise the kept ones (keepScanResiduals)
+        Raises ValueError if residuals are neither given nor kept
+        '''
+        if context is None:
+            context = self.context
+        if not self.__checkIfStacked(scanIndex, context):
             print(f"-----> scan no. {scanIndex+1} was not stacked, so it cannot be removed!")
             return
-        i = self.scansInStack.index(scanIndex)
-        self.scansInStack.pop(i)
-        self.stack.pop(i)
-        self.scans_proceed[scanIndex] = 'DISCARDED'
+        context.stack.remove(scanIndex, residuals)
+        context.scans_proceed[scanIndex] = 'DISCARDED'
 
-    def __checkIfStacked(self, indexNo):
-        if indexNo in self.scansInStack:
+    def __checkIfStacked(self, indexNo, context: polarizationContext | None = None):
+        if context is None:
+            context = self.context
+        if indexNo in context.stack:
             return True
         else:
             return False
     
     def setLHCTab(self):
-        self.LHCTab = np.mean(self.stack, axis=0)
+        self.LHCTab = self.stack.mean()
     def setRHCTab(self):
-        self.RHCTab = np.mean(self.stack, axis=0)
+        self.RHCTab = self.stack.mean()
 
     def __generateVelTab(self):
         '''
@@ -425,28 +608,15 @@ class dataContainter:
         Generally, the data is rotated to this frame upon loading, so here we are just generating the table straightfoward
         Nothing really complicated
         '''
-        velocity = self.obs.scans[0].vlsr # km/s
-        restfreq = self.obs.scans[0].rest # MHz
+        fscan = self.obs.scans[0]
         if not self.isOnOff:
-            freq_rang = self.obs.scans[0].bw / 2.0 # MHz
-            nchans = self.obs.scans[0].NNch / 2.0
+            freq_rang = fscan.bw / 2.0 # MHz
+            nchans = fscan.NNch / 2.0
         else:
-            freq_rang = self.obs.scans[0].bw
-            nchans = self.obs.scans[0].NNch
-
-        c = 299792.458 # km/s
-        beta = velocity / c
-        gamma  = 1.0 / np.sqrt(1.0 - beta**2.0)
-        fcentr = restfreq * (gamma * (1.0 - beta))
-        fbegin = fcentr - freq_rang / 2.0
-        fend = fcentr + freq_rang / 2.0
-        #self.auto_prepared_to_fft = zeros((4, self.NN), dtype=complex128) # docelowa
-        freqsTab = np.zeros((4, int(nchans)), dtype=np.float64)
-        velsTab = np.zeros((4, int(nchans)), dtype=np.float64)
-        for i in range(len(fbegin)):
-            freqsTab[i] = np.linspace(fbegin[i], fend[i], int(nchans))
-            velsTab[i] = - c * ( (freqsTab[i] / restfreq[i] ) - 1.0 )
-            velsTab[i] = velsTab[i][::-1]
+            freq_rang = fscan.bw
+            nchans = fscan.NNch
+        # -- shared by every observation with the same setup, read-only --
+        freqsTab, velsTab = spectralAxes(fscan.vlsr, fscan.rest, freq_rang, int(nchans))
         return velsTab
 
     def removeChannels(self, BBC, scanNumber, removeTab):
@@ -472,69 +642,74 @@ class dataContainter:
         return fitVels, fitData
     
     def convertVelsToChannels(self, BBC, velTab):
-        chanTab = []
-        for i in velTab:
-            minChan = -1
-            maxChan = -1
-            # find minChan
-            for j in range(len(self.velTab[BBC])):
-                if i[0] < self.velTab[BBC][j]:
-                    minChan = j
-                    break
-            # find maxChan
-            for j in range(len(self.velTab[BBC])):
-                if i[1] < self.velTab[BBC][j]:
-                    maxChan = j
-                    break
-            
-            if i[0] > self.velTab[BBC].max():
-                minChan = len(self.velTab[BBC])-1
-
-            if i[1] > self.velTab[BBC].max():
-                maxChan = len(self.velTab[BBC])-1
-
-            if minChan != -1 and maxChan != -1:
-                chanTab.append([minChan, maxChan])
-        return chanTab
+        '''
+        Converts velocity ranges << velTab >> to channel ranges of BBC << BBC >>
+        Range starts (and ends) at the first channel with velocity greater than its edge,
+        edges above the axis are clipped to the last channel, ranges with an edge
+        not below the axis (but not above it either) are dropped
+        '''
+        vels = self.velTab[BBC]
+        ranges = np.asarray(velTab, dtype=np.float64).reshape(-1, 2)
+        # velocity axis is increasing, so the first greater velocity is a single searchsorted
+        chans = np.searchsorted(vels, ranges, side='right')
+        chans[chans == len(vels)] = -1
+        chans[ranges > vels.max()] = len(vels) - 1
+        return chans[(chans != -1).all(axis=1)].tolist()
     
     def removeChansOnFinalSpectrum(self, channelsToRemove):
-        for i in channelsToRemove:
-            minChan = i[0]
-            maxChan = i[1]
+        ranges = np.asarray(channelsToRemove, dtype=np.int64).reshape(-1, 2)
+        for minChan, maxChan in ranges:
             print(f'------> Removing from channels {minChan} to {maxChan}')
-            for j in range(minChan, maxChan, 1):
-                self.finalFitRes[j] = self.__interpolateFinal(minChan, maxChan, j)
+        ranges = ranges[ranges[:, 1] > ranges[:, 0]]
+        if len(ranges) == 0:
+            return
+        ordered = ranges[np.argsort(ranges[:, 0], kind='stable')]
+        if np.all(ordered[1:, 0] >= ordered[:-1, 1]):
+            self.__interpolateFinal(ranges)
+        else:
+            # -- overlapping ranges interpolate over each other, so they go one by one, in the given order --
+            for r in ranges:
+                self.__interpolateFinal(r[np.newaxis])
 
-    def __interpolateFinal(self, minChan, maxChan, j):
+    def __interpolateFinal(self, ranges):
         '''
-        interpolate between specified channels for channel j
+        Replaces channels [minChan, maxChan) of every range of << ranges >> with the line
+        between the values at minChan and maxChan
         '''
-        y1 = self.finalFitRes[minChan]
-        x1 = minChan
-        y2 = self.finalFitRes[maxChan]
-        x2 = maxChan
-        a = (y1-y2) / (x1 - x2)
-        b = y1 - a * x1
-        return a * j + b
+        minChans = ranges[:, 0]
+        maxChans = ranges[:, 1]
+        y1 = self.finalFitRes[minChans]
+        y2 = self.finalFitRes[maxChans]
+        a = (y1 - y2) / (minChans - maxChans)
+        b = y1 - a * minChans
+        lengths = maxChans - minChans
+        starts = np.cumsum(lengths) - lengths
+        channels = np.arange(lengths.sum()) - np.repeat(starts - minChans, lengths)
+        self.finalFitRes[channels] = np.repeat(a, lengths) * channels + np.repeat(b, lengths)
     
     def cancelChangesFinal(self):
         print(f'------> cancelling all of the changes!')
         self.finalFitRes = self.meanStack.copy()
     
-    def clearStack(self, pol='LHC'):
+    def clearStack(self, pol='LHC', context: polarizationContext | None = None):
+        if context is None:
+            context = self.context
+        uncalibrated = context.finalFitRes if context.uncalibratedFitRes is None else context.uncalibratedFitRes
         if pol == 'LHC':
-            self.finalLHC = self.finalFitRes.copy()
+            self.finalLHC = context.finalFitRes.copy()
+            self.uncalibratedLHC = np.array(uncalibrated, copy=True)
+            self.appliedCalCoeffLHC = context.calibrationCoeff
         elif pol == 'RHC':
-            self.finalRHC = self.finalFitRes.copy()
+            self.finalRHC = context.finalFitRes.copy()
+            self.uncalibratedRHC = np.array(uncalibrated, copy=True)
+            self.appliedCalCoeffRHC = context.calibrationCoeff
 
-        self.clearStackedData()
+        self.clearStackedData(context)
     
-    def clearStackedData(self):
-        self.meanStack = []
-        self.stack = []
-        self.scansInStack = []
-        self.finalFitRes = []
-        self.scans_proceed = self.__makeScansProceedTable()
+    def clearStackedData(self, context: polarizationContext | None = None):
+        if context is None:
+            context = self.context
+        context.clear()
 
     def setActualBBC(self, BBC):
         self.actualBBC = BBC
@@ -544,33 +719,25 @@ class dataContainter:
         V  = self.finalRHC - self.finalLHC
         return I, V, self.finalLHC, self.finalRHC
     
-    def __tryToLoadCaltabs(self):
-        """
-        Tries to load caltab from a server
-        adresses are loaded from the config file
-        """
-        try:
-            confile = configparser.ConfigParser()
-            confile.read(os.path.join(self.DE_CAT,'caltabPaths.ini'))
-            for i in confile.sections():
-                tab_paths = [confile[i]['lhcCaltab'], confile[i]['rhcCaltab']]
-                freq_ranges = [ float(confile[i]['minFreq']), float(confile[i]['maxFreq'])]
-                self.caltabs.append(caltab(i, tab_paths, freq_ranges))
-            self.caltabsLoaded = True
-            return True
-        except:
-            self.caltabsLoaded = False
-            return False
-    
+    def getCaltabIndex(self) -> caltabIndex:
+        '''
+        Returns frequency range index of << caltabs >>, shared with the store if the caltabs are
+        '''
+        index = self.caltabStore.getIndex()
+        if index.caltabs is self.caltabs:
+            return index
+        if self.__localCaltabIndex is None or self.__localCaltabIndex.caltabs is not self.caltabs:
+            self.__localCaltabIndex = caltabIndex(self.caltabs)
+        return self.__localCaltabIndex
+
     def findProperCaltabIndex(self):
         '''
         Assumes the data is loaded
         '''
-        properIndex = int(1e9)
-        for i in range(len(self.caltabs)):
-            if self.caltabs[i].inRange(self.obs.scans[0].rest[0] / 1000.0):
-                properIndex = i
-        return properIndex
+        properIndex = self.getCaltabIndex().findCaltabIndices(self.obs.scans[0].rest[0] / 1000.0)[0]
+        if properIndex == NO_CALTAB:
+            return int(1e9)
+        return int(properIndex)
     
     def findCalCoefficients(self) -> bool:
         '''
@@ -579,14 +746,19 @@ class dataContainter:
             True - if the caltab is longer than current epoch
             False - if the caltab is shorter
         '''
+        with self.timer.span(STAGE_CALIBRATION):
+            return self.__findCalCoefficients()
+
+    def __findCalCoefficients(self) -> bool:
         date = self.obs.mjd
         if self.properCaltabIndex == int(1e9):
             self.calCoeffLHC = 1.0
             self.calCoeffRHC = 1.0
             return True
         else:
-            self.calCoeffLHC = self.caltabs[self.properCaltabIndex].findCoeffs(date)[0]
-            self.calCoeffRHC = self.caltabs[self.properCaltabIndex].findCoeffs(date)[1]
+            coefficients = self.getCaltabIndex().coefficients(date, self.properCaltabIndex)
+            self.calCoeffLHC = float(coefficients.lhc[0])
+            self.calCoeffRHC = float(coefficients.rhc[0])
             self.printCalibrationMessage(self.calCoeffLHC, self.calCoeffRHC, date, lhc=True)
             if self.caltabs[self.properCaltabIndex].getMaxEpoch() < date:
                 return False
@@ -618,16 +790,24 @@ class dataContainter:
             print(f'-----> Check CAREFULLY if this is ok.')
         print('-----------------------------------------')
     
-    def calibrate(self, lhc = True):
-        if lhc:
-            self.meanStack *= self.calCoeffLHC
-            self.finalFitRes *= self.calCoeffLHC
-        else:
-            self.meanStack *= self.calCoeffRHC
-            self.finalFitRes *= self.calCoeffRHC
-        return self.finalFitRes
+    def calibrate(self, lhc = True, context: polarizationContext | None = None):
+        if context is None:
+            context = self.context
+        with self.timer.span(STAGE_CALIBRATION):
+            coeff = self.calCoeffLHC if lhc else self.calCoeffRHC
+            # -- spectrum before the first calibration is kept for recalibration --
+            if context.calibrationCoeff is None:
+                context.uncalibratedFitRes = np.array(context.finalFitRes, dtype=np.float64, copy=True)
+                context.calibrationCoeff = coeff
+            else:
+                context.calibrationCoeff *= coeff
+            context.meanStack *= coeff
+            context.finalFitRes *= coeff
+        return context.finalFitRes
     
     def uncalibrate(self, lhc = True):
+        self.context.calibrationCoeff = None
+        self.context.uncalibratedFitRes = None
         if lhc:
             self.meanStack = self.meanStack / self.calCoeffLHC
             self.finalFitRes = self.finalFitRes / self.calCoeffLHC
@@ -653,6 +833,10 @@ class dataContainter:
         print("-----> Fit order changed to", fitOrder)
     
     def saveReducedDataToFits(self):
+        with self.timer.span(STAGE_FITS_WRITE):
+            return self.__saveReducedDataToFits()
+
+    def __saveReducedDataToFits(self):
         # -- filename --
         fname = self.obs.scans[0].sourcename + '_' + str(round(self.obs.mjd,3)).replace(".", "") + ".fits"
         result_filename = os.path.join(self.dataTmpDirectory, fname)
@@ -665,8 +849,18 @@ class dataContainter:
         primaryHeader = self.__constructPrimaryHeader()
         dataHeader = fits.BinTableHDU.from_columns([columnPol1, columnPol2])
         self.__addToSecondaryHeader(dataHeader.header)
+        self.__addCalibrationToHeader(dataHeader.header)
+        hdus = [primaryHeader, dataHeader]
+        # -- spectra before calibration, so the file can be recalibrated without the archive --
+        if self.keepUncalibrated and self.__calibrationApplied():
+            uncalLHC = np.array(self.uncalibratedLHC, dtype=np.float64)
+            uncalRHC = np.array(self.uncalibratedRHC, dtype=np.float64)
+            hdus.append(fits.BinTableHDU.from_columns([
+                fits.Column(name='Pol 1', format='E', array=uncalLHC[::-1]),
+                fits.Column(name='Pol 2', format='E', array=uncalRHC[::-1])],
+                name='UNCALIB'))
         # -- filesave --
-        hdul = fits.HDUList([primaryHeader, dataHeader])
+        hdul = fits.HDUList(hdus)
         hdul.writeto(result_filename, overwrite=True)
         return result_filename
 
@@ -730,15 +924,31 @@ class dataContainter:
         hdr['TSYS1'] = (float(fscan.tsys[self.bbcs_used[0]-1]) / 1000.0, 'Measured Tsys pol 1')
         hdr['TSYS2'] = (float(fscan.tsys[self.bbcs_used[1]-1]) / 1000.0, 'Measured Tsys pol 2')
     
+    def __addCalibrationToHeader(self, hdr):
+        '''
+        Records how the spectra were calibrated - data.recalibration uses it to apply newer caltabs
+        '''
+        # -- without a caltab for the epoch the coefficients are 1.0, so the spectra are not calibrated --
+        calibrated = self.__calibrationApplied() and self.properCaltabIndex != int(1e9)
+        if calibrated:
+            caltabLabel = str(self.caltabs[self.properCaltabIndex].label)
+        else:
+            caltabLabel = 'NONE'
+        hdr['CALIBRAT'] = (calibrated, 'Calibrated with caltabs')
+        hdr['CAL_LHC'] = (float(self.appliedCalCoeffLHC or 1.0), 'Calibration coefficient of pol 1')
+        hdr['CAL_RHC'] = (float(self.appliedCalCoeffRHC or 1.0), 'Calibration coefficient of pol 2')
+        hdr['CALTAB'] = (caltabLabel, 'Caltab used for calibration')
+        hdr['CALTABV'] = (self.caltabStore.version(), 'Version of the caltabs')
+        hdr['OBS_MJD'] = (float(self.obs.mjd), 'Epoch used for calibration')
+
+    def __calibrationApplied(self):
+        '''
+        True if calibration of the final spectra was requested (calibrate was called on them)
+        '''
+        return self.appliedCalCoeffLHC is not None or self.appliedCalCoeffRHC is not None
+
     def __calculateFbeginAndRest(self, Vlsr, restFreq, bw):
-        c = 299792.458
-        restFreq  /= 1e6
-        beta = Vlsr / c
-        gamma = 1.0 / np.sqrt(1.0-beta**2.0)
-        FCENTR = float(restFreq) * (gamma * (1.0-beta))
-        FBEGIN = float(FCENTR) - float(bw) / 2.0
-        FEND = float(FCENTR) + float(bw) / 2.0
-        return FCENTR, FBEGIN, FEND
+        return headerBand(Vlsr, restFreq / 1e6, bw)
 
     def __makeRAandDECstring(self, fscan):
         str_rah = self.append0(str(fscan.rah))
@@ -3,8 +3,40 @@ This is a simple wrapper that uses the slightly modified instance of
 SSDDR dataClass - in order to perform proper data reduction
 """
 
-from .dataClass import dataContainter
-import streamlit as st
+import os
+import multiprocessing
+from typing import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .dataClass import dataContainter, FIT_ORDER
+from .caltabStore import caltabStore
+from .modelLoader import load_models_from_directory, loaded_model_checksums, model_filenames
+from .tfliteBackend import exportModelsDirectory, BACKEND_KERAS, BACKEND_TFLITE, QUANTIZATION_NONE
+from .resultCache import resultCache
+from .progress import silentProgress
+from .timing import stageTimer, appendTimingRecord, STAGE_ARCHIVE
+
+# -- models of the worker process, loaded once by _initWorker --
+_workerModels = None
+
+
+def _initWorker(models_directory: str, backend: str, quantization: str, software_path: str | None = None):
+    '''
+    Initializer of the worker processes - loads models once per process
+    '''
+    global _workerModels
+    _workerModels = load_models_from_directory(
+        models_directory, backend = backend, quantization = quantization, software_path = software_path)
+
+
+def _reduceArchiveInWorker(reductor, archiveFilename: str) -> tuple[str, dict | None]:
+    '''
+    Reduces single archive in the worker process, using models loaded by _initWorker
+    Returns the name of the saved .fits file and timings of the archive (None if not timed)
+    '''
+    reductor.annotator_model, reductor.broken_scans_detector, reductor.final_scan_annotator_model = _workerModels
+    saved_filename = reductor.reduceArchive(archiveFilename)
+    return saved_filename, reductor.archiveTimings.get(archiveFilename)
+
 
 class MultipleDataReductor:
     def __init__(
@@ -18,7 +50,17 @@ class MultipleDataReductor:
             isOnOff: bool = False,
             isCal: bool = True,
             BBCLHC: int = 1,
-            BBCRHC: int = 2):
+            BBCRHC: int = 2,
+            workers: int = 1,
+            models_directory: str | None = None,
+            result_cache: resultCache | None = None,
+            timing: bool = False,
+            timing_log: str | None = None,
+            observation_loader = None,
+            model_backend: str = BACKEND_KERAS,
+            model_quantization: str = QUANTIZATION_NONE,
+            batched_baseline_fit: bool = False,
+            keep_uncalibrated: bool = True):
         # -- first we need to create attributes for data reduction --
         self.archiveFilenames = archiveFilenames
         self.dataTmpDirectory = data_tmp_directory
@@ -30,68 +72,219 @@ class MultipleDataReductor:
         self.annotator_model = annotator_model
         self.broken_scans_detector = broken_scans_detector_model
         self.final_scan_annotator_model = final_scan_annotator_model
+        # -- parallel reduction --
+        self.workers = max(1, int(workers))
+        if models_directory is None:
+            models_directory = os.path.join(self.softwarePath, "models")
+        self.modelsDirectory = models_directory
+        # -- inference backend of the models loaded by the worker processes --
+        self.modelBackend = model_backend
+        self.modelQuantization = model_quantization
+
+        # -- durations of the reduction stages, per archive (key: archive filename) --
+        self.timing = timing or timing_log is not None
+        self.timingLog = timing_log
+        self.archiveTimings: dict[str, dict] = {}
+        # -- baselines of all scans fitted with one solve (opt-in, False - fit_cheby per scan) --
+        self.batchedBaselineFit = batched_baseline_fit
+        # -- calibrated files keep the UNCALIB extension (spectra before calibration), so they can be recalibrated --
+        self.keepUncalibrated = keep_uncalibrated
+        # -- archive parser handed to dataContainter (None - ScanSet) --
+        self.observationLoader = observation_loader
 
-        # -- download caltabs --
-        self.dummyObject = dataContainter(
-            self.softwarePath,
-            target_filename = None,
-        )
-        self.dummyObject.download_caltabs()
-        del self.dummyObject
+        # -- refresh caltabs (only if they are outdated) --
+        caltab_version = None
+        if self.isCal:
+            store = caltabStore(self.softwarePath)
+            store.refresh()
+            caltab_version = store.version()
         # ----------------------
+        # -- reduced files are looked up in the cache first (if given) --
+        self.resultCache = result_cache
+        self.caltabVersion = caltab_version
+        self.__cacheParameters = None
         self.archiveFilenames = archiveFilenames
 
-    def performDataReduction(self):
+    @property
+    def cacheParameters(self) -> dict:
+        '''
+        Everything, besides the archive, that the reduced file depends on - part of the cache keys
+        Computed on the first use, so model files are hashed only when the cache is used
+        '''
+        if self.__cacheParameters is None:
+            self.__cacheParameters = {
+                'parameters': {
+                    'isOnOff': self.isOnOff,
+                    'isCal': self.isCal,
+                    'BBCLHC': self.bbcLHC,
+                    'BBCRHC': self.bbcRHC,
+                    'backend': self.modelBackend,
+                    'quantization': self.modelQuantization,
+                    'fitOrder': FIT_ORDER,
+                    'batchedBaselineFit': self.batchedBaselineFit,
+                    'keepUncalibrated': self.keepUncalibrated,
+                },
+                'model_checksums': loaded_model_checksums(self.modelsDirectory, self.softwarePath),
+                'caltab_version': self.caltabVersion,
+            }
+        return self.__cacheParameters
+
+    def __getstate__(self):
+        '''
+        Models are not sent to the worker processes - they load their own copies
+        '''
+        state = self.__dict__.copy()
+        state['annotator_model'] = None
+        state['broken_scans_detector'] = None
+        state['final_scan_annotator_model'] = None
+        return state
+
+    def performDataReduction(
+            self,
+            fileSavedCallback: Callable[[str], None] | None = None,
+            progressCallback: Callable[[float, str], None] | None = None):
+        '''
+        Reduces all of the archives, returns names of the saved .fits files
+        << fileSavedCallback >> is called with the name of every .fits file as soon as it is written
+        << progressCallback >> is called with fraction complete and a message
+        (e.g. Streamlit progress bar or data.progress.terminalProgress)
+        '''
+        if progressCallback is None:
+            progressCallback = silentProgress()
+        if self.workers > 1 and len(self.archiveFilenames) > 1:
+            return self.__performParallelDataReduction(fileSavedCallback, progressCallback)
         saved_filenames: list[str] = []
-        bar = st.progress(0, text = "Starting processing files...")
         for file_index, singleArchiveFilename in enumerate(self.archiveFilenames):
             fraction_complete = (file_index + 1) / len(self.archiveFilenames)
-            bar.progress(fraction_complete, f"Processing file no. {file_index+1} out of {len(self.archiveFilenames)}")
-            # -- declare object --
-            observation = dataContainter(
-                software_path = self.softwarePath,
-                target_filename = singleArchiveFilename,
-                data_tmp_directory = self.dataTmpDirectory)
-
-            # -- if this is first file from pack - download caltabs --
-            if file_index == 0 and self.isCal:
-                observation.download_caltabs()
-
-
-            observation.findCalCoefficients()
-            # -- LHC --
-            observation.actualBBC = self.bbcLHC
-            for i in range(len(observation.obs.mergedScans)):
-                observation.addToStack(
-                    i,
-                    annotator = self.annotator_model,
-                    broken_scan_detector = self.broken_scans_detector)
-            # handle calibration
-            observation.calculateSpectrumFromStack()
-            observation.processFinalSpectrum(
-                observation.finalFitRes,
-                self.final_scan_annotator_model)
-            if self.isCal:
-                observation.calibrate(lhc = True)
-            observation.clearStack(pol = "LHC")
-            observation.bbcs_used.append(self.bbcLHC)
-
-            # -- RHC --
-            observation.actualBBC = self.bbcRHC
-            for i in range(len(observation.obs.mergedScans)):
-                observation.addToStack(
-                    i,
-                    annotator = self.annotator_model,
-                    broken_scan_detector = self.broken_scans_detector)
-            # handle calibration
-            observation.calculateSpectrumFromStack()
-            observation.processFinalSpectrum(
-                observation.finalFitRes,
-                self.final_scan_annotator_model)
-            if self.isCal:
-                observation.calibrate(lhc = False)
-            observation.clearStack(pol = "RHC")
-            observation.bbcs_used.append(self.bbcRHC)
-            saved_filenames.append(observation.saveReducedDataToFits())
-            del observation # delete observation object since the data was processed
-        return saved_filenames
\ No newline at end of file
+            progressCallback(fraction_complete, f"Processing file no. {file_index+1} out of {len(self.archiveFilenames)}")
+            saved_filenames.append(self.reduceArchive(singleArchiveFilename))
+            self.__logArchiveTimings(singleArchiveFilename)
+            if fileSavedCallback is not None:
+                fileSavedCallback(saved_filenames[-1])
+        self.__logBatchTimings()
+        return saved_filenames
+
+    def __performParallelDataReduction(
+            self,
+            fileSavedCallback: Callable[[str], None] | None,
+            progressCallback: Callable[[float, str], None]):
+        '''
+        Spreads the archives across the pool of worker processes
+        Returned filenames keep the order of << archiveFilenames >>
+        '''
+        saved_filenames: list[str | None] = [None] * len(self.archiveFilenames)
+        workers = min(self.workers, len(self.archiveFilenames))
+        if self.resultCache is not None:
+            # hash the models once here - workers get the parameters with the pickled reductor
+            self.cacheParameters
+        if self.modelBackend == BACKEND_TFLITE:
+            # export once here, rather than in every worker at the same time
+            exportModelsDirectory(
+                self.modelsDirectory, self.modelQuantization,
+                keras_filenames = model_filenames(self.modelsDirectory, self.softwarePath))
+        with ProcessPoolExecutor(
+                max_workers = workers,
+                mp_context = multiprocessing.get_context("spawn"),
+                initializer = _initWorker,
+                initargs = (self.modelsDirectory, self.modelBackend, self.modelQuantization, self.softwarePath)) as executor:
+            futures = {
+                executor.submit(_reduceArchiveInWorker, self, singleArchiveFilename): file_index
+                for file_index, singleArchiveFilename in enumerate(self.archiveFilenames)
+            }
+            for files_done, future in enumerate(as_completed(futures), start = 1):
+                archive_filename = self.archiveFilenames[futures[future]]
+                saved_filenames[futures[future]], archive_timings = future.result()
+                if archive_timings is not None:
+                    self.archiveTimings[archive_filename] = archive_timings
+                    self.__logArchiveTimings(archive_filename)
+                if fileSavedCallback is not None:
+                    fileSavedCallback(saved_filenames[futures[future]])
+                fraction_complete = files_done / len(self.archiveFilenames)
+                progressCallback(fraction_complete, f"Processed {files_done} out of {len(self.archiveFilenames)} files")
+        self.__logBatchTimings()
+        return saved_filenames
+
+    def batchTimings(self) -> dict:
+        '''
+        Returns stage durations summed over all of the reduced archives
+        '''
+        timer = stageTimer()
+        for archive_timings in self.archiveTimings.values():
+            timer.merge(archive_timings)
+        return timer.summary()
+
+    def __logArchiveTimings(self, archiveFilename: str):
+        if self.timingLog is not None and archiveFilename in self.archiveTimings:
+            appendTimingRecord(self.timingLog, {
+                'archive': os.path.basename(archiveFilename),
+                'stages': self.archiveTimings[archiveFilename]})
+
+    def __logBatchTimings(self):
+        if self.timingLog is not None:
+            appendTimingRecord(self.timingLog, {
+                'batch': len(self.archiveTimings),
+                'workers': self.workers,
+                'stages': self.batchTimings()})
+
+    def reduceArchive(self, singleArchiveFilename: str) -> str:
+        '''
+        Performs the data reduction of a single archive
+        Returns the name of the saved .fits file
+        Durations of the stages are stored in << archiveTimings >>, if timing is on
+        '''
+        timer = stageTimer(enabled = self.timing)
+        with timer.span(STAGE_ARCHIVE):
+            saved_filename = self.__reduceArchive(singleArchiveFilename, timer)
+        if self.timing:
+            self.archiveTimings[singleArchiveFilename] = timer.summary()
+        return saved_filename
+
+    def __reduceArchive(self, singleArchiveFilename: str, timer: stageTimer) -> str:
+        if self.resultCache is not None:
+            cache_key = resultCache.key(singleArchiveFilename, **self.cacheParameters)
+            cached_filename = self.resultCache.get(cache_key, self.dataTmpDirectory)
+            if cached_filename is not None:
+                print(f"-----> {os.path.basename(singleArchiveFilename)} was already reduced, using cached result")
+                return cached_filename
+        saved_filename = self.__reduceObservation(singleArchiveFilename, timer)
+        if self.resultCache is not None:
+            self.resultCache.put(cache_key, saved_filename)
+        return saved_filename
+
+    def __reduceObservation(self, singleArchiveFilename: str, timer: stageTimer) -> str:
+        '''
+        Reduces the archive from scratch, returns the name of the saved .fits file
+        '''
+        # -- declare object --
+        observation = dataContainter(
+            software_path = self.softwarePath,
+            target_filename = singleArchiveFilename,
+            data_tmp_directory = self.dataTmpDirectory,
+            batchedBaselineFit = self.batchedBaselineFit,
+            keepUncalibrated = self.keepUncalibrated,
+            timer = timer,
+            observation_loader = self.observationLoader)
+
+        observation.findCalCoefficients()
+        # -- LHC and RHC are reduced together, each in its own context --
+        lhc = observation.newPolarizationContext(self.bbcLHC)
+        rhc = observation.newPolarizationContext(self.bbcRHC)
+        observation.stackPolarizations(
+            [lhc, rhc],
+            annotator = self.annotator_model,
+            broken_scan_detector = self.broken_scans_detector)
+        observation.processFinalSpectra(
+            [observation.calculateSpectrumFromStack(lhc), observation.calculateSpectrumFromStack(rhc)],
+            self.final_scan_annotator_model,
+            [lhc, rhc])
+        # handle calibration
+        if self.isCal:
+            observation.calibrate(lhc = True, context = lhc)
+            observation.calibrate(lhc = False, context = rhc)
+        observation.clearStack(pol = "LHC", context = lhc)
+        observation.clearStack(pol = "RHC", context = rhc)
+        observation.bbcs_used.append(self.bbcLHC)
+        observation.bbcs_used.append(self.bbcRHC)
+        saved_filename = observation.saveReducedDataToFits()
+        del observation # delete observation object since the data was processed
+        return saved_filename
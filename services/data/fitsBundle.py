@@ -0,0 +1,150 @@
+'''
+Many reduced observations in a single .fits file
+Every observation becomes one row of a binary table: its header keys are columns
+(OBJECT, DATE-OBS, OBS_MJD, VSYS, TSYS1, CAL_LHC, ...) and its spectra are array columns.
+Observations with different number of channels go to separate tables
+(EXTNAME = SPECTRA, EXTVER = 1, 2, ..., NCHANS key holds the number of channels).
+Tables are written uncompressed, so readers can memory-map the file and fetch one epoch
+without loading the others.
+'''
+
+import os
+import numpy as np
+from astropy.io import fits
+from .recalibration import UNCALIBRATED_EXTENSION
+
+BUNDLE_EXTENSION = 'SPECTRA'
+FILENAME_COLUMN = 'FILENAME'
+SPECTRA_COLUMNS = ('Pol 1', 'Pol 2')
+UNCALIBRATED_COLUMNS = ('Uncal Pol 1', 'Uncal Pol 2')
+# -- keys describing the table itself, not the observation --
+STRUCTURAL_KEYS = ('XTENSION', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2', 'PCOUNT', 'GCOUNT', 'TFIELDS', 'EXTNAME', 'EXTVER')
+
+
+def _observationKeys(header: fits.Header) -> dict:
+    return {
+        key: value for key, value in header.items()
+        if key not in STRUCTURAL_KEYS and not key.startswith(('TTYPE', 'TFORM', 'TUNIT', 'TDIM'))
+    }
+
+
+def _keyColumn(name: str, values: list) -> fits.Column:
+    '''
+    Column of header key << name >> of every observation (missing values are empty, False or NaN)
+    '''
+    present = [v for v in values if v is not None]
+    if len(present) > 0 and all(isinstance(v, bool) for v in present):
+        return fits.Column(name = name, format = 'L', array = np.array([bool(v) for v in values]))
+    if len(present) > 0 and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return fits.Column(name = name, format = 'D',
+                           array = np.array([np.nan if v is None else float(v) for v in values]))
+    strings = ['' if v is None else str(v) for v in values]
+    width = max(1, max(len(s) for s in strings))
+    return fits.Column(name = name, format = f'{width}A', array = np.array(strings))
+
+
+def writeFitsBundle(fits_filenames: list[str], bundle_filename: str) -> str:
+    '''
+    Writes observations of the reduced << fits_filenames >> (in the given order) to << bundle_filename >>
+    Returns << bundle_filename >>
+    '''
+    groups: dict[int, list[tuple[str, dict, np.ndarray, np.ndarray | None]]] = {}
+    primaryHeader = None
+    for filename in fits_filenames:
+        with fits.open(filename) as hdul:
+            if primaryHeader is None:
+                primaryHeader = hdul[0].header.copy()
+            data = hdul[1].data
+            spectra = np.stack([np.asarray(data[c], dtype = np.float32) for c in SPECTRA_COLUMNS])
+            uncalibrated = None
+            if UNCALIBRATED_EXTENSION in hdul:
+                uncalibratedData = hdul[UNCALIBRATED_EXTENSION].data
+                uncalibrated = np.stack([np.asarray(uncalibratedData[c], dtype = np.float32) for c in SPECTRA_COLUMNS])
+            groups.setdefault(spectra.shape[1], []).append(
+                (os.path.basename(filename), _observationKeys(hdul[1].header), spectra, uncalibrated))
+
+    primary = fits.PrimaryHDU(header = primaryHeader)
+    primary.header['BUNDLE'] = (True, 'Many observations, one per table row')
+    primary.header['NEPOCHS'] = (sum(len(g) for g in groups.values()), 'Number of observations')
+    primary.header['NTABLES'] = (len(groups), 'Number of tables with spectra')
+    hdus = [primary]
+    for version, (nchans, observations) in enumerate(groups.items(), start = 1):
+        keys = list(dict.fromkeys(key for _, header, _, _ in observations for key in header))
+        columns = [fits.Column(name = FILENAME_COLUMN, format = f'{max(len(o[0]) for o in observations)}A',
+                               array = np.array([o[0] for o in observations]))]
+        columns += [_keyColumn(key, [header.get(key) for _, header, _, _ in observations]) for key in keys]
+        for i, name in enumerate(SPECTRA_COLUMNS):
+            columns.append(fits.Column(name = name, format = f'{nchans}E',
+                                       array = np.stack([o[2][i] for o in observations])))
+        if all(o[3] is not None for o in observations):
+            for i, name in enumerate(UNCALIBRATED_COLUMNS):
+                columns.append(fits.Column(name = name, format = f'{nchans}E',
+                                           array = np.stack([o[3][i] for o in observations])))
+        table = fits.BinTableHDU.from_columns(columns, name = BUNDLE_EXTENSION, ver = version)
+        table.header['NCHANS'] = (nchans, 'Number of channels of the spectra')
+        hdus.append(table)
+    fits.HDUList(hdus).writeto(bundle_filename, overwrite = True)
+    print(f"-----> {primary.header['NEPOCHS']} observations bundled into {os.path.basename(bundle_filename)}")
+    return bundle_filename
+
+
+class fitsBundle:
+    def __init__(self, filename: str):
+        '''
+        Opens bundle << filename >> memory-mapped - spectra are read only when asked for
+        Epochs are numbered across the tables, in the order they were written
+        '''
+        self.filename = filename
+        self.hdul = fits.open(filename, memmap = True)
+        self.tables = [hdu for hdu in self.hdul[1:] if hdu.name == BUNDLE_EXTENSION]
+        self.__rows = [(table, row) for table in self.tables for row in range(table.header['NAXIS2'])]
+
+    def __len__(self) -> int:
+        return len(self.__rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.hdul.close()
+
+    def metadata(self, epoch: int) -> dict:
+        '''
+        Returns header keys of observation << epoch >>
+        '''
+        table, row = self.__rows[epoch]
+        record = table.data[row]
+        return {
+            name: record[name] for name in table.columns.names
+            if name not in SPECTRA_COLUMNS and name not in UNCALIBRATED_COLUMNS
+        }
+
+    def spectrum(self, epoch: int, uncalibrated: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns Pol 1 and Pol 2 spectra of observation << epoch >> (before calibration, if << uncalibrated >>)
+        '''
+        table, row = self.__rows[epoch]
+        names = UNCALIBRATED_COLUMNS if uncalibrated else SPECTRA_COLUMNS
+        return tuple(np.array(table.data.field(name)[row], dtype = np.float32) for name in names)
+
+    def column(self, name: str) -> np.ndarray:
+        '''
+        Returns header key << name >> of every observation, e.g. column('OBS_MJD')
+        '''
+        return np.concatenate([np.asarray(table.data.field(name)) for table in self.tables]) \
+            if len(self.tables) > 0 else np.array([])
+
+    def find(self, source: str | None = None, mjd_range: tuple[float, float] | None = None) -> list[int]:
+        '''
+        Returns epochs of << source >> observed within [start, end] << mjd_range >>
+        '''
+        selected = np.ones(len(self), dtype = bool)
+        if source is not None:
+            selected &= np.char.strip(self.column('OBJECT').astype(str)) == source
+        if mjd_range is not None:
+            mjds = self.column('OBS_MJD')
+            selected &= (mjds >= mjd_range[0]) & (mjds <= mjd_range[1])
+        return np.flatnonzero(selected).tolist()
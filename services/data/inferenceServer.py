@@ -0,0 +1,189 @@
+"""
+In-process inference service
+Owns the models and runs every predict() of every session and job thread through a queue.
+Concurrent requests for the same model are merged into micro-batches (up to << max_batch_size >>
+rows, waiting at most << max_wait >> seconds for more requests), so the model is called
+by one thread at a time and with larger batches. A request never waits longer than
+<< request_timeout >>, and requests are failed at once if the thread serving their model stops.
+"""
+
+import time
+import queue
+import threading
+from typing import Callable
+import numpy as np
+from .tfliteBackend import MODEL_SUFFIXES
+
+DEFAULT_MAX_BATCH_SIZE = 256 # rows (spectra)
+DEFAULT_MAX_WAIT = 0.005 # seconds
+# -- the first request also waits for the models to load --
+DEFAULT_REQUEST_TIMEOUT = 600.0 # seconds
+
+
+class _request:
+    def __init__(self, data: np.ndarray):
+        self.data = data
+        self.result: np.ndarray | None = None
+        self.error: Exception | None = None
+        self.done = threading.Event()
+
+
+class modelProxy:
+    def __init__(self, server, name: str):
+        '''
+        Stands in for the model - predict() goes through << server >>
+        '''
+        self.server = server
+        self.name = name
+
+    def predict(self, data: np.ndarray, verbose = 0) -> np.ndarray:
+        return self.server.predict(self.name, data)
+
+
+class inferenceServer:
+    def __init__(
+            self,
+            models_provider: Callable[[], tuple],
+            max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+            max_wait: float = DEFAULT_MAX_WAIT,
+            request_timeout: float = DEFAULT_REQUEST_TIMEOUT):
+        '''
+        << models_provider >> returns the models, like load_models_from_directory
+        (e.g. backgroundModelLoader.get) - it is called on the first request, so the server
+        and its proxies can be created before the models are loaded
+        '''
+        self.modelsProvider = models_provider
+        self.maxBatchSize = max(1, int(max_batch_size))
+        self.maxWait = max_wait
+        self.requestTimeout = request_timeout
+        self.__models: dict | None = None
+        self.__modelsLock = threading.Lock()
+        self.__queues = {name: queue.Queue() for name in MODEL_SUFFIXES}
+        # -- errors of the serving threads that stopped, new requests for their models fail at once --
+        self.__queuesLock = threading.Lock()
+        self.__stopped: dict[str, Exception] = {}
+        self.__statsLock = threading.Lock()
+        self.__stats = {name: {'requests': 0, 'batches': 0, 'rows': 0} for name in MODEL_SUFFIXES}
+        self.__threads = [
+            threading.Thread(target = self.__serve, args = (name,), name = f'inference-{name}', daemon = True)
+            for name in MODEL_SUFFIXES
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def proxies(self) -> tuple[modelProxy, modelProxy, modelProxy]:
+        '''
+        Returns proxies of scan annotator, broken scans detector and final scan annotator
+        '''
+        return tuple(modelProxy(self, name) for name in MODEL_SUFFIXES)
+
+    def predict(self, name: str, data: np.ndarray) -> np.ndarray:
+        '''
+        Queues << data >> (batch of model inputs) for model << name >> and waits for the output
+        Raises TimeoutError if the output is not ready in << requestTimeout >> seconds
+        '''
+        request = _request(np.asarray(data))
+        with self.__queuesLock:
+            if name in self.__stopped:
+                raise self.__stopped[name]
+            self.__queues[name].put(request)
+        if not request.done.wait(self.requestTimeout):
+            raise TimeoutError(f"No output of model {name} in {self.requestTimeout} s")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stats(self) -> dict:
+        '''
+        Returns numbers of requests, batches and rows served by every model
+        '''
+        with self.__statsLock:
+            return {name: dict(stats) for name, stats in self.__stats.items()}
+
+    def __model(self, name: str):
+        with self.__modelsLock:
+            if self.__models is None:
+                self.__models = dict(zip(MODEL_SUFFIXES, self.modelsProvider()))
+            return self.__models[name]
+
+    def __serve(self, name: str):
+        # requests with other input shape than the current batch, or not fitting in it, wait for the next one
+        postponed: list[_request] = []
+        # -- requests of the batch being collected or run --
+        batch: list[_request] = []
+        try:
+            self.__serveRequests(name, postponed, batch)
+        except BaseException as e:
+            error = RuntimeError(f"Inference thread of model {name} stopped: {e!r}")
+            # -- nothing serves the queue anymore - fail whatever waits in it --
+            with self.__queuesLock:
+                self.__stopped[name] = error
+                pending = batch + postponed
+                while True:
+                    try:
+                        pending.append(self.__queues[name].get_nowait())
+                    except queue.Empty:
+                        break
+            for request in pending:
+                request.error = error
+                request.done.set()
+            raise
+
+    def __serveRequests(self, name: str, postponed: list[_request], batch: list[_request]):
+        requests_queue = self.__queues[name]
+        while True:
+            batch.clear()
+            batch.append(postponed.pop(0) if len(postponed) > 0 else requests_queue.get())
+            first = batch[0]
+            rows = len(first.data)
+            deadline = time.perf_counter() + self.maxWait
+            # -- postponed requests first, then whatever arrives before the deadline --
+            # (a single request larger than max_batch_size still goes alone, as one batch)
+            for request in list(postponed):
+                if rows >= self.maxBatchSize:
+                    break
+                if self.__fits(request, first, rows):
+                    postponed.remove(request)
+                    batch.append(request)
+                    rows += len(request.data)
+            while rows < self.maxBatchSize:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = requests_queue.get(timeout = timeout)
+                except queue.Empty:
+                    break
+                if self.__fits(request, first, rows):
+                    batch.append(request)
+                    rows += len(request.data)
+                else:
+                    postponed.append(request)
+            self.__run(name, batch)
+
+    def __fits(self, request: _request, first: _request, rows: int) -> bool:
+        '''
+        True if << request >> can join the batch started by << first >>, which has << rows >> rows so far
+        '''
+        return request.data.shape[1:] == first.data.shape[1:] and rows + len(request.data) <= self.maxBatchSize
+
+    def __run(self, name: str, batch: list[_request]):
+        try:
+            model = self.__model(name)
+            inputs = batch[0].data if len(batch) == 1 else np.concatenate([r.data for r in batch])
+            outputs = np.asarray(model.predict(inputs, verbose = 0))
+            start = 0
+            for request in batch:
+                request.result = outputs[start:start + len(request.data)]
+                start += len(request.data)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
+            with self.__statsLock:
+                stats = self.__stats[name]
+                stats['requests'] += len(batch)
+                stats['batches'] += 1
+                stats['rows'] += sum(len(r.data) for r in batch)
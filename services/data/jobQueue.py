@@ -0,0 +1,127 @@
+"""
+Queue of the data reduction jobs, executed by a bounded pool of background threads
+Jobs outlive the Streamlit script run that submitted them - their status, progress
+and result can be looked up later by the job id
+"""
+
+import os
+import time
+import uuid
+import shutil
+import threading
+import traceback
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_QUEUED = 'QUEUED'
+JOB_RUNNING = 'RUNNING'
+JOB_DONE = 'DONE'
+JOB_FAILED = 'FAILED'
+
+# -- finished jobs (and their files) are kept for this long, in seconds --
+JOB_RETENTION = 24 * 3600.0
+
+
+class reductionJob:
+    def __init__(self, description: str, directory: str | None = None, result_mime: str | None = None):
+        '''
+        << directory >> is removed together with the job, once it expires
+        << result_mime >> is the content type of the result file
+        '''
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.directory = directory
+        self.resultMime = result_mime
+        self.status = JOB_QUEUED
+        self.progress = 0.0
+        self.message = "Waiting in the queue..."
+        self.resultFilename: str | None = None
+        self.error: str | None = None
+        self.submitted = time.time()
+        self.finished: float | None = None
+        self.__lock = threading.Lock()
+
+    def setProgress(self, fraction: float, message: str):
+        '''
+        Progress callback, handed to the job target
+        '''
+        with self.__lock:
+            self.progress = min(max(float(fraction), 0.0), 1.0)
+            self.message = message
+
+    def isFinished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+
+class jobQueue:
+    def __init__(self, max_workers: int = 2, retention: float = JOB_RETENTION):
+        '''
+        At most << max_workers >> jobs are executed at the same time, the rest waits in the queue
+        '''
+        self.maxWorkers = max(1, int(max_workers))
+        self.retention = retention
+        self.jobs: dict[str, reductionJob] = {}
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers = self.maxWorkers, thread_name_prefix = 'reduction-job')
+
+    def submit(
+            self,
+            target: Callable[[Callable[[float, str], None]], str],
+            description: str = "",
+            directory: str | None = None,
+            result_mime: str | None = None) -> str:
+        '''
+        Queues << target >> and returns id of the job
+        << target >> is called with the progress callback of the job and returns the name of the result file
+        '''
+        self.cleanup()
+        job = reductionJob(description, directory, result_mime)
+        with self.__lock:
+            self.jobs[job.id] = job
+        self.__executor.submit(self.__run, job, target)
+        return job.id
+
+    def get(self, job_id: str) -> reductionJob | None:
+        with self.__lock:
+            return self.jobs.get(job_id)
+
+    def queuePosition(self, job_id: str) -> int:
+        '''
+        Returns number of jobs queued before << job_id >> (0 if the job is not queued)
+        '''
+        with self.__lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != JOB_QUEUED:
+                return 0
+            return sum(1 for j in self.jobs.values() if j.status == JOB_QUEUED and j.submitted < job.submitted)
+
+    def cleanup(self):
+        '''
+        Forgets jobs finished more than << retention >> seconds ago and removes their files
+        '''
+        now = time.time()
+        with self.__lock:
+            expired = [
+                j for j in self.jobs.values()
+                if j.isFinished() and j.finished is not None and now - j.finished > self.retention
+            ]
+            for job in expired:
+                del self.jobs[job.id]
+        for job in expired:
+            if job.directory is not None and os.path.exists(job.directory):
+                shutil.rmtree(job.directory, ignore_errors = True)
+
+    def __run(self, job: reductionJob, target):
+        job.status = JOB_RUNNING
+        job.setProgress(0.0, "Starting processing files...")
+        # -- finish time is set before the final status, cleanup() reads it as soon as the job looks finished --
+        try:
+            job.resultFilename = target(job.setProgress)
+            job.setProgress(1.0, "Finished")
+            job.finished = time.time()
+            job.status = JOB_DONE
+        except Exception as e:
+            traceback.print_exc()
+            job.error = f"{type(e).__name__}: {e}"
+            job.finished = time.time()
+            job.status = JOB_FAILED
@@ -0,0 +1,376 @@
+"""
+Loading of the tensorflow models, used during the data reduction
+Tensorflow is imported only when the models are loaded, so importing this module is cheap
+"""
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import importlib.util
+import tempfile
+import time
+import threading
+import configparser
+import requests
+from .timing import stageTimer, appendTimingRecord
+from .tfliteBackend import load_tflite_models, MODEL_SUFFIXES, BACKEND_KERAS, BACKEND_TFLITE, QUANTIZATION_NONE
+
+MODEL_PATHS_FILENAME = 'modelPaths.ini'
+MANIFEST_FILENAME = 'manifest.json'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60.0
+
+
+def weighted_categorical_crossentropy(weights):
+    """
+    TLDR: this function definition is required for proper loading of tensorflow models
+    Creates a weighted categorical crossentropy loss function.
+    Args:
+        weights (dict or list): A list where indices correspond to class labels and values are weights.
+    Returns:
+        A loss function to be used in model compilation.
+    """
+
+    import tensorflow as tf
+
+    def loss(y_true, y_pred):
+        y_pred = tf.clip_by_value(y_pred, 1e-7, 1 - 1e-7)  # Prevent log(0)
+        y_true = tf.cast(y_true, tf.float32)
+
+        # Compute per-class weights
+        weights_per_sample = tf.reduce_sum(y_true * weights, axis=-1)
+
+        # Compute weighted loss
+        loss = -tf.reduce_sum(y_true * tf.math.log(y_pred), axis=-1) * weights_per_sample
+
+        return tf.reduce_mean(loss)
+
+    return loss
+
+
+def model_filenames(models_directory: str, software_path: str | None = None) -> list[str]:
+    """
+    Returns paths of scan annotator, broken scans detector and final scan annotator
+    If << models_directory >> is the model store of << software_path >>, these are the files listed
+    in its modelPaths.ini (the ones validated by ensure_models), so stray files are never picked up.
+    Other directories (e.g. stand-in models) have no list - the last matching .keras file is taken
+    """
+    if software_path is not None and os.path.exists(os.path.join(software_path, MODEL_PATHS_FILENAME)):
+        version, models = read_model_paths(software_path)
+        store_directory = os.path.join(software_path, "models", version)
+        if os.path.abspath(models_directory) == os.path.abspath(store_directory):
+            filenames = {model['name']: model['filename'] for model in models}
+            missing = [name for name in MODEL_SUFFIXES if name not in filenames]
+            if len(missing) > 0:
+                raise KeyError(f"Models {missing} are not listed in {MODEL_PATHS_FILENAME}")
+            return [os.path.join(models_directory, filenames[name]) for name in MODEL_SUFFIXES]
+    filenames = []
+    for suffix in MODEL_SUFFIXES:
+        matches = sorted(glob.glob(os.path.join(models_directory, f"*_{suffix}.keras")))
+        if len(matches) == 0:
+            raise FileNotFoundError(f"No *_{suffix}.keras model in {models_directory}")
+        filenames.append(matches[-1])
+    return filenames
+
+
+def load_models_from_directory(
+        models_directory: str,
+        compile_models: bool = False,
+        backend: str = BACKEND_KERAS,
+        quantization: str = QUANTIZATION_NONE,
+        software_path: str | None = None):
+    """
+    Loads scan annotator, broken scans detector and final scan annotator from << models_directory >>
+    Returns them in that order
+    Files are chosen by model_filenames - pass << software_path >> to load exactly the models of its modelPaths.ini
+    Models are used for inference only, so by default they are not compiled (<< compile_models >>)
+    (training-only state, e.g. the custom loss, is not deserialized)
+    With << backend >> = "tflite" models are exported to TFLite (once, with optional << quantization >>)
+    and run by the TFLite interpreter
+    """
+    keras_filenames = model_filenames(models_directory, software_path)
+    if backend == BACKEND_TFLITE:
+        return load_tflite_models(models_directory, quantization, keras_filenames = keras_filenames)
+    elif backend != BACKEND_KERAS:
+        raise ValueError(f"Unknown inference backend {backend}")
+    from tensorflow import keras
+
+    filename_scan_annotator, filename_broken_scans_detector, filename_final_scan_annotator = keras_filenames
+
+    # load models using KERAS
+    scan_annotator_model = keras.models.load_model(
+        filename_scan_annotator,
+        custom_objects = {'loss': weighted_categorical_crossentropy},
+        compile = compile_models)
+    broken_scans_detector_model = keras.models.load_model(
+        filename_broken_scans_detector,
+        compile = compile_models)
+    final_scan_annotator_model = keras.models.load_model(
+        filename_final_scan_annotator,
+        custom_objects={"loss": weighted_categorical_crossentropy},
+        compile = compile_models
+    )
+    return scan_annotator_model, broken_scans_detector_model, final_scan_annotator_model
+
+
+def read_model_paths(software_path: str):
+    """
+    Reads modelPaths.ini from << software_path >>
+    Returns version of the model store and list of models, each as dict with
+    "name", "url", "filename" and "sha256" (empty string if checksum is not pinned)
+    """
+    confile = configparser.ConfigParser()
+    confile.read(os.path.join(software_path, MODEL_PATHS_FILENAME))
+    version = confile['STORE']['version']
+    models = []
+    for section in confile.sections():
+        if section == 'STORE':
+            continue
+        models.append({
+            "name": section,
+            "url": confile[section]['url'],
+            "filename": confile[section]['filename'],
+            "sha256": confile[section].get('sha256', '').strip().lower()
+        })
+    return version, models
+
+
+def model_store_directory(software_path: str) -> str:
+    """
+    Returns directory of the current version of the model store
+    """
+    version, _ = read_model_paths(software_path)
+    return os.path.join(software_path, "models", version)
+
+
+def file_sha256(filename: str) -> str:
+    """
+    Computes sha256 checksum of the file, reading it in chunks
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_checksums(models_directory: str) -> dict:
+    """
+    Returns {filename: sha256} of the models, recorded in the store manifest
+    """
+    manifest_filename = os.path.join(models_directory, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_filename):
+        return {}
+    with open(manifest_filename, 'r') as f:
+        return json.load(f)
+
+
+def loaded_model_checksums(models_directory: str, software_path: str | None = None) -> dict:
+    """
+    Returns {filename: sha256} of the models that load_models_from_directory loads (e.g. for cache keys)
+    Checksums come from the manifest, files without a recorded (validated) checksum are hashed
+    """
+    manifest = model_checksums(models_directory)
+    try:
+        filenames = model_filenames(models_directory, software_path)
+    except (FileNotFoundError, KeyError):
+        return manifest
+    return {
+        os.path.basename(f): manifest.get(os.path.basename(f)) or file_sha256(f)
+        for f in filenames if os.path.exists(f)
+    }
+
+
+def _write_manifest(models_directory: str, manifest: dict):
+    """
+    Writes the store manifest atomically
+    """
+    fd, tmp_filename = tempfile.mkstemp(dir = models_directory, suffix = '.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent = 2, sort_keys = True)
+    os.replace(tmp_filename, os.path.join(models_directory, MANIFEST_FILENAME))
+
+
+def download_model_file(url: str, local_filename: str, expected_sha256: str = '') -> str:
+    """
+    Streams file from << url >> to a temporary file next to << local_filename >>
+    and renames it into place only when the download is complete (and matches
+    << expected_sha256 >>, if given). Returns sha256 of the downloaded file
+    """
+    digest = hashlib.sha256()
+    fd, tmp_filename = tempfile.mkstemp(dir = os.path.dirname(local_filename), suffix = '.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with requests.get(url, stream = True, timeout = DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size = DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        checksum = digest.hexdigest()
+        if expected_sha256 and checksum != expected_sha256:
+            raise ValueError(f"checksum mismatch for {url}: expected {expected_sha256}, got {checksum}")
+        os.replace(tmp_filename, local_filename)
+        return checksum
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def pin_model_checksums(software_path: str) -> dict:
+    """
+    Downloads every model listed in modelPaths.ini of << software_path >> to the model store
+    and writes sha256 of the downloaded files into modelPaths.ini (comments and order are kept)
+    Returns {model name: sha256}
+    """
+    version, models = read_model_paths(software_path)
+    models_directory = os.path.join(software_path, "models", version)
+    os.makedirs(models_directory, exist_ok = True)
+    checksums = {}
+    for model in models:
+        print(f"-----> Downloading model {model['filename']}...")
+        checksums[model['name']] = download_model_file(
+            model['url'], os.path.join(models_directory, model['filename']))
+    paths_filename = os.path.join(software_path, MODEL_PATHS_FILENAME)
+    with open(paths_filename, 'r') as f:
+        lines = f.readlines()
+    section = None
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']'):
+            section = stripped[1:-1]
+        elif section in checksums and stripped.split('=')[0].strip() == 'sha256':
+            lines[index] = f"sha256 = {checksums[section]}\n"
+    with open(paths_filename, 'w') as f:
+        f.writelines(lines)
+    manifest = model_checksums(models_directory)
+    manifest.update({model['filename']: checksums[model['name']] for model in models})
+    _write_manifest(models_directory, manifest)
+    return checksums
+
+
+def ensure_models(software_path: str, offline: bool = False, require_pinned: bool = False) -> str:
+    """
+    Makes sure that every model listed in modelPaths.ini is present in the model store
+    File is downloaded only if it is missing or its checksum does not match the pinned
+    one (or the one recorded in the manifest). With << offline >> network is never used.
+    Models without a pinned checksum cannot be validated - with << require_pinned >>
+    they are refused (ValueError), otherwise a warning is printed
+    Returns the directory with the models
+    """
+    version, models = read_model_paths(software_path)
+    unpinned = [model['name'] for model in models if not model['sha256']]
+    if len(unpinned) > 0:
+        if require_pinned:
+            raise ValueError(f"Models {unpinned} have no pinned sha256 in {MODEL_PATHS_FILENAME}")
+        # -- checksum recorded in the manifest only tells that the file did not change since the first download --
+        print(f"-----> WARNING: models {unpinned} have no pinned sha256 in {MODEL_PATHS_FILENAME}, "
+              f"their integrity is NOT validated", file = sys.stderr)
+    models_directory = os.path.join(software_path, "models", version)
+    os.makedirs(models_directory, exist_ok = True)
+    manifest = model_checksums(models_directory)
+    for model in models:
+        local_filename = os.path.join(models_directory, model['filename'])
+        expected_sha256 = model['sha256'] or manifest.get(model['filename'], '')
+        if os.path.exists(local_filename):
+            checksum = file_sha256(local_filename)
+            if expected_sha256 and checksum == expected_sha256:
+                manifest[model['filename']] = checksum
+                continue
+            if offline:
+                if expected_sha256:
+                    raise ValueError(
+                        f"Model {local_filename} does not match its checksum "
+                        f"(expected {expected_sha256}, got {checksum}) and offline mode is on")
+                # -- nothing is recorded, an unvalidated checksum must never validate the file later --
+                print(f"-----> Model {model['filename']} has no checksum to validate it, using it anyway (offline mode)")
+                continue
+        elif offline:
+            raise FileNotFoundError(f"Model {local_filename} is missing and offline mode is on")
+        print(f"-----> Downloading model {model['filename']}...")
+        try:
+            manifest[model['filename']] = download_model_file(model['url'], local_filename, model['sha256'])
+        except (requests.RequestException, ValueError, OSError) as e:
+            # -- local copy that failed its checksum is never used --
+            if not os.path.exists(local_filename) or expected_sha256:
+                raise
+            # -- nothing is recorded, so the next start tries to download it again --
+            print(f"-----> Download of {model['filename']} failed ({e}), using the local copy without a checksum to validate it")
+    _write_manifest(models_directory, manifest)
+    return models_directory
+
+
+class backgroundModelLoader:
+    def __init__(
+            self,
+            software_path: str,
+            offline: bool = False,
+            timing_log: str | None = None,
+            backend: str = BACKEND_KERAS,
+            quantization: str = QUANTIZATION_NONE,
+            require_pinned: bool = False):
+        """
+        Starts making sure the models are in the store and loading them in a background thread
+        Durations of the steps (tensorflow import, model store check, model loading) are in << timer >>,
+        cold start time (from the creation of the loader until the models are ready) in << coldStartSeconds >>
+        Both are appended to << timing_log >> (JSON lines), if given
+        << backend >> and << quantization >> are passed to load_models_from_directory,
+        << offline >> and << require_pinned >> to ensure_models
+        """
+        self.softwarePath = software_path
+        self.offline = offline
+        self.requirePinned = require_pinned
+        self.backend = backend
+        self.quantization = quantization
+        self.timingLog = timing_log
+        self.timer = stageTimer()
+        self.modelsDirectory: str | None = None
+        self.coldStartSeconds: float | None = None
+        self.error: Exception | None = None
+        self.__models = None
+        self.__ready = threading.Event()
+        self.__start = time.perf_counter()
+        self.__thread = threading.Thread(target = self.__load, name = 'model-loader', daemon = True)
+        self.__thread.start()
+
+    def ready(self) -> bool:
+        return self.__ready.is_set()
+
+    def get(self, timeout: float | None = None):
+        """
+        Returns the models (like load_models_from_directory), waiting until they are loaded
+        Raises the error of the loading, if it failed
+        """
+        if not self.__ready.wait(timeout):
+            raise TimeoutError("Models are still loading")
+        if self.error is not None:
+            raise self.error
+        return self.__models
+
+    def __load(self):
+        try:
+            with self.timer.span('models_store'):
+                self.modelsDirectory = ensure_models(self.softwarePath, offline = self.offline, require_pinned = self.requirePinned)
+            if self.backend != BACKEND_TFLITE or importlib.util.find_spec('tflite_runtime') is None:
+                with self.timer.span('tensorflow_import'):
+                    import tensorflow
+            with self.timer.span('models_load'):
+                self.__models = load_models_from_directory(
+                    self.modelsDirectory,
+                    backend = self.backend,
+                    quantization = self.quantization,
+                    software_path = self.softwarePath)
+            self.coldStartSeconds = time.perf_counter() - self.__start
+            print(f"-----> Models loaded, cold start took {self.coldStartSeconds:.1f} s")
+            if self.timingLog is not None:
+                appendTimingRecord(self.timingLog, {
+                    'cold_start': self.coldStartSeconds,
+                    'stages': self.timer.summary()})
+        except Exception as e:
+            self.error = e
+            print(f"-----> Loading of the models failed: {e}")
+        finally:
+            self.__ready.set()
@@ -0,0 +1,44 @@
+"""
+Class that holds the state of the reduction of a single polarization
+Every polarization gets its own instance, so LHC and RHC can be reduced at the same time
+"""
+
+from .stackAccumulator import stackAccumulator
+
+DEFAULT_FIT_BOUNDS_CHANNELS = [
+    [10, 824],
+    [1224, 2872],
+    [3272, 4086]
+]
+
+
+class polarizationContext:
+    def __init__(self, bbc: int = 1, scansCount: int = 0, keepScans: bool = False):
+        '''
+        Initializes the context for BBC << bbc >> of the observation with << scansCount >> merged scans
+        With << keepScans >> residuals of every stacked scan are kept (debug mode)
+        '''
+        self.actualBBC = bbc
+        self.fitBoundsChannels = [list(bounds) for bounds in DEFAULT_FIT_BOUNDS_CHANNELS]
+        self.stack = stackAccumulator(keepScans = keepScans)
+        self.meanStack = []
+        self.finalFitRes = []
+        # -- calibration coefficient applied to finalFitRes (None - not calibrated) and the spectrum before it --
+        self.calibrationCoeff = None
+        self.uncalibratedFitRes = None
+        self.scans_proceed = ['NOT_PROCEEDED'] * scansCount
+
+    @property
+    def scansInStack(self) -> list[int]:
+        return self.stack.scanIndices
+
+    def clear(self):
+        '''
+        Clears stacked data, BBC and fit bounds stay intact
+        '''
+        self.meanStack = []
+        self.stack.clear()
+        self.finalFitRes = []
+        self.calibrationCoeff = None
+        self.uncalibratedFitRes = None
+        self.scans_proceed = ['NOT_PROCEEDED'] * len(self.scans_proceed)
@@ -0,0 +1,25 @@
+"""
+Progress reporters for MultipleDataReductor
+Every reporter is a callable taking fraction complete (0 - 1) and a message
+"""
+
+import sys
+import time
+
+
+class silentProgress:
+    def __call__(self, fraction: float, message: str):
+        pass
+
+
+class terminalProgress:
+    def __init__(self, stream = sys.stderr):
+        '''
+        Logs progress messages to << stream >>, with elapsed time
+        '''
+        self.stream = stream
+        self.start = time.perf_counter()
+
+    def __call__(self, fraction: float, message: str):
+        elapsed = time.perf_counter() - self.start
+        print(f"-----> [{fraction*100.0:5.1f}% | {elapsed:8.1f} s] {message}", file=self.stream, flush=True)
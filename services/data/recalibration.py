@@ -0,0 +1,120 @@
+'''
+Recalibration of already reduced .fits files
+Files reduced with calibration keep their spectra before calibration (UNCALIB extension, unless
+it was turned off) and the coefficients that were applied (CAL_LHC / CAL_RHC, CALTAB, CALTABV, OBS_MJD keys of the data header),
+so applying newer caltabs needs no archive and no models: coefficients of all files
+are found with one caltabIndex query and only files whose coefficients changed are rewritten.
+'''
+
+import os
+import glob
+import numpy as np
+from astropy.io import fits
+from .caltabIndex import caltabIndex, NO_CALTAB
+
+UNCALIBRATED_EXTENSION = 'UNCALIB'
+# -- relative change of the coefficient below which the file is left untouched --
+COEFFICIENT_TOLERANCE = 1e-9
+
+
+class calibrationRecord:
+    def __init__(self, filename: str, header: fits.Header):
+        '''
+        Calibration keys of the data << header >> of the reduced file << filename >>
+        '''
+        self.filename = filename
+        self.calibrated = bool(header['CALIBRAT'])
+        self.mjd = float(header['OBS_MJD'])
+        self.restFrequency = float(header['RESTFRQ']) / 1e6 # MHz
+        self.lhc = float(header['CAL_LHC'])
+        self.rhc = float(header['CAL_RHC'])
+        self.caltab = str(header['CALTAB'])
+        self.version = str(header['CALTABV'])
+
+
+def expandReducedFiles(patterns: list[str]) -> list[str]:
+    '''
+    Expands files, glob patterns and directories (their .fits files) of << patterns >>, without duplicates
+    '''
+    filenames = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '*.fits')))
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        for filename in matches:
+            filename = os.path.abspath(filename)
+            if filename not in filenames:
+                filenames.append(filename)
+    return filenames
+
+
+def readCalibrationRecords(filenames: list[str]) -> tuple[list[calibrationRecord], list[str]]:
+    '''
+    Reads calibration keys of << filenames >>
+    Returns records of the files that can be recalibrated and names of the skipped ones
+    (reduced without calibration, or without the uncalibrated spectra)
+    Files with no caltab for their epoch (CALIBRAT = False) are kept - a newer caltab may cover them
+    '''
+    records = []
+    skipped = []
+    for filename in filenames:
+        try:
+            with fits.open(filename) as hdul:
+                if UNCALIBRATED_EXTENSION not in hdul or 'CALIBRAT' not in hdul[1].header:
+                    skipped.append(filename)
+                    continue
+                record = calibrationRecord(filename, hdul[1].header)
+        except (OSError, KeyError, IndexError) as e:
+            print(f"-----> Cannot read {filename}: {e}")
+            skipped.append(filename)
+            continue
+        records.append(record)
+    return records, skipped
+
+
+def recalibrateFiles(filenames: list[str], index: caltabIndex, version: str = '', dry_run: bool = False) -> dict:
+    '''
+    Applies coefficients of the caltabs of << index >> (<< version >> is stored in the headers)
+    to the uncalibrated spectra of << filenames >>, rewriting only the files whose coefficients changed
+    Returns lists of 'recalibrated', 'unchanged' and 'skipped' filenames
+    '''
+    records, skipped = readCalibrationRecords(filenames)
+    report = {'recalibrated': [], 'unchanged': [], 'skipped': skipped}
+    if len(records) == 0:
+        return report
+    result = index.query([r.mjd for r in records], [r.restFrequency for r in records])
+    for i, record in enumerate(records):
+        label = 'NONE' if result.indices[i] == NO_CALTAB else str(index.caltabs[result.indices[i]].label)
+        changed = label != record.caltab or record.calibrated != (label != 'NONE') or \
+            not np.isclose(result.lhc[i], record.lhc, rtol = COEFFICIENT_TOLERANCE, atol = 0.0) or \
+            not np.isclose(result.rhc[i], record.rhc, rtol = COEFFICIENT_TOLERANCE, atol = 0.0)
+        if not changed:
+            report['unchanged'].append(record.filename)
+            continue
+        if not dry_run:
+            _rewriteFile(record.filename, float(result.lhc[i]), float(result.rhc[i]), label, version)
+        print(f"-----> {os.path.basename(record.filename)}: LHC {record.lhc:.4f} -> {result.lhc[i]:.4f}, "
+              f"RHC {record.rhc:.4f} -> {result.rhc[i]:.4f} ({record.caltab} -> {label})")
+        report['recalibrated'].append(record.filename)
+    return report
+
+
+def _rewriteFile(filename: str, lhc: float, rhc: float, label: str, version: str):
+    '''
+    Overwrites calibrated spectra of << filename >> with its uncalibrated spectra scaled by << lhc >> and << rhc >>
+    The file is marked as calibrated only if the caltab << label >> was found ('NONE' - coefficients are 1.0)
+    '''
+    with fits.open(filename, mode = 'update') as hdul:
+        uncalibrated = hdul[UNCALIBRATED_EXTENSION].data
+        data = hdul[1].data
+        data['Pol 1'][:] = np.asarray(uncalibrated['Pol 1'], dtype = np.float64) * lhc
+        data['Pol 2'][:] = np.asarray(uncalibrated['Pol 2'], dtype = np.float64) * rhc
+        header = hdul[1].header
+        header['CALIBRAT'] = label != 'NONE'
+        header['CAL_LHC'] = lhc
+        header['CAL_RHC'] = rhc
+        header['CALTAB'] = label
+        header['CALTABV'] = version
@@ -0,0 +1,123 @@
+'''
+Content-addressed cache of the reduced .fits files
+The key is built from the archive content, the reduction parameters, the model checksums
+and the caltab version, so the cached result is used only if it would be reduced the same way.
+Entries are evicted in least-recently-used order once the cache grows over its size limit.
+'''
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import platformdirs
+from .modelLoader import file_sha256
+
+# -- bump to invalidate results cached by older versions of the reduction --
+RESULT_CACHE_VERSION = 1
+RESULT_CACHE_SIZE = 2 * 1024**3 # bytes
+
+
+class resultCache:
+    def __init__(self, cache_dir: str | None = None, max_bytes: int = RESULT_CACHE_SIZE):
+        '''
+        << cache_dir >> defaults to the SSDDR cache directory
+        '''
+        if cache_dir is None:
+            cache_dir = os.path.join(platformdirs.user_cache_dir('ssddr'), 'results')
+        self.cacheDirectory = cache_dir
+        self.maxBytes = max_bytes
+        os.makedirs(self.cacheDirectory, exist_ok = True)
+
+    @staticmethod
+    def key(archive_filename: str, parameters: dict, model_checksums: dict, caltab_version: str | None) -> str:
+        '''
+        Returns the cache key of the archive, reduced with << parameters >>
+        '''
+        description = {
+            'version': RESULT_CACHE_VERSION,
+            'archive': file_sha256(archive_filename),
+            'parameters': parameters,
+            'models': model_checksums,
+            'caltabs': caltab_version,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys = True).encode()).hexdigest()
+
+    def get(self, key: str, target_directory: str) -> str | None:
+        '''
+        Copies the cached .fits file to << target_directory >> and returns its name (None if not cached)
+        '''
+        entry = os.path.join(self.cacheDirectory, key)
+        try:
+            fits_names = [f for f in os.listdir(entry) if f.endswith('.fits')]
+        except FileNotFoundError:
+            return None
+        if len(fits_names) != 1:
+            return None
+        target_filename = os.path.join(target_directory, fits_names[0])
+        try:
+            shutil.copyfile(os.path.join(entry, fits_names[0]), target_filename)
+            # -- mark as recently used --
+            os.utime(entry)
+        except FileNotFoundError:
+            return None # evicted in the meantime
+        return target_filename
+
+    def put(self, key: str, fits_filename: str):
+        '''
+        Stores the .fits file under << key >>, then evicts the least recently used entries
+        '''
+        entry = os.path.join(self.cacheDirectory, key)
+        if os.path.exists(entry):
+            return
+        # -- entry becomes visible only when complete --
+        tmp_entry = tempfile.mkdtemp(dir = self.cacheDirectory, prefix = '.tmp_')
+        try:
+            shutil.copyfile(fits_filename, os.path.join(tmp_entry, os.path.basename(fits_filename)))
+            os.replace(tmp_entry, entry)
+        except OSError:
+            # another process stored the same result first
+            shutil.rmtree(tmp_entry, ignore_errors = True)
+        self.evict()
+
+    def size(self) -> int:
+        return sum(entry_size for _, _, entry_size in self.__entries())
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache fits in << maxBytes >>
+        '''
+        entries = sorted(self.__entries(), key = lambda e: e[1])
+        total_size = sum(entry_size for _, _, entry_size in entries)
+        for entry, _, entry_size in entries:
+            if total_size <= self.maxBytes:
+                break
+            shutil.rmtree(entry, ignore_errors = True)
+            total_size -= entry_size
+
+    def clear(self):
+        for entry, _, _ in self.__entries():
+            shutil.rmtree(entry, ignore_errors = True)
+
+    def __entries(self) -> list[tuple[str, float, int]]:
+        '''
+        Returns (directory, last use, size in bytes) of every complete entry
+        '''
+        entries = []
+        for name in os.listdir(self.cacheDirectory):
+            entry = os.path.join(self.cacheDirectory, name)
+            if name.startswith('.tmp_'):
+                # -- leftovers of interrupted writes --
+                try:
+                    if time.time() - os.path.getmtime(entry) > 3600.0:
+                        shutil.rmtree(entry, ignore_errors = True)
+                except OSError:
+                    pass
+                continue
+            try:
+                entry_size = sum(e.stat().st_size for e in os.scandir(entry) if e.is_file())
+                entries.append((entry, os.path.getmtime(entry), entry_size))
+            except OSError:
+                continue
+        return entries
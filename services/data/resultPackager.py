@@ -0,0 +1,65 @@
+"""
+Packs reduced .fits files into a single archive, in process
+Files are added one by one, as soon as they are written
+"""
+
+import os
+import tarfile
+import zipfile
+
+# codec: (archive extension, mime type)
+PACKAGE_CODECS = {
+    "store": (".tar", "application/x-tar"),
+    "gzip": (".tar.gz", "application/gzip"),
+    "bz2": (".tar.bz2", "application/x-bzip2"),
+    "zip": (".zip", "application/zip"),
+}
+DEFAULT_CODEC = "gzip"
+# -- fast compression, .fits files with float spectra do not compress much better anyway --
+DEFAULT_COMPRESSLEVEL = 1
+
+
+class resultPackager:
+    def __init__(self, archive_basename: str, codec: str = DEFAULT_CODEC, compresslevel: int = DEFAULT_COMPRESSLEVEL):
+        """
+        Opens archive << archive_basename >> + extension of the << codec >>
+        :param archive_basename: path of the archive, without extension
+        :param codec: one of "store", "gzip", "bz2" or "zip"
+        :param compresslevel: compression level for gzip, bz2 and zip
+        """
+        if codec not in PACKAGE_CODECS:
+            raise ValueError(f"Unknown codec {codec}, expected one of {', '.join(PACKAGE_CODECS)}")
+        self.codec = codec
+        extension, self.mime = PACKAGE_CODECS[codec]
+        self.filename = archive_basename + extension
+        self.addedFiles: list[str] = []
+        if codec == "zip":
+            self.archive = zipfile.ZipFile(self.filename, "w", compression = zipfile.ZIP_DEFLATED, compresslevel = compresslevel)
+        elif codec == "store":
+            self.archive = tarfile.open(self.filename, "w")
+        elif codec == "gzip":
+            self.archive = tarfile.open(self.filename, "w:gz", compresslevel = compresslevel)
+        else:
+            self.archive = tarfile.open(self.filename, "w:bz2", compresslevel = max(1, compresslevel))
+
+    def add(self, filename: str):
+        """
+        Adds file to the archive, under its base name
+        """
+        if filename is None:
+            return
+        arcname = os.path.basename(filename)
+        if self.codec == "zip":
+            self.archive.write(filename, arcname = arcname)
+        else:
+            self.archive.add(filename, arcname = arcname)
+        self.addedFiles.append(filename)
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,76 @@
+'''
+Frequency and velocity axes of the spectra
+Almost every archive of a source shares the observing setup (vlsr, rest frequencies, bandwidth
+and number of channels), so the axes are computed once per setup and kept in a bounded LRU cache.
+Returned arrays are shared between observations, hence read-only.
+'''
+
+from functools import lru_cache
+import numpy as np
+
+SPEED_OF_LIGHT = 299792.458 # km/s
+AXES_CACHE_SIZE = 64 # setups
+AXES_ROWS = 4 # BBCs
+
+
+def _setupKey(values) -> tuple[float, ...]:
+    return tuple(float(v) for v in np.atleast_1d(np.asarray(values, dtype = np.float64)))
+
+
+def _readOnly(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+def dopplerShiftedBand(vlsr, rest_mhz, freq_range):
+    '''
+    Returns observed central frequency, beginning and end of the band [MHz]
+    for source velocity << vlsr >> [km/s], << rest_mhz >> and bandwidth << freq_range >> [MHz]
+    Works on scalars and on arrays (one entry per BBC)
+    '''
+    beta = np.asarray(vlsr, dtype = np.float64) / SPEED_OF_LIGHT
+    gamma = 1.0 / np.sqrt(1.0 - beta**2.0)
+    fcentr = np.asarray(rest_mhz, dtype = np.float64) * (gamma * (1.0 - beta))
+    fbegin = fcentr - np.asarray(freq_range, dtype = np.float64) / 2.0
+    fend = fcentr + np.asarray(freq_range, dtype = np.float64) / 2.0
+    return fcentr, fbegin, fend
+
+
+@lru_cache(maxsize = AXES_CACHE_SIZE)
+def _headerBand(vlsr: float, rest_mhz: float, freq_range: float) -> tuple[float, float, float]:
+    fcentr, fbegin, fend = dopplerShiftedBand(vlsr, rest_mhz, freq_range)
+    return float(fcentr), float(fbegin), float(fend)
+
+
+def headerBand(vlsr, rest_mhz, freq_range) -> tuple[float, float, float]:
+    '''
+    Cached dopplerShiftedBand of a single BBC, as floats for the FITS header
+    '''
+    return _headerBand(float(vlsr), float(rest_mhz), float(freq_range))
+
+
+@lru_cache(maxsize = AXES_CACHE_SIZE)
+def _axes(vlsr: tuple, rest_mhz: tuple, freq_range: tuple, nchans: int) -> tuple[np.ndarray, np.ndarray]:
+    _, fbegin, fend = dopplerShiftedBand(vlsr, rest_mhz, freq_range)
+    rows = min(len(fbegin), AXES_ROWS)
+    fbegin, fend = fbegin[:rows], fend[:rows]
+    rest = np.broadcast_to(np.asarray(rest_mhz, dtype = np.float64), fbegin.shape)
+    freqs = np.zeros((AXES_ROWS, nchans), dtype = np.float64)
+    vels = np.zeros((AXES_ROWS, nchans), dtype = np.float64)
+    freqs[:rows] = np.linspace(fbegin, fend, nchans, axis = -1)
+    vels[:rows] = (- SPEED_OF_LIGHT * ((freqs[:rows] / rest[:, np.newaxis]) - 1.0))[:, ::-1]
+    return _readOnly(freqs), _readOnly(vels)
+
+
+def spectralAxes(vlsr, rest_mhz, freq_range, nchans) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns read-only (4, << nchans >>) frequency [MHz] and velocity [km/s] tables,
+    one row per BBC (velocities are in reversed channel order, like the spectra)
+    Repeated setups are served from the cache
+    '''
+    return _axes(_setupKey(vlsr), _setupKey(rest_mhz), _setupKey(freq_range), int(nchans))
+
+
+def clearAxesCache():
+    _axes.cache_clear()
+    _headerBand.cache_clear()
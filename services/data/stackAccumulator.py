@@ -0,0 +1,113 @@
+"""
+Streaming stack of the scan residuals
+Keeps a running (weighted) sum of the residuals instead of the residuals themselves,
+so adding and removing a scan costs O(n_channels) and the mean needs no re-stacking.
+Residuals of every scan are kept only on request (keepScans, when scans are removed or debugged) -
+otherwise residuals of the removed scan have to be given
+"""
+
+import numpy as np
+
+
+class stackAccumulator:
+    def __init__(self, keepScans: bool = False):
+        '''
+        With << keepScans >> residuals of every stacked scan are kept as well (debug mode)
+        '''
+        self.keepScans = keepScans
+        self.sum: np.ndarray | None = None
+        self.weightSum = 0.0
+        self.weights: dict[int, float] = {} # scan index -> weight, in stacking order
+        self.scans: dict[int, np.ndarray] = {} # scan index -> residuals, only with keepScans
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def __contains__(self, scanIndex: int) -> bool:
+        return scanIndex in self.weights
+
+    @property
+    def scanIndices(self) -> list[int]:
+        '''
+        Indices of the stacked scans, in stacking order
+        '''
+        return list(self.weights.keys())
+
+    def add(self, scanIndex: int, residuals: np.ndarray, weight: float = 1.0):
+        '''
+        Adds residuals of scan << scanIndex >> to the stack
+        '''
+        if scanIndex in self.weights:
+            raise ValueError(f"Scan {scanIndex} is already stacked")
+        residuals = np.asarray(residuals, dtype=np.float64)
+        if self.sum is None:
+            self.sum = np.zeros(residuals.shape, dtype=np.float64)
+        elif residuals.shape != self.sum.shape:
+            raise ValueError(f"Residuals of shape {residuals.shape} cannot be stacked with {self.sum.shape}")
+        self.sum += weight * residuals
+        self.weightSum += weight
+        self.weights[scanIndex] = float(weight)
+        if self.keepScans:
+            self.scans[scanIndex] = residuals.copy()
+
+    def addMany(self, scanIndices: list[int], residuals: np.ndarray, weights: np.ndarray | None = None):
+        '''
+        Adds (n_scans, n_channels) << residuals >> of << scanIndices >> with one reduction
+        '''
+        residuals = np.asarray(residuals, dtype=np.float64)
+        if len(scanIndices) == 0:
+            return
+        if weights is None:
+            weights = np.ones(len(scanIndices), dtype=np.float64)
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(set(scanIndices)) < len(scanIndices) or any(i in self.weights for i in scanIndices):
+            raise ValueError("Scan cannot be stacked twice")
+        if self.sum is None:
+            self.sum = np.zeros(residuals.shape[1:], dtype=np.float64)
+        elif residuals.shape[1:] != self.sum.shape:
+            raise ValueError(f"Residuals of shape {residuals.shape[1:]} cannot be stacked with {self.sum.shape}")
+        self.sum += weights @ residuals
+        self.weightSum += float(weights.sum())
+        for scanIndex, weight, scan_residuals in zip(scanIndices, weights, residuals):
+            self.weights[scanIndex] = float(weight)
+            if self.keepScans:
+                self.scans[scanIndex] = scan_residuals.copy()
+
+    def remove(self, scanIndex: int, residuals: np.ndarray | None = None):
+        '''
+        Removes scan << scanIndex >> from the stack
+        Residuals of the scan have to be given, unless they are kept (debug mode)
+        '''
+        if scanIndex not in self.weights:
+            raise KeyError(f"Scan {scanIndex} is not stacked")
+        if residuals is None:
+            if scanIndex not in self.scans:
+                raise ValueError(f"Residuals of scan {scanIndex} are not kept, they have to be given")
+            residuals = self.scans[scanIndex]
+        residuals = np.asarray(residuals, dtype=np.float64)
+        if residuals.shape != self.sum.shape:
+            raise ValueError(f"Residuals of shape {residuals.shape} cannot be removed from {self.sum.shape}")
+        weight = self.weights.pop(scanIndex)
+        self.scans.pop(scanIndex, None)
+        if len(self.weights) == 0:
+            # start from exact zeros, rather than from the rounding errors of the subtractions
+            self.sum[:] = 0.0
+            self.weightSum = 0.0
+        else:
+            self.sum -= weight * residuals
+            self.weightSum -= weight
+
+    def mean(self) -> np.ndarray | None:
+        '''
+        Returns the weighted mean of the stacked residuals (None if the stack is empty)
+        Every call returns a new array, so it can be scaled in place (e.g. by calibrate)
+        '''
+        if len(self.weights) == 0:
+            return None
+        return self.sum / self.weightSum
+
+    def clear(self):
+        self.sum = None
+        self.weightSum = 0.0
+        self.weights = {}
+        self.scans = {}
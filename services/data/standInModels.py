@@ -0,0 +1,70 @@
+"""
+Small stand-in models for benchmarks, built offline
+They take the same inputs and return outputs of the same shape as the real models,
+but their labels come from simple thresholds instead of training:
+- channel annotators label channels above << rfi_threshold >> as RFI (category 2), the rest as baseline (category 0)
+- broken scans detector flags scans with any channel above << broken_threshold >>
+"""
+
+import os
+from typing import TYPE_CHECKING
+import numpy as np
+# -- tensorflow is imported only when the models are built --
+if TYPE_CHECKING:
+    from tensorflow import keras
+
+STAND_IN_VERSION = '00'
+RFI_THRESHOLD = 20.0
+BROKEN_THRESHOLD = 150.0
+
+
+def buildChannelAnnotator(rfi_threshold: float = RFI_THRESHOLD) -> "keras.Model":
+    '''
+    (n_scans, n_channels, 1) -> (n_scans, n_channels, 4) channel category probabilities
+    '''
+    from tensorflow import keras
+    inputs = keras.Input(shape = (None, 1))
+    logits_layer = keras.layers.Conv1D(4, kernel_size = 1)
+    outputs = keras.layers.Softmax()(logits_layer(inputs))
+    model = keras.Model(inputs, outputs)
+    # category 0: 0, category 2: x - threshold, categories 1 and 3 never win
+    kernel = np.array([[[0.0, 0.0, 1.0, 0.0]]], dtype = np.float32)
+    bias = np.array([0.0, -1e3, -rfi_threshold, -1e3], dtype = np.float32)
+    logits_layer.set_weights([kernel, bias])
+    return model
+
+
+def buildBrokenScansDetector(broken_threshold: float = BROKEN_THRESHOLD) -> "keras.Model":
+    '''
+    (n_scans, n_channels, 1) -> (n_scans, 2) probabilities of [ok, broken]
+    '''
+    from tensorflow import keras
+    inputs = keras.Input(shape = (None, 1))
+    logits_layer = keras.layers.Conv1D(2, kernel_size = 1)
+    logits = keras.layers.GlobalMaxPooling1D()(logits_layer(inputs))
+    outputs = keras.layers.Softmax()(logits)
+    model = keras.Model(inputs, outputs)
+    kernel = np.array([[[0.0, 1.0]]], dtype = np.float32)
+    bias = np.array([0.0, -broken_threshold], dtype = np.float32)
+    logits_layer.set_weights([kernel, bias])
+    return model
+
+
+def buildStandInModels():
+    '''
+    Returns scan annotator, broken scans detector and final scan annotator, like load_models_from_directory
+    '''
+    return buildChannelAnnotator(), buildBrokenScansDetector(), buildChannelAnnotator()
+
+
+def saveStandInModels(models_directory: str) -> str:
+    '''
+    Saves stand-in models under the names load_models_from_directory looks for
+    Returns << models_directory >>
+    '''
+    os.makedirs(models_directory, exist_ok = True)
+    scan_annotator, broken_scans_detector, final_scan_annotator = buildStandInModels()
+    scan_annotator.save(os.path.join(models_directory, f"{STAND_IN_VERSION}_single_scan_annotator.keras"))
+    broken_scans_detector.save(os.path.join(models_directory, f"{STAND_IN_VERSION}_broken_scans.keras"))
+    final_scan_annotator.save(os.path.join(models_directory, f"{STAND_IN_VERSION}_final_scan_annotator.keras"))
+    return models_directory
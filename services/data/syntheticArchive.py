@@ -0,0 +1,179 @@
+"""
+Synthetic archives for benchmarks
+Writes .tar.bz2 archives with a controllable number of scans and channels, RFI and broken scans,
+and reads them back with syntheticScanSet - a stand-in for ncu_salsa_rt4.ScanSet, that exposes
+the attributes dataContainter uses. The layout of the archive is our own (header.json + one .npy
+per scan), real RT4 archives are parsed by ncu_salsa_rt4 only.
+"""
+
+import io
+import json
+import tarfile
+import numpy as np
+from astropy.time import Time
+
+HEADER_MEMBER = 'header.json'
+NO_OF_BBC = 4
+SCAN_DURATION = 60.0 / 86400.0 # days
+REST_FREQUENCIES = [6668.519, 6668.519, 6668.519, 6668.519] # MHz
+
+
+def writeSyntheticArchive(
+        filename: str,
+        scans: int = 20,
+        channels: int = 4096,
+        rfi_rate: float = 0.2,
+        broken_rate: float = 0.05,
+        onOff: bool = False,
+        seed: int = 0,
+        sourcename: str = 'synthetic',
+        startMJD: float = 60000.0) -> str:
+    '''
+    Writes synthetic archive with << scans >> scans of << channels >> channels in every BBC
+    << rfi_rate >> - fraction of the scans with RFI spikes
+    << broken_rate >> - fraction of the broken scans (strong baseline jumps)
+    Returns << filename >>
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1.0, 1.0, channels)
+    line_width = max(channels / 800.0, 2.0)
+    # -- maser lines are the same in every scan --
+    if onOff:
+        line_centres = [channels * 0.5]
+        line_signs = [1.0]
+    else:
+        # frequency switch - the line appears in both halves, with the opposite signs
+        line_centres = [channels * 0.25, channels * 0.75]
+        line_signs = [1.0, -1.0]
+    lines = np.zeros(channels)
+    channel_numbers = np.arange(channels)
+    for centre, sign in zip(line_centres, line_signs):
+        lines += sign * 10.0 * np.exp(-0.5 * ((channel_numbers - centre) / line_width)**2)
+
+    header = {
+        'sourcename': sourcename,
+        'onOff': onOff,
+        'NNch': channels,
+        'rest': REST_FREQUENCIES,
+        'vlsr': [-5.0] * NO_OF_BBC,
+        'bw': [2.0] * NO_OF_BBC,
+        'ra': [20, 38, 36],
+        'dec': [42, 37, 35],
+        'scans': [],
+    }
+    with tarfile.open(filename, 'w:bz2') as archive:
+        for scanIndex in range(scans):
+            coefficients = rng.normal(0.0, 2.0, size = (NO_OF_BBC, 6))
+            pols = np.polynomial.chebyshev.chebval(x, coefficients.T) # (n_bbc, n_channels)
+            pols += rng.normal(0.0, 1.0, size = (NO_OF_BBC, channels))
+            pols += lines
+            if rng.random() < rfi_rate:
+                for _ in range(rng.integers(1, 6)):
+                    start = rng.integers(0, channels - 4)
+                    pols[:, start:start + rng.integers(1, 4)] += rng.uniform(50.0, 200.0)
+            if rng.random() < broken_rate:
+                pols[:, rng.integers(channels // 4, 3 * channels // 4):] += rng.uniform(400.0, 800.0)
+            mjd = startMJD + scanIndex * SCAN_DURATION
+            header['scans'].append({
+                'mjd': mjd,
+                'EL': float(rng.uniform(30.0, 60.0)),
+                'AZ': float(rng.uniform(0.0, 360.0)),
+                'tsys': [float(t) for t in rng.uniform(25000.0, 35000.0, size = NO_OF_BBC)],
+            })
+            _addMember(archive, f"scan_{scanIndex:04d}.npy", _npyBytes(pols.astype(np.float32)))
+        _addMember(archive, HEADER_MEMBER, json.dumps(header).encode())
+    return filename
+
+
+def _npyBytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def _addMember(archive: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+class syntheticScan:
+    def __init__(self, header: dict, scan: dict, pols: np.ndarray):
+        self.sourcename = header['sourcename']
+        self.NNch = header['NNch']
+        self.rest = np.asarray(header['rest'], dtype = np.float64)
+        self.vlsr = np.asarray(header['vlsr'], dtype = np.float64)
+        self.bw = np.asarray(header['bw'], dtype = np.float64)
+        self.rah, self.ram, self.ras = header['ra']
+        self.decd, self.decm, self.decs = header['dec']
+        self.mjd = scan['mjd']
+        self.EL = scan['EL']
+        self.AZ = scan['AZ']
+        self.tsys = np.asarray(scan['tsys'], dtype = np.float64)
+        self.isotime = Time(self.mjd, format = 'mjd').isot
+        self.pols = pols
+
+
+class syntheticMergedScan:
+    def __init__(self, scans: list[syntheticScan]):
+        '''
+        Merges << scans >> into one, by averaging
+        '''
+        self.mjd = float(np.mean([scan.mjd for scan in scans]))
+        self.pols = np.mean([scan.pols for scan in scans], axis = 0).astype(np.float64)
+        self.__originalPols = self.pols.copy()
+
+    def remove_channels(self, bbc: int, removeTab: list):
+        '''
+        Replaces [start, end] (end inclusive) channel ranges of << bbc >> with linear interpolation
+        '''
+        data = self.pols[bbc-1]
+        for start, end in removeTab:
+            left = max(start - 1, 0)
+            right = min(end + 1, len(data) - 1)
+            data[start:end+1] = np.interp(np.arange(start, end + 1), [left, right], [data[left], data[right]])
+
+    def removeChannels(self, bbc: int, removeTab: list):
+        self.remove_channels(bbc, removeTab)
+
+    def cancelRemove(self, bbc: int):
+        self.pols[bbc-1] = self.__originalPols[bbc-1].copy()
+
+    def fit_cheby(self, bbc: int, order: int, fitBoundsChannels: list):
+        '''
+        Fits Chebyshev polynomial through channels in << fitBoundsChannels >> ([start, end] runs, end inclusive)
+        Returns channel numbers, the polynomial and the fit residuals
+        Channels are gathered range by range and fitted with numpy, independently of baselineFit,
+        so the batched fit (fitChebyForScans) is compared with a different implementation
+        '''
+        data = self.pols[bbc-1]
+        channels = np.arange(len(data))
+        fitChans = []
+        fitData = []
+        for start, end in fitBoundsChannels:
+            fitChans.extend(channels[start:end+1])
+            fitData.extend(data[start:end+1])
+        poly = np.polynomial.chebyshev.Chebyshev.fit(fitChans, fitData, order, domain = [0, len(data) - 1])
+        polyTabY = poly(channels)
+        return channels, polyTabY, data - polyTabY
+
+
+class syntheticScanSet:
+    def __init__(self, filename: str, onOff: bool = False, debug: bool = False):
+        '''
+        Reads archive written by writeSyntheticArchive, pairs of scans are merged
+        '''
+        with tarfile.open(filename, 'r') as archive:
+            header = json.loads(archive.extractfile(HEADER_MEMBER).read())
+            scan_members = sorted(name for name in archive.getnames() if name.endswith('.npy'))
+            self.scans = [
+                syntheticScan(header, scan, np.load(io.BytesIO(archive.extractfile(name).read())))
+                for scan, name in zip(header['scans'], scan_members)
+            ]
+        if debug:
+            print(f"-----> Loaded {len(self.scans)} synthetic scans from \"{filename}\"")
+        self.mergedScans = [
+            syntheticMergedScan(self.scans[i:i+2])
+            for i in range(0, len(self.scans) - 1, 2)
+        ]
+        self.mjd = float(np.mean([scan.mjd for scan in self.scans]))
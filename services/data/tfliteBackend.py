@@ -0,0 +1,160 @@
+"""
+TFLite inference backend
+Keras models are exported once to .tflite files (optionally quantized) and run with the TFLite
+interpreter - tflite_runtime if it is installed, tf.lite otherwise. Exported files are kept in
+the model store, next to the .keras files, and re-exported only when the .keras file changes.
+"""
+
+import os
+import glob
+import tempfile
+import threading
+import numpy as np
+
+BACKEND_KERAS = 'keras'
+BACKEND_TFLITE = 'tflite'
+INFERENCE_BACKENDS = (BACKEND_KERAS, BACKEND_TFLITE)
+
+QUANTIZATION_NONE = 'none'
+QUANTIZATION_FLOAT16 = 'float16'
+QUANTIZATION_DYNAMIC = 'dynamic' # int8 weights, float activations
+# -- full int8 quantization is not offered: it needs calibration on real preprocessed spectra --
+QUANTIZATIONS = (QUANTIZATION_NONE, QUANTIZATION_FLOAT16, QUANTIZATION_DYNAMIC)
+
+TFLITE_DIRECTORY = 'tflite'
+
+# -- suffixes of the models, in the order returned by load_models_from_directory --
+MODEL_SUFFIXES = ('single_scan_annotator', 'broken_scans', 'final_scan_annotator')
+
+
+def _interpreterClass():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class tfliteModel:
+    def __init__(self, filename: str, num_threads: int | None = None):
+        '''
+        Runs .tflite model with the Keras-like predict() used by dataContainter
+        '''
+        self.filename = filename
+        self.interpreter = _interpreterClass()(model_path = filename, num_threads = num_threads)
+        self.interpreter.allocate_tensors()
+        self.__inputIndex = self.interpreter.get_input_details()[0]['index']
+        self.__outputIndex = self.interpreter.get_output_details()[0]['index']
+        self.__inputShape = None
+        # interpreter is not thread-safe, and jobs run in parallel threads
+        self.__lock = threading.Lock()
+
+    def predict(self, data: np.ndarray, verbose = 0) -> np.ndarray:
+        '''
+        Runs the whole << data >> batch through the model at once
+        '''
+        data = np.ascontiguousarray(data, dtype = np.float32)
+        with self.__lock:
+            if self.__inputShape != data.shape:
+                self.interpreter.resize_tensor_input(self.__inputIndex, data.shape)
+                self.interpreter.allocate_tensors()
+                self.__inputShape = data.shape
+            self.interpreter.set_tensor(self.__inputIndex, data)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.__outputIndex).copy()
+
+
+def exportTFLite(model, filename: str, quantization: str = QUANTIZATION_NONE) -> str:
+    '''
+    Converts Keras << model >> to << filename >>, with optional << quantization >>
+    File is written to a unique temporary file first, so concurrent exports never mix
+    Returns << filename >>
+    '''
+    import tensorflow as tf
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization}, choose one of {QUANTIZATIONS}")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != QUANTIZATION_NONE:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == QUANTIZATION_FLOAT16:
+        converter.target_spec.supported_types = [tf.float16]
+    tflite_model = converter.convert()
+    fd, tmp_filename = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(filename)), suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(tflite_model)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return filename
+
+
+def tfliteDirectory(models_directory: str, quantization: str = QUANTIZATION_NONE) -> str:
+    return os.path.join(models_directory, TFLITE_DIRECTORY, quantization)
+
+
+def exportModelsDirectory(
+        models_directory: str,
+        quantization: str = QUANTIZATION_NONE,
+        force: bool = False,
+        keras_filenames: list[str] | None = None) -> list[str]:
+    '''
+    Exports .keras models of << models_directory >> to .tflite files, skipping up-to-date ones
+    << keras_filenames >> - models to export, in the order of load_models_from_directory
+    (default: the last matching .keras file of every model)
+    Returns names of the .tflite files, in the same order
+    '''
+    export_directory = tfliteDirectory(models_directory, quantization)
+    os.makedirs(export_directory, exist_ok = True)
+    if keras_filenames is None:
+        keras_filenames = [sorted(glob.glob(os.path.join(models_directory, f"*_{suffix}.keras")))[-1] for suffix in MODEL_SUFFIXES]
+    tflite_filenames = []
+    for keras_filename in keras_filenames:
+        tflite_filename = os.path.join(
+            export_directory,
+            os.path.splitext(os.path.basename(keras_filename))[0] + '.tflite')
+        if force or not os.path.exists(tflite_filename) or \
+                os.path.getmtime(tflite_filename) < os.path.getmtime(keras_filename):
+            from tensorflow import keras
+            print(f"-----> Exporting {os.path.basename(keras_filename)} to TFLite ({quantization})...")
+            exportTFLite(keras.models.load_model(keras_filename, compile = False), tflite_filename, quantization)
+        tflite_filenames.append(tflite_filename)
+    return tflite_filenames
+
+
+def load_tflite_models(
+        models_directory: str,
+        quantization: str = QUANTIZATION_NONE,
+        num_threads: int | None = None,
+        keras_filenames: list[str] | None = None):
+    '''
+    Returns TFLite versions of scan annotator, broken scans detector and final scan annotator
+    '''
+    return tuple(
+        tfliteModel(filename, num_threads = num_threads)
+        for filename in exportModelsDirectory(models_directory, quantization, keras_filenames = keras_filenames))
+
+
+def compareBackends(reference_models, tested_models, data: np.ndarray, final_data: np.ndarray | None = None) -> dict:
+    '''
+    Runs (n_scans, n_channels) << data >> through both sets of models
+    (<< final_data >> through the final scan annotators, << data >> if not given)
+    Returns fraction of the channel labels (both annotators) and broken scan decisions that agree,
+    and the largest absolute difference of the output probabilities
+    '''
+    if final_data is None:
+        final_data = data
+    report = {}
+    for name, reference, tested, model_data in zip(
+            MODEL_SUFFIXES, reference_models, tested_models, (data, data, final_data)):
+        model_data = np.asarray(model_data, dtype = np.float32)
+        batch = model_data.reshape(model_data.shape[0], model_data.shape[1], 1)
+        reference_output = np.asarray(reference.predict(batch, verbose = 0))
+        tested_output = np.asarray(tested.predict(batch, verbose = 0))
+        report[name] = {
+            'agreement': float(np.mean(np.argmax(reference_output, axis = -1) == np.argmax(tested_output, axis = -1))),
+            'max_abs_diff': float(np.max(np.abs(reference_output - tested_output))),
+        }
+    return report
@@ -0,0 +1,90 @@
+'''
+Lightweight timing of the reduction stages
+Stages are wrapped in named spans, their durations are summed per stage.
+Disabled timer hands out one shared no-op span, so instrumented code costs next to nothing.
+'''
+
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+# -- names of the instrumented stages --
+STAGE_LOAD = 'load_archive'
+STAGE_OUTLIERS = 'isolation_forest'
+STAGE_BROKEN_SCANS = 'broken_scan_detector'
+STAGE_ANNOTATOR = 'annotator'
+STAGE_FINAL_ANNOTATOR = 'final_annotator'
+STAGE_BASELINE_FIT = 'baseline_fit'
+STAGE_CALIBRATION = 'calibration'
+STAGE_FITS_WRITE = 'fits_write'
+STAGE_ARCHIVE = 'archive_total'
+
+_NULL_SPAN = nullcontext()
+
+
+class _span:
+    def __init__(self, timer, name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timer.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class stageTimer:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages: dict[str, list] = {} # name -> [count, total seconds]
+        self.__lock = threading.Lock()
+
+    def span(self, name: str):
+        '''
+        Context manager, that adds the time spent inside to the stage << name >>
+        '''
+        if not self.enabled:
+            return _NULL_SPAN
+        return _span(self, name)
+
+    def record(self, name: str, seconds: float, count: int = 1):
+        with self.__lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += count
+            stage[1] += seconds
+
+    def summary(self) -> dict:
+        '''
+        Returns {stage: {"count": n, "seconds": total}}
+        '''
+        with self.__lock:
+            return {name: {'count': count, 'seconds': seconds} for name, (count, seconds) in self.stages.items()}
+
+    def merge(self, summary: dict):
+        '''
+        Adds << summary >> of another timer (e.g. from a worker process)
+        '''
+        for name, stage in summary.items():
+            self.record(name, stage['seconds'], stage['count'])
+
+
+# -- shared timer of the code that is not timed --
+NULL_TIMER = stageTimer(enabled = False)
+
+
+def appendTimingRecord(log_filename: str, record: dict):
+    '''
+    Appends << record >> as one line of the JSON-lines log
+    '''
+    record = dict(record, time = time.time())
+    with open(log_filename, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def readTimingLog(log_filename: str) -> list[dict]:
+    with open(log_filename, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -1,80 +1,85 @@
 import os
+import shutil
 import streamlit as st
 from data.dataReductorMultipleFiles import MultipleDataReductor
+from data.modelLoader import backgroundModelLoader, model_store_directory
+from data.tfliteBackend import BACKEND_KERAS, QUANTIZATION_NONE
+from data.inferenceServer import inferenceServer
+from data.resultPackager import resultPackager, PACKAGE_CODECS, DEFAULT_CODEC
+from data.jobQueue import jobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from data.resultCache import resultCache
+from data.fitsBundle import writeFitsBundle
+from data.timing import readTimingLog
 from datetime import datetime
-import glob
-import tensorflow as tf
-from tensorflow import keras
-import requests
 DE_CAT = os.path.dirname(os.path.abspath(__file__))
+# -- with REDUCTOR_OFFLINE_MODELS=1 models are loaded from the local store only --
+OFFLINE_MODELS = os.environ.get("REDUCTOR_OFFLINE_MODELS", "0") == "1"
+# -- with REDUCTOR_REQUIRE_PINNED_MODELS=1 models without a pinned sha256 in modelPaths.ini are refused --
+REQUIRE_PINNED_MODELS = os.environ.get("REDUCTOR_REQUIRE_PINNED_MODELS", "0") == "1"
+# -- inference backend ("keras" or "tflite") and TFLite quantization ("none", "float16", "dynamic") --
+INFERENCE_BACKEND = os.environ.get("REDUCTOR_INFERENCE_BACKEND", BACKEND_KERAS)
+QUANTIZATION = os.environ.get("REDUCTOR_QUANTIZATION", QUANTIZATION_NONE)
+# -- uploaded archives are copied to the disk in chunks of this size --
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# -- number of reduction jobs executed at the same time, shared by all sessions --
+JOB_WORKERS = int(os.environ.get("REDUCTOR_JOB_WORKERS", "2"))
+# -- how often the job status is refreshed, in seconds --
+JOB_POLL_INTERVAL = 2.0
+# -- size limit of the cache of reduced files, in MB (0 disables the cache) --
+RESULT_CACHE_MB = int(os.environ.get("REDUCTOR_RESULT_CACHE_MB", "2048"))
+# -- with REDUCTOR_TIMING=1 durations of the reduction stages are shown with every job --
+TIMING = os.environ.get("REDUCTOR_TIMING", "0") == "1"
+TIMING_LOG_FILENAME = "timings.jsonl"
+# -- cold start of the models is appended to this JSON-lines file, if set --
+STARTUP_TIMING_LOG = os.environ.get("REDUCTOR_STARTUP_LOG")
+# -- predictions of concurrent jobs are merged into batches of at most this many spectra,
+# waiting at most this long (in milliseconds) for more requests --
+MAX_BATCH_SIZE = int(os.environ.get("REDUCTOR_MAX_BATCH_SIZE", "256"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("REDUCTOR_MAX_BATCH_WAIT_MS", "5"))
+# -- a prediction (including loading of the models on the first one) fails after this many seconds --
+INFERENCE_TIMEOUT = float(os.environ.get("REDUCTOR_INFERENCE_TIMEOUT", "600"))
+# -- results up to this size (in MB) are kept in memory for the download, larger ones are read from the disk --
+RESULT_MEMORY_CACHE_MB = float(os.environ.get("REDUCTOR_RESULT_MEMORY_CACHE_MB", "16"))
 
 
-def weighted_categorical_crossentropy(weights):
-    """
-    TLDR: this function definition is required for proper loading of tensorflow models
-    Creates a weighted categorical crossentropy loss function.
-    Args:
-        weights (dict or list): A list where indices correspond to class labels and values are weights.
-    Returns:
-        A loss function to be used in model compilation.
-    """
-
-    def loss(y_true, y_pred):
-        y_pred = tf.clip_by_value(y_pred, 1e-7, 1 - 1e-7)  # Prevent log(0)
-        y_true = tf.cast(y_true, tf.float32)
-
-        # Compute per-class weights
-        weights_per_sample = tf.reduce_sum(y_true * weights, axis=-1)
-
-        # Compute weighted loss
-        loss = -tf.reduce_sum(y_true * tf.math.log(y_pred), axis=-1) * weights_per_sample
-
-        return tf.reduce_mean(loss)
-
-    return loss
+@st.cache_resource
+def get_model_loader():
+    # models are checked in the local store (downloaded only if missing or corrupted)
+    # and loaded in the background, the page renders in the meantime
+    return backgroundModelLoader(
+        DE_CAT,
+        offline = OFFLINE_MODELS,
+        require_pinned = REQUIRE_PINNED_MODELS,
+        timing_log = STARTUP_TIMING_LOG,
+        backend = INFERENCE_BACKEND,
+        quantization = QUANTIZATION)
 
+@st.cache_resource
+def get_inference_server():
+    # the only owner of the models - every session and job predicts through it
+    return inferenceServer(
+        get_model_loader().get,
+        max_batch_size = MAX_BATCH_SIZE,
+        max_wait = MAX_BATCH_WAIT_MS / 1000.0,
+        request_timeout = INFERENCE_TIMEOUT)
 
-def download_file_requests_basic(url, local_filename):
-    """
-    Downloads a file from a URL using requests.get() and saves it to a local file.
-    Suitable for smaller files.
-    """
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
+@st.cache_resource
+def get_job_queue():
+    # one queue for all of the sessions
+    return jobQueue(max_workers = JOB_WORKERS)
 
-        with open(local_filename, 'wb') as f:
-            f.write(response.content)
-    except:
-        pass
+@st.cache_resource(max_entries = 8)
+def read_result_file(filename: str, mtime: float) -> bytes:
+    # small results are read once, not on every refresh of the job status
+    with open(filename, "rb") as f:
+        return f.read()
 
 @st.cache_resource
-def load_models():
-    # create directories
-    os.makedirs(os.path.join(DE_CAT, 'models'), exist_ok = True)
-    # downlad models
-    scan_annotator_address = "https://box.pionier.net.pl/f/2093ab41430447d8a0a2/?dl=1"
-    broken_scan_address = "https://box.pionier.net.pl/f/c7a1bb1e492e4197b70e/?dl=1"
-    final_scan_annotator_address = "https://box.pionier.net.pl/f/ab881a6e6c90425486d0/?dl=1"
-    download_file_requests_basic(scan_annotator_address, os.path.join(DE_CAT, "models", "01_single_scan_annotator.keras"))
-    download_file_requests_basic(broken_scan_address, os.path.join(DE_CAT, "models", "01_broken_scans.keras"))
-    download_file_requests_basic(final_scan_annotator_address, os.path.join(DE_CAT, "models", "01_final_scan_annotator.keras"))
-    # load models from a drive
-    filename_scan_annotator = glob.glob(os.path.join(DE_CAT, "models", "*single_scan_annotator.keras"))[-1]
-    filename_broken_scans_detector = glob.glob(os.path.join(DE_CAT, "models", "*_broken_scans.keras"))[-1]
-    filename_final_scan_annotator = glob.glob(os.path.join(DE_CAT, "models", "*_final_scan_annotator.keras"))[-1]
-
-    # load models using KERAS
-    scan_annotator_model = keras.models.load_model(
-        filename_scan_annotator,
-        custom_objects = {'loss': weighted_categorical_crossentropy})
-    broken_scans_detector_model = keras.models.load_model(
-        filename_broken_scans_detector)
-    final_scan_annotator_model = keras.models.load_model(
-        filename_final_scan_annotator,
-        custom_objects={"loss": weighted_categorical_crossentropy}
-    )
-    return scan_annotator_model, broken_scans_detector_model, final_scan_annotator_model
+def get_result_cache():
+    # one cache for all of the sessions
+    if RESULT_CACHE_MB <= 0:
+        return None
+    return resultCache(max_bytes = RESULT_CACHE_MB * 1024**2)
 
 def generate_timestamp_dirname():
     """
@@ -84,6 +89,15 @@ def generate_timestamp_dirname():
     timestamp_str = now.strftime("%Y%m%d_%H%M%S_%f")
     return f"{timestamp_str}_data"
 
+def saveUploadedFile(uploadedFile, fileSavePath: str):
+    """
+    Copies uploaded file to the disk in fixed-size chunks,
+    without materializing another in-memory copy of the whole archive
+    """
+    uploadedFile.seek(0)
+    with open(fileSavePath, "wb") as f:
+        shutil.copyfileobj(uploadedFile, f, UPLOAD_CHUNK_SIZE)
+
 def displayMessageOnLoad(uploaded_files, use_caltab, is_onoff):
     if uploaded_files is not None:
         st.write(f"You have uploaded {len(uploaded_files)} files")
@@ -96,16 +110,11 @@ def displayMessageOnLoad(uploaded_files, use_caltab, is_onoff):
     else:
         st.write(f"Reduction using frequency-switch technique")
 
-def processUploadedFiles(
-        uploadedFiles: list,
-        isOnOff: bool,
-        isCal: bool,
-        BBCLHC: int,
-        BBCRHC: int,
-        annotator_model: tf.keras.models.Model,
-        broken_scan_model: tf.keras.models.Model,
-        final_scan_annotator_model: tf.keras.models.Model):
-    # -- prepare data --
+def saveUploadedFiles(uploadedFiles: list):
+    """
+    Saves uploaded files to a fresh temporary directory
+    Returns the directory and the list of saved files
+    """
     tmp_reduction_dir = os.path.join(DE_CAT, "temporary_data", generate_timestamp_dirname())
     os.makedirs(tmp_reduction_dir, exist_ok = True)
     # list with files that were managed to
@@ -114,15 +123,38 @@ def processUploadedFiles(
         if uploadedFile is not None:
             fileSavePath = os.path.join(tmp_reduction_dir, uploadedFile.name)
             try:
-                fileContent = uploadedFile.getvalue()
-                with open(fileSavePath, "wb") as f:
-                    f.write(fileContent)
+                saveUploadedFile(uploadedFile, fileSavePath)
                 data_reduction_files.append(fileSavePath)
-            except:
+            except OSError:
                 pass
+    return tmp_reduction_dir, data_reduction_files
 
-    # -- perform data reduction --
-    with st.spinner("Processing uploaded files..."):
+def reduceSavedFiles(
+        data_reduction_files: list[str],
+        tmp_reduction_dir: str,
+        isOnOff: bool,
+        isCal: bool,
+        BBCLHC: int,
+        BBCRHC: int,
+        annotator_model,
+        broken_scan_model,
+        final_scan_annotator_model,
+        workers: int = 1,
+        codec: str = DEFAULT_CODEC,
+        bundle: bool = False,
+        keep_uncalibrated: bool = True,
+        result_cache: resultCache | None = None,
+        progressCallback = None) -> str:
+    """
+    Reduces saved archives and packs the .fits files
+    With << bundle >> all observations are packed as a single .fits file
+    With << keep_uncalibrated >> calibrated files keep their spectra before calibration, for recalibration
+    Returns the name of the result archive
+    """
+    archive_basename = os.path.join(tmp_reduction_dir, os.path.basename(tmp_reduction_dir))
+    bundle_filename = archive_basename + ".fits"
+    # -- every .fits file goes to the archive as soon as it is written (or to the bundle at the end) --
+    with resultPackager(archive_basename, codec = codec) as packager:
         reductor = MultipleDataReductor(
             archiveFilenames = [f for f in data_reduction_files],
             data_tmp_directory = tmp_reduction_dir,
@@ -133,41 +165,165 @@ def processUploadedFiles(
             BBCRHC = BBCRHC,
             annotator_model = annotator_model,
             broken_scans_detector_model = broken_scan_model,
-            final_scan_annotator_model = final_scan_annotator_model)
-        file_names_to_download = reductor.performDataReduction()
-
-        # -- manage files in temporary directory --
-        cwd = os.getcwd() # get the current working directory
-        os.chdir(tmp_reduction_dir) # change to data save directory
-        archive_filename = os.path.basename(tmp_reduction_dir)
-        os.system(f"tar -cvjf {archive_filename}.tar.bz2 *.fits") # compress.fits files
-        # remove leftover files
-        for filename in file_names_to_download:
-            if os.path.exists(os.path.join(DE_CAT, filename)):
-                os.remove(os.path.join(DE_CAT, filename))
-        for filename in data_reduction_files:
-            if os.path.exists(filename):
-                os.remove(filename)
-        os.chdir(cwd)
-
-    # set the file to download
-    with open(os.path.join(tmp_reduction_dir, f"{archive_filename}.tar.bz2"), "rb") as f:
-        st.download_button(
-            label = "Download .fits files",
-            data = f,
-            file_name = f"{archive_filename}.tar.bz2",
-            mime = None,
-            icon = ":material/download:"
-        )
-    if os.path.exists(os.path.join(tmp_reduction_dir, f"{archive_filename}.tar.bz2")):
-        os.remove(os.path.join(tmp_reduction_dir, f"{archive_filename}.tar.bz2"))
-    if os.path.exists(tmp_reduction_dir):
-        os.rmdir(tmp_reduction_dir)
-
-def archive_uploader(
-        annotator_model: tf.keras.models.Model,
-        broken_scan_model: tf.keras.models.Model,
-        final_scan_annotator_model: tf.keras.models.Model) -> None:
+            final_scan_annotator_model = final_scan_annotator_model,
+            workers = workers,
+            models_directory = model_store_directory(DE_CAT),
+            result_cache = result_cache,
+            model_backend = INFERENCE_BACKEND,
+            model_quantization = QUANTIZATION,
+            keep_uncalibrated = keep_uncalibrated,
+            timing_log = os.path.join(tmp_reduction_dir, TIMING_LOG_FILENAME) if TIMING else None)
+        file_names_to_download = reductor.performDataReduction(
+            fileSavedCallback = None if bundle else packager.add,
+            progressCallback = progressCallback)
+        if bundle:
+            packager.add(writeFitsBundle(file_names_to_download, bundle_filename))
+            file_names_to_download.append(bundle_filename)
+
+    # remove leftover files
+    for filename in file_names_to_download:
+        if os.path.exists(filename):
+            os.remove(filename)
+    for filename in data_reduction_files:
+        if os.path.exists(filename):
+            os.remove(filename)
+    return packager.filename
+
+def reduceWithLoadedModels(
+        data_reduction_files: list[str],
+        tmp_reduction_dir: str,
+        progressCallback,
+        model_loader: backgroundModelLoader,
+        inference_server: inferenceServer,
+        **reduction_parameters) -> str:
+    """
+    Waits for the models (if they are still loading) and reduces saved archives,
+    predicting through the shared inference server
+    """
+    if not model_loader.ready():
+        progressCallback(0.0, "Waiting for the models to load...")
+    model_loader.get()
+    annotator_model, broken_scan_model, final_scan_annotator_model = inference_server.proxies()
+    return reduceSavedFiles(
+        data_reduction_files,
+        tmp_reduction_dir,
+        annotator_model = annotator_model,
+        broken_scan_model = broken_scan_model,
+        final_scan_annotator_model = final_scan_annotator_model,
+        progressCallback = progressCallback,
+        **reduction_parameters)
+
+def processUploadedFiles(
+        uploadedFiles: list,
+        **reduction_parameters) -> str:
+    """
+    Saves uploaded files and queues their reduction
+    Returns the id of the job
+    """
+    tmp_reduction_dir, data_reduction_files = saveUploadedFiles(uploadedFiles)
+    # -- shared resources are looked up here, in the script thread --
+    model_loader = get_model_loader()
+    inference_server = get_inference_server()
+    result_cache = get_result_cache()
+    return get_job_queue().submit(
+        lambda progressCallback: reduceWithLoadedModels(
+            data_reduction_files,
+            tmp_reduction_dir,
+            progressCallback,
+            model_loader,
+            inference_server,
+            result_cache = result_cache,
+            **reduction_parameters),
+        description = f"{len(data_reduction_files)} file(s) submitted at {datetime.now().strftime('%H:%M:%S')}",
+        directory = tmp_reduction_dir,
+        result_mime = PACKAGE_CODECS[reduction_parameters.get("codec", DEFAULT_CODEC)][1])
+
+def displayJob(job_id: str):
+    """
+    Displays status of the job, with download button when the result is ready
+    """
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        st.write(f"Job `{job_id}` not found (it might have expired)")
+        return
+    st.write(f"**Job** `{job.id}` - {job.description}")
+    if job.status == JOB_QUEUED:
+        st.write(f"Waiting in the queue ({queue.queuePosition(job.id)} job(s) ahead)")
+    elif job.status == JOB_RUNNING:
+        st.progress(job.progress, text = job.message)
+    elif job.status == JOB_FAILED:
+        st.error(f"Reduction failed: {job.error}")
+    elif job.status == JOB_DONE and job.resultFilename is not None and os.path.exists(job.resultFilename):
+        if os.path.getsize(job.resultFilename) <= RESULT_MEMORY_CACHE_MB * 1024**2:
+            displayDownloadButton(job, read_result_file(job.resultFilename, os.path.getmtime(job.resultFilename)))
+        else:
+            # large results are not cached - the file is handed over to the button straight from the disk
+            with open(job.resultFilename, "rb") as result_file:
+                displayDownloadButton(job, result_file)
+        if TIMING:
+            displayJobTimings(job)
+
+def displayDownloadButton(job, data):
+    st.download_button(
+        label = "Download .fits files",
+        data = data,
+        file_name = os.path.basename(job.resultFilename),
+        mime = job.resultMime,
+        icon = ":material/download:",
+        key = f"download_{job.id}"
+    )
+
+def displayJobTimings(job):
+    """
+    Displays durations of the reduction stages of the job, summed over its archives
+    """
+    timing_log = os.path.join(job.directory or "", TIMING_LOG_FILENAME)
+    if not os.path.exists(timing_log):
+        return
+    batches = [record for record in readTimingLog(timing_log) if "batch" in record]
+    if len(batches) == 0:
+        return
+    with st.expander("Timings"):
+        stages = batches[-1]["stages"]
+        st.table({
+            "stage": list(stages.keys()),
+            "calls": [stage["count"] for stage in stages.values()],
+            "seconds": [round(stage["seconds"], 3) for stage in stages.values()]})
+
+def displayJobs():
+    """
+    Displays jobs of this session and a lookup of any job by its id
+    """
+    job_ids = st.session_state.get("jobs", [])
+    if len(job_ids) > 0:
+        st.subheader("Your jobs")
+        for job_id in reversed(job_ids):
+            displayJob(job_id)
+    job_id = st.text_input("Look up a job by its id")
+    if job_id:
+        displayJob(job_id.strip())
+    st.button("Refresh status")
+
+def displayModelStatus():
+    """
+    Displays whether the models are still loading
+    """
+    model_loader = get_model_loader()
+    if not model_loader.ready():
+        st.info("Models are loading in the background - submitted files will wait for them")
+    elif model_loader.error is not None:
+        st.error(f"Models could not be loaded: {model_loader.error}")
+    elif TIMING:
+        st.caption(f"Models loaded, cold start took {model_loader.coldStartSeconds:.1f} s")
+
+# -- refresh job and model status periodically, if this version of Streamlit can do so --
+if hasattr(st, "fragment"):
+    displayJobs = st.fragment(run_every = JOB_POLL_INTERVAL)(displayJobs)
+    displayModelStatus = st.fragment(run_every = JOB_POLL_INTERVAL)(displayModelStatus)
+
+def archive_uploader() -> None:
+    displayModelStatus()
     with st.form("Form"):
         uploaded_files = st.file_uploader(
             "Upload .tar.bz2 archives",
@@ -188,32 +344,49 @@ def archive_uploader(
 
         use_caltab = st.checkbox("Use caltabs", value = True)
         is_onoff = st.checkbox("On-off reduction", value = False)
+        keep_uncalibrated = st.checkbox(
+            "Keep spectra before calibration",
+            value = True,
+            help = "needed to apply newer caltabs later (services/recalibrate.py), doubles the size of the .fits files")
+        workers = st.number_input(
+            "Worker processes",
+            min_value = 1,
+            max_value = os.cpu_count() or 1,
+            value = 1)
+        codec = st.selectbox(
+            "Result archive compression",
+            list(PACKAGE_CODECS.keys()),
+            index = list(PACKAGE_CODECS.keys()).index(DEFAULT_CODEC))
+        # -- output mode: bundle or not --
+        outputs = {"One .fits file per observation": False, "All observations in one .fits file": True}
+        output = st.radio("Output", outputs.keys(), index = 0)
         submit = st.form_submit_button("Submit")
 
     if submit:
         st.write(f"You selected BBC {selection[selected_bbc_lhc]} for LHC and BBC {selection[selected_bbc_rhc]} for RHC")
         # -- display message --
         displayMessageOnLoad(uploaded_files, use_caltab, is_onoff)
-        # -- process files --
-        processUploadedFiles(
+        # -- queue processing of the files --
+        job_id = processUploadedFiles(
             uploaded_files,
             isOnOff = is_onoff,
             isCal = use_caltab,
             BBCLHC = int(selection[selected_bbc_lhc]),
             BBCRHC = int(selection[selected_bbc_rhc]),
-            annotator_model = annotator_model,
-            broken_scan_model = broken_scan_model,
-            final_scan_annotator_model=final_scan_annotator_model)
+            workers = int(workers),
+            codec = codec,
+            bundle = outputs[output],
+            keep_uncalibrated = keep_uncalibrated)
+        st.session_state.setdefault("jobs", []).append(job_id)
+        st.write(f"Your files were queued as job `{job_id}`, the result can be downloaded later using this id")
+    displayJobs()
 
 
 def main():
-    scan_annotator_model, broken_scans_detector_model, final_scan_annotator = load_models()
     st.set_page_config(page_title="Torun 32 m radio telescope data reductor", layout='wide')
-    archive_uploader(
-        annotator_model = scan_annotator_model,
-        broken_scan_model = broken_scans_detector_model,
-        final_scan_annotator_model = final_scan_annotator
-    )
+    # -- starts loading the models, does not wait for them --
+    get_model_loader()
+    archive_uploader()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+Parity check of the TFLite inference backend against Keras
+Runs merged scans (and their final-spectrum-like means) through both backends and compares
+channel labels and broken scan decisions. Exits with 0 if every model agrees to the tolerance,
+with 1 otherwise, so it can gate a deployment or a CI job.
+Example:
+    python services/parity.py --quantization dynamic night/*.tar.bz2
+Without network access and archives (synthetic archive, stand-in models):
+    python services/parity.py --stand-in-models --quantization dynamic
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+from data.modelLoader import load_models_from_directory, ensure_models
+from data.tfliteBackend import compareBackends, QUANTIZATIONS, QUANTIZATION_NONE, BACKEND_KERAS, BACKEND_TFLITE
+from data.syntheticArchive import writeSyntheticArchive, syntheticScanSet
+from data.standInModels import saveStandInModels
+DE_CAT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_arguments(argv = None):
+    parser = argparse.ArgumentParser(description = "Compares TFLite models with the Keras models")
+    parser.add_argument("archives", nargs = "*",
+                        help = "archives with the test scans (default: synthetic archive)")
+    parser.add_argument("--quantization", choices = QUANTIZATIONS, default = QUANTIZATION_NONE,
+                        help = f"quantization of the TFLite models (default: {QUANTIZATION_NONE})")
+    parser.add_argument("--tolerance", type = float, default = 0.99,
+                        help = "minimal fraction of the labels and decisions that have to agree (default: 0.99)")
+    parser.add_argument("--models-dir", default = None,
+                        help = "directory with the .keras models (default: local model store)")
+    parser.add_argument("--offline-models", action = "store_true",
+                        help = "never download models, use the local model store only")
+    parser.add_argument("--stand-in-models", action = "store_true",
+                        help = "compare stand-in models (built on the fly) instead of the real ones - checks the backends offline")
+    return parser.parse_args(argv)
+
+
+def load_spectra(archives: list[str]) -> np.ndarray:
+    '''
+    Returns (n_spectra, n_channels) matrix with every BBC of every merged scan
+    '''
+    if len(archives) == 0:
+        archives = [writeSyntheticArchive(os.path.join(tempfile.mkdtemp(), "synthetic.tar.bz2"), scans = 40)]
+        loader = syntheticScanSet
+    else:
+        from ncu_salsa_rt4 import ScanSet as loader
+    spectra = []
+    for archive in archives:
+        observation = loader(archive, False)
+        spectra.extend(np.asarray(scan.pols)[bbc] for scan in observation.mergedScans for bbc in range(len(scan.pols)))
+    return np.asarray(spectra, dtype = np.float32)
+
+
+def main(argv = None) -> int:
+    args = parse_arguments(argv)
+    models_directory = args.models_dir
+    if args.stand_in_models:
+        models_directory = saveStandInModels(os.path.join(tempfile.mkdtemp(), "models"))
+    elif models_directory is None:
+        models_directory = ensure_models(DE_CAT, offline = args.offline_models)
+    keras_models = load_models_from_directory(models_directory, backend = BACKEND_KERAS, software_path = DE_CAT)
+    tflite_models = load_models_from_directory(
+        models_directory, backend = BACKEND_TFLITE, quantization = args.quantization, software_path = DE_CAT)
+    spectra = load_spectra(args.archives)
+    # -- final annotator gets frequency-switched halves, like the final spectra --
+    half = spectra.shape[1] // 2
+    final_spectra = (spectra[:, :half] - spectra[:, half:]) / 2.0
+    report = compareBackends(keras_models, tflite_models, spectra, final_spectra)
+    passed = True
+    for name, result in report.items():
+        ok = result["agreement"] >= args.tolerance
+        passed = passed and ok
+        print(f"{name:>22s}: {result['agreement'] * 100:7.3f} % labels agree, "
+              f"max |dp| = {result['max_abs_diff']:.2e} {'OK' if ok else 'FAILED'}")
+    print(f"-----> Parity {'PASSED' if passed else 'FAILED'} (tolerance {args.tolerance * 100:.3f} %)")
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+"""
+Pins sha256 of the published models in modelPaths.ini
+Run it whenever the model files (or the version of the store) change, and commit modelPaths.ini
+Example:
+    python services/pin_models.py
+"""
+
+import os
+import sys
+from data.modelLoader import pin_model_checksums
+DE_CAT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main() -> int:
+    for name, checksum in pin_model_checksums(DE_CAT).items():
+        print(f"{name:>22s}: {checksum}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
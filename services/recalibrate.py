@@ -0,0 +1,57 @@
+"""
+Applies current caltabs to already reduced .fits files
+Only headers and uncalibrated spectra are read, so no archives and no models are needed.
+Example:
+    python services/recalibrate.py reduced/ --refresh-caltabs
+"""
+
+import os
+import sys
+import time
+import argparse
+from data.caltabStore import caltabStore
+from data.recalibration import expandReducedFiles, recalibrateFiles
+DE_CAT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_arguments(argv = None):
+    parser = argparse.ArgumentParser(description = "Recalibrates reduced .fits files with the current caltabs")
+    parser.add_argument("files", nargs = "+",
+                        help = ".fits files, glob patterns or directories with the reduced files")
+    parser.add_argument("--refresh-caltabs", action = "store_true",
+                        help = "download caltabs before recalibration, even if they are not outdated")
+    parser.add_argument("--dry-run", action = "store_true",
+                        help = "only list the files that would be rewritten")
+    return parser.parse_args(argv)
+
+
+def main(argv = None) -> int:
+    args = parse_arguments(argv)
+    filenames = expandReducedFiles(args.files)
+    missing = [f for f in filenames if not os.path.isfile(f)]
+    for filename in missing:
+        print(f"-----> No such file: {filename}", file = sys.stderr)
+    if len(missing) > 0 or len(filenames) == 0:
+        if len(filenames) == 0:
+            print("-----> No files to recalibrate", file = sys.stderr)
+        return 1
+
+    store = caltabStore(DE_CAT)
+    if args.refresh_caltabs or store.needsRefresh():
+        store.refresh(force = args.refresh_caltabs)
+    index = store.getIndex()
+    if len(index.caltabs) == 0:
+        print("-----> No caltabs loaded, nothing to apply", file = sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    report = recalibrateFiles(filenames, index, version = store.version(), dry_run = args.dry_run)
+    action = "would be recalibrated" if args.dry_run else "recalibrated"
+    print(f"-----> {len(report['recalibrated'])} of {len(filenames)} files {action}, "
+          f"{len(report['unchanged'])} unchanged, {len(report['skipped'])} skipped "
+          f"({time.perf_counter() - start:.2f} s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,8 @@
+"""
+Tests import the modules the same way the scripts in services/ do (from data.xxx import ...)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services'))
@@ -0,0 +1,76 @@
+"""
+Batched baseline fitting, compared with the per-spectrum numpy fits it replaced
+"""
+
+import numpy as np
+import pytest
+from data.baselineFit import fitBaselines, rangesToMask, BASIS_POLYNOMIAL
+from data.categoryBounds import runsToRanges
+
+
+def fitPolyForData(spectrum_data, fitBoundChannels, poly_order):
+    '''
+    dataContainter.fit_poly_for_data before the batched fit: np.polyfit on channel numbers 1..N
+    '''
+    chans = np.linspace(1, len(spectrum_data), len(spectrum_data))
+    fitData = []
+    fitChans = []
+    for i in fitBoundChannels:
+        fitData.extend(spectrum_data[i[0]:i[1]])
+        fitChans.extend(chans[i[0]:i[1]])
+    poly = np.polyfit(fitChans, fitData, poly_order)
+    return spectrum_data - np.polyval(poly, chans)
+
+
+def fitCheby(data, order, fitBoundsChannels):
+    '''
+    ScanSet.fit_cheby: Chebyshev fit through [start, end] runs (end inclusive)
+    '''
+    channels = np.arange(len(data))
+    fitChans = np.concatenate([channels[start:end+1] for start, end in fitBoundsChannels])
+    poly = np.polynomial.chebyshev.Chebyshev.fit(fitChans, data[fitChans], order, domain = [0, len(data) - 1])
+    return data - poly(channels)
+
+
+def spectra(n_rows, n_channels, seed = 0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1.0, 1.0, n_channels)
+    baselines = np.polynomial.polynomial.polyval(x, rng.normal(0.0, 5.0, (n_rows, 6)).T)
+    return baselines + rng.normal(0.0, 0.1, (n_rows, n_channels))
+
+
+def test_ranges_to_mask_follows_slicing():
+    ranges = [[[10, 20], [15, 30]], [], [[-5, 3], [90, 200]], [[40, 40]]]
+    expected = np.zeros((len(ranges), 100), dtype = bool)
+    for row, row_ranges in enumerate(ranges):
+        for start, end in row_ranges:
+            expected[row, max(start, 0):end] = True
+    np.testing.assert_array_equal(rangesToMask(ranges, 100), expected)
+
+
+# -- fit ranges reach both ends of the spectrum, like the baseline runs of the annotators;
+# far outside the fitted channels high order baselines are extrapolated and the fits are not comparable --
+def test_polynomial_fit_agrees_with_polyfit():
+    data = spectra(4, 2048)
+    ranges = [[[25, 800], [1200, 2020]], [[25, 2020]], [[30, 300], [500, 700], [1500, 2000]], [[30, 1000], [1900, 2040]]]
+    residuals = fitBaselines(data, rangesToMask(ranges, data.shape[1]), 7, basis = BASIS_POLYNOMIAL)
+    for row, row_ranges in enumerate(ranges):
+        np.testing.assert_allclose(residuals[row], fitPolyForData(data[row], row_ranges, 7), atol = 1e-6)
+
+
+@pytest.mark.parametrize("n_channels", [1024, 2048])
+def test_chebyshev_fit_agrees_with_fit_cheby(n_channels):
+    data = spectra(3, n_channels, seed = n_channels)
+    runs = [[[25, 400], [700, n_channels - 26]], [[25, n_channels - 1]], [[25, 60], [300, 900], [n_channels - 100, n_channels - 30]]]
+    residuals = fitBaselines(data, rangesToMask([runsToRanges(r) for r in runs], n_channels), 10)
+    for row, row_runs in enumerate(runs):
+        np.testing.assert_allclose(residuals[row], fitCheby(data[row], 10, row_runs), atol = 1e-8)
+
+
+def test_channels_outside_the_mask_do_not_affect_the_fit():
+    data = spectra(1, 512)
+    mask = rangesToMask([[[25, 200], [300, 490]]], 512)
+    spoiled = data.copy()
+    spoiled[0, 210:290] = np.nan
+    residuals = fitBaselines(spoiled, mask, 10)
+    np.testing.assert_allclose(residuals[0, mask[0]], fitBaselines(data, mask, 10)[0, mask[0]], atol = 1e-10)
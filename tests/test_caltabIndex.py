@@ -0,0 +1,71 @@
+"""
+Vectorized caltab queries, compared with findProperCaltabIndex and findCoeffs of every epoch
+"""
+
+import numpy as np
+from data.caltabClass import caltab
+from data.caltabIndex import caltabIndex, NO_CALTAB
+
+NO_CALTAB_INDEX = int(1e9) # findProperCaltabIndex without caltab
+
+
+def makeCaltab(label, freqRange, seed):
+    rng = np.random.default_rng(seed)
+    lhcEpochs = np.sort(rng.uniform(8000.0, 11000.0, 30))
+    rhcEpochs = np.sort(rng.uniform(8100.0, 10900.0, 25))
+    return caltab.fromTables(
+        label, freqRange,
+        np.vstack((lhcEpochs, rng.uniform(0.5, 2.0, len(lhcEpochs)))),
+        np.vstack((rhcEpochs, rng.uniform(0.5, 2.0, len(rhcEpochs)))))
+
+
+def findProperCaltabIndex(caltabs, frequency_ghz):
+    properIndex = NO_CALTAB_INDEX
+    for i in range(len(caltabs)):
+        if caltabs[i].inRange(frequency_ghz):
+            properIndex = i
+    return properIndex
+
+
+# -- overlapping ranges: the last covering caltab wins, boundaries belong to no caltab on their own --
+CALTABS = [
+    makeCaltab('OH', [1.6, 1.7], 0),
+    makeCaltab('M', [6.0, 7.0], 1),
+    makeCaltab('M_narrow', [6.6, 6.7], 2),
+    makeCaltab('H2O', [22.0, 22.5], 3),
+]
+
+
+def test_query_agrees_with_the_loop():
+    index = caltabIndex(CALTABS)
+    rng = np.random.default_rng(4)
+    frequencies = np.concatenate((
+        [1600.0, 1700.0, 1650.0, 6000.0, 6600.0, 6668.519, 6700.0, 7000.0, 12178.0, 22235.08, 22500.0],
+        rng.uniform(1000.0, 25000.0, 200))) # MHz
+    mjds = rng.uniform(57000.0, 62000.0, len(frequencies))
+    result = index.query(mjds, frequencies)
+    for i, (mjd, frequency) in enumerate(zip(mjds, frequencies)):
+        expected = findProperCaltabIndex(CALTABS, frequency / 1000.0)
+        if expected == NO_CALTAB_INDEX:
+            assert result.indices[i] == NO_CALTAB and not result.found[i]
+            assert result.lhc[i] == 1.0 and result.rhc[i] == 1.0
+        else:
+            assert result.indices[i] == expected and result.found[i]
+            lhc, rhc = CALTABS[expected].findCoeffs(mjd)
+            assert result.lhc[i] == lhc and result.rhc[i] == rhc
+
+
+def test_epochs_outside_the_caltab_are_extrapolated():
+    index = caltabIndex(CALTABS)
+    c = CALTABS[1]
+    minEpoch = max(c.lhcMJDTab.min(), c.rhcMJDTab.min())
+    maxEpoch = min(c.lhcMJDTab.max(), c.rhcMJDTab.max())
+    result = index.query([minEpoch - 1.0, (minEpoch + maxEpoch) / 2.0, maxEpoch + 1.0], 6100.0)
+    assert result.extrapolated.tolist() == [True, False, True]
+    assert result.inRange.tolist() == [False, True, False]
+
+
+def test_empty_index():
+    result = caltabIndex([]).query([58000.0, 59000.0], [6668.519, 12178.0])
+    assert result.indices.tolist() == [NO_CALTAB, NO_CALTAB]
+    assert result.lhc.tolist() == [1.0, 1.0] and result.rhc.tolist() == [1.0, 1.0]
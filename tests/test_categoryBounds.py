@@ -0,0 +1,59 @@
+"""
+Vectorized category runs, compared with the loop of dataContainter.extract_category_bounds they replaced
+"""
+
+import numpy as np
+import pytest
+from data.categoryBounds import categoryRuns, categoryRunsMatrix, runsToRanges, EDGE_CHANNELS
+
+
+def extractCategoryBounds(category, cat_to_bound = 0):
+    new_bounds = []
+    i = 25
+    while i < len(category) - 25:
+        if category[i] == cat_to_bound:
+            start = i
+            while i < len(category) and category[i] == cat_to_bound:
+                i += 1
+            end = i - 1
+            new_bounds.append([start, end])
+        else:
+            i += 1
+    return new_bounds
+
+
+@pytest.mark.parametrize("run_length", [1, 3, 40])
+@pytest.mark.parametrize("category", [0, 1, 2])
+def test_runs_agree_with_the_loop(run_length, category):
+    rng = np.random.default_rng(run_length)
+    labels = np.repeat(rng.integers(0, 3, 2048 // run_length + 1), run_length)[:2048]
+    assert categoryRuns(labels, category).tolist() == extractCategoryBounds(labels, category)
+
+
+def test_runs_at_the_edges():
+    labels = np.ones(100, dtype = int)
+    # -- run crossing the left edge is cut, run starting in the right edge is dropped, run crossing it is kept whole --
+    labels[10:30] = 0
+    labels[60:80] = 0
+    labels[90:] = 0
+    assert categoryRuns(labels, 0).tolist() == extractCategoryBounds(labels, 0) == [[EDGE_CHANNELS, 29], [60, 79]]
+    labels[:] = 1
+    labels[70:] = 0
+    assert categoryRuns(labels, 0).tolist() == extractCategoryBounds(labels, 0) == [[70, 99]]
+
+
+def test_matrix_rows_agree_with_single_rows():
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 2, (16, 512))
+    labels[3] = 1
+    for row, runs in zip(labels, categoryRunsMatrix(labels, 0)):
+        assert runs.tolist() == extractCategoryBounds(row, 0)
+
+
+def test_runs_to_ranges_makes_ends_exclusive():
+    labels = np.ones(100, dtype = int)
+    labels[40:50] = 0
+    ranges = runsToRanges(categoryRuns(labels, 0))
+    assert ranges.tolist() == [[40, 50]]
+    assert np.all(labels[ranges[0, 0]:ranges[0, 1]] == 0)
+    assert runsToRanges([]).shape == (0, 2)
@@ -0,0 +1,74 @@
+"""
+Vectorized velocity-to-channel mapping and interpolation of the final spectrum,
+compared with the loops they replaced (needs ncu_salsa_rt4, the archive parser)
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("ncu_salsa_rt4")
+from data.dataClass import dataContainter
+from data.polarizationContext import polarizationContext
+
+
+def convertVelsToChannels(vels, velTab):
+    chanTab = []
+    for i in velTab:
+        minChan = -1
+        maxChan = -1
+        for j in range(len(vels)):
+            if i[0] < vels[j]:
+                minChan = j
+                break
+        for j in range(len(vels)):
+            if i[1] < vels[j]:
+                maxChan = j
+                break
+        if i[0] > vels.max():
+            minChan = len(vels)-1
+        if i[1] > vels.max():
+            maxChan = len(vels)-1
+        if minChan != -1 and maxChan != -1:
+            chanTab.append([minChan, maxChan])
+    return chanTab
+
+
+def removeChansOnFinalSpectrum(finalFitRes, channelsToRemove):
+    for minChan, maxChan in channelsToRemove:
+        for j in range(minChan, maxChan, 1):
+            y1 = finalFitRes[minChan]
+            y2 = finalFitRes[maxChan]
+            a = (y1 - y2) / (minChan - maxChan)
+            b = y1 - a * minChan
+            finalFitRes[j] = a * j + b
+    return finalFitRes
+
+
+def container(vels = None, finalFitRes = None):
+    # -- only the attributes used by the tested methods, no archive is loaded --
+    data = object.__new__(dataContainter)
+    data.context = polarizationContext(bbc = 1)
+    data.velTab = {1: vels}
+    data.finalFitRes = finalFitRes
+    return data
+
+
+def test_velocities_to_channels_agree_with_the_loop():
+    vels = np.linspace(-50.0, 30.0, 2048)
+    velTab = [[-10.0, 5.0], [5.0, -10.0], [-60.0, -40.0], [-60.0, 40.0], [25.0, 40.0], [40.0, 50.0],
+              [vels[100], vels[200]], [vels[-1], vels[-1]], [vels[0], vels[-1]], [-70.0, -60.0]]
+    assert container(vels).convertVelsToChannels(1, velTab) == convertVelsToChannels(vels, velTab)
+
+
+@pytest.mark.parametrize("channelsToRemove", [
+    [[100, 200], [500, 520], [1000, 1001]],
+    [[500, 520], [100, 200]],
+    [[100, 200], [150, 300], [120, 130]], # overlapping - interpolated one by one
+    [[300, 300], [400, 390], [10, 20]], # empty and reversed ranges change nothing
+])
+def test_removed_channels_agree_with_the_loop(channelsToRemove):
+    spectrum = np.random.default_rng(0).normal(0.0, 1.0, 2048)
+    data = container(finalFitRes = spectrum.copy())
+    data.removeChansOnFinalSpectrum(channelsToRemove)
+    np.testing.assert_allclose(
+        data.finalFitRes, removeChansOnFinalSpectrum(spectrum.copy(), channelsToRemove), rtol = 1e-12, atol = 1e-12)
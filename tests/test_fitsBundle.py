@@ -0,0 +1,59 @@
+"""
+Bundles of reduced observations, read back memory-mapped
+"""
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from data.fitsBundle import writeFitsBundle, fitsBundle, UNCALIBRATED_COLUMNS
+
+
+def writeReducedFile(filename, source, mjd, nchans, seed, uncalibrated = True):
+    rng = np.random.default_rng(seed)
+    pol1, pol2 = rng.normal(0.0, 1.0, (2, nchans)).astype(np.float32)
+    data = fits.BinTableHDU.from_columns([
+        fits.Column(name = 'Pol 1', format = 'E', array = pol1),
+        fits.Column(name = 'Pol 2', format = 'E', array = pol2)])
+    data.header['OBJECT'] = source
+    data.header['OBS_MJD'] = mjd
+    data.header['CALIBRAT'] = True
+    data.header['TSYS1'] = 50.0 + seed
+    hdus = [fits.PrimaryHDU(), data]
+    if uncalibrated:
+        hdus.append(fits.BinTableHDU.from_columns([
+            fits.Column(name = 'Pol 1', format = 'E', array = pol1 / 2.0),
+            fits.Column(name = 'Pol 2', format = 'E', array = pol2 / 2.0)],
+            name = 'UNCALIB'))
+    fits.HDUList(hdus).writeto(filename)
+    return pol1, pol2
+
+
+def test_observations_round_trip(tmp_path):
+    observations = [('G32.744', 60000.1, 64), ('G33.641', 60000.2, 32), ('G32.744', 60001.1, 64)]
+    filenames = [str(tmp_path / f'obs{i}.fits') for i in range(len(observations))]
+    spectra = [writeReducedFile(f, *o, seed = i) for i, (f, o) in enumerate(zip(filenames, observations))]
+    bundle_filename = writeFitsBundle(filenames, str(tmp_path / 'bundle.fits'))
+    with fitsBundle(bundle_filename) as bundle:
+        assert len(bundle) == 3 and len(bundle.tables) == 2
+        # -- epochs are numbered table by table (64 channels first) --
+        order = [0, 2, 1]
+        for epoch, i in enumerate(order):
+            np.testing.assert_array_equal(bundle.spectrum(epoch)[0], spectra[i][0])
+            np.testing.assert_array_equal(bundle.spectrum(epoch, uncalibrated = True)[1], spectra[i][1] / 2.0)
+            metadata = bundle.metadata(epoch)
+            assert metadata['OBS_MJD'] == observations[i][1]
+            assert metadata['TSYS1'] == 50.0 + i
+            assert metadata['CALIBRAT']
+        assert bundle.find(source = 'G32.744') == [0, 1]
+        assert bundle.find(mjd_range = (60000.0, 60000.5)) == [0, 2]
+        assert bundle.find(source = 'G32.744', mjd_range = (60001.0, 60002.0)) == [1]
+
+
+def test_uncalibrated_spectra_only_if_every_observation_has_them(tmp_path):
+    filenames = [str(tmp_path / 'a.fits'), str(tmp_path / 'b.fits')]
+    writeReducedFile(filenames[0], 'G32.744', 60000.1, 16, seed = 0)
+    writeReducedFile(filenames[1], 'G32.744', 60000.2, 16, seed = 1, uncalibrated = False)
+    with fitsBundle(writeFitsBundle(filenames, str(tmp_path / 'bundle.fits'))) as bundle:
+        assert not set(UNCALIBRATED_COLUMNS) & set(bundle.tables[0].columns.names)
+        with pytest.raises(KeyError):
+            bundle.spectrum(0, uncalibrated = True)
@@ -0,0 +1,64 @@
+"""
+Micro-batching inference server, with simple numpy models
+"""
+
+import threading
+import numpy as np
+import pytest
+from data.inferenceServer import inferenceServer
+from data.tfliteBackend import MODEL_SUFFIXES
+
+
+class doublingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, data, verbose = 0):
+        self.calls += 1
+        return np.asarray(data) * 2.0
+
+
+def test_concurrent_requests_get_their_own_rows():
+    models = tuple(doublingModel() for _ in MODEL_SUFFIXES)
+    server = inferenceServer(lambda: models, max_wait = 0.05)
+    annotator = server.proxies()[0]
+    inputs = [np.full((i + 1, 8, 1), float(i)) for i in range(6)]
+    outputs = [None] * len(inputs)
+
+    def predict(i):
+        outputs[i] = annotator.predict(inputs[i])
+
+    threads = [threading.Thread(target = predict, args = (i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for data, output in zip(inputs, outputs):
+        np.testing.assert_array_equal(output, data * 2.0)
+    assert server.stats()[MODEL_SUFFIXES[0]]['requests'] == len(inputs)
+
+
+def test_request_times_out():
+    release = threading.Event()
+
+    def models_provider():
+        release.wait()
+        return tuple(doublingModel() for _ in MODEL_SUFFIXES)
+
+    server = inferenceServer(models_provider, request_timeout = 0.1)
+    try:
+        with pytest.raises(TimeoutError):
+            server.predict(MODEL_SUFFIXES[1], np.zeros((1, 8, 1)))
+    finally:
+        release.set()
+
+
+def test_requests_fail_when_serving_thread_stops():
+    server = inferenceServer(lambda: tuple(doublingModel() for _ in MODEL_SUFFIXES), request_timeout = 5.0)
+    # -- 0-d input has no rows, it stops the serving thread --
+    with pytest.raises(RuntimeError):
+        server.predict(MODEL_SUFFIXES[2], np.float64(1.0))
+    with pytest.raises(RuntimeError):
+        server.predict(MODEL_SUFFIXES[2], np.zeros((1, 8, 1)))
+    # -- other models are still served --
+    np.testing.assert_array_equal(server.predict(MODEL_SUFFIXES[0], np.ones((1, 8, 1))), np.full((1, 8, 1), 2.0))
@@ -0,0 +1,94 @@
+"""
+Recalibration of reduced .fits files with the uncalibrated spectra kept
+"""
+
+import numpy as np
+from astropy.io import fits
+from data.caltabClass import caltab
+from data.caltabIndex import caltabIndex
+from data.recalibration import recalibrateFiles, readCalibrationRecords, UNCALIBRATED_EXTENSION
+
+MJD = 60000.5
+RESTFRQ = 6668.519e6 # Hz
+
+
+def writeReducedFile(filename, lhc = 1.0, rhc = 1.0, caltab_label = 'NONE', calibrated = False, uncalibrated = True):
+    pol1 = np.linspace(1.0, 2.0, 16)
+    pol2 = np.linspace(3.0, 4.0, 16)
+    data = fits.BinTableHDU.from_columns([
+        fits.Column(name = 'Pol 1', format = 'E', array = pol1 * lhc),
+        fits.Column(name = 'Pol 2', format = 'E', array = pol2 * rhc)])
+    header = data.header
+    header['RESTFRQ'] = RESTFRQ
+    header['CALIBRAT'] = calibrated
+    header['CAL_LHC'] = lhc
+    header['CAL_RHC'] = rhc
+    header['CALTAB'] = caltab_label
+    header['CALTABV'] = 'old'
+    header['OBS_MJD'] = MJD
+    hdus = [fits.PrimaryHDU(), data]
+    if uncalibrated:
+        hdus.append(fits.BinTableHDU.from_columns([
+            fits.Column(name = 'Pol 1', format = 'E', array = pol1),
+            fits.Column(name = 'Pol 2', format = 'E', array = pol2)],
+            name = UNCALIBRATED_EXTENSION))
+    fits.HDUList(hdus).writeto(filename)
+    return pol1, pol2
+
+
+def methanolCaltab(lhc, rhc):
+    epochs = np.array([MJD - 50000.0 - 10.0, MJD - 50000.0 + 10.0])
+    return caltab.fromTables(
+        'M', [6.6, 6.7],
+        np.vstack((epochs, np.full(2, lhc))),
+        np.vstack((epochs, np.full(2, rhc))))
+
+
+def test_newer_caltab_rescales_uncalibrated_spectra(tmp_path):
+    filename = str(tmp_path / 'calibrated.fits')
+    pol1, pol2 = writeReducedFile(filename, lhc = 1.5, rhc = 1.5, caltab_label = 'M', calibrated = True)
+    report = recalibrateFiles([filename], caltabIndex([methanolCaltab(2.0, 3.0)]), version = 'new')
+    assert report['recalibrated'] == [filename]
+    with fits.open(filename) as hdul:
+        np.testing.assert_allclose(hdul[1].data['Pol 1'], pol1 * 2.0, rtol = 1e-6)
+        np.testing.assert_allclose(hdul[1].data['Pol 2'], pol2 * 3.0, rtol = 1e-6)
+        assert hdul[1].header['CALIBRAT']
+        assert hdul[1].header['CALTABV'] == 'new'
+
+
+def test_recalibrating_without_caltab_clears_calibrat(tmp_path):
+    filename = str(tmp_path / 'calibrated.fits')
+    pol1, _ = writeReducedFile(filename, lhc = 1.5, rhc = 1.5, caltab_label = 'M', calibrated = True)
+    report = recalibrateFiles([filename], caltabIndex([]))
+    assert report['recalibrated'] == [filename]
+    with fits.open(filename) as hdul:
+        np.testing.assert_allclose(hdul[1].data['Pol 1'], pol1, rtol = 1e-6)
+        assert not hdul[1].header['CALIBRAT']
+        assert hdul[1].header['CALTAB'] == 'NONE'
+
+
+def test_file_without_caltab_is_calibrated_once_one_covers_it(tmp_path):
+    filename = str(tmp_path / 'no_caltab.fits')
+    writeReducedFile(filename)
+    assert recalibrateFiles([filename], caltabIndex([]))['unchanged'] == [filename]
+    report = recalibrateFiles([filename], caltabIndex([methanolCaltab(2.0, 2.0)]))
+    assert report['recalibrated'] == [filename]
+    with fits.open(filename) as hdul:
+        assert hdul[1].header['CALIBRAT']
+        assert hdul[1].header['CALTAB'] == 'M'
+
+
+def test_files_without_uncalibrated_spectra_are_skipped(tmp_path):
+    filename = str(tmp_path / 'without_uncalib.fits')
+    writeReducedFile(filename, lhc = 1.5, rhc = 1.5, caltab_label = 'M', calibrated = True, uncalibrated = False)
+    records, skipped = readCalibrationRecords([filename])
+    assert records == [] and skipped == [filename]
+
+
+def test_dry_run_leaves_files_untouched(tmp_path):
+    filename = str(tmp_path / 'calibrated.fits')
+    pol1, _ = writeReducedFile(filename, lhc = 1.5, rhc = 1.5, caltab_label = 'M', calibrated = True)
+    report = recalibrateFiles([filename], caltabIndex([methanolCaltab(2.0, 2.0)]), dry_run = True)
+    assert report['recalibrated'] == [filename]
+    with fits.open(filename) as hdul:
+        np.testing.assert_allclose(hdul[1].data['Pol 1'], pol1 * 1.5, rtol = 1e-6)
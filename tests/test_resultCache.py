@@ -0,0 +1,57 @@
+"""
+Content-addressed cache of the reduced .fits files
+"""
+
+import os
+from data.resultCache import resultCache
+
+PARAMETERS = {'isOnOff': False, 'isCal': True, 'BBCLHC': 1, 'BBCRHC': 2}
+
+
+def writeFile(filename, content):
+    with open(filename, 'wb') as f:
+        f.write(content)
+    return filename
+
+
+def test_key_changes_with_archive_content_and_parameters(tmp_path):
+    archive = writeFile(str(tmp_path / 'a.tar.bz2'), b'archive')
+    key = resultCache.key(archive, PARAMETERS, {'model': 'abc'}, 'v1')
+    assert key == resultCache.key(archive, dict(reversed(PARAMETERS.items())), {'model': 'abc'}, 'v1')
+    assert key != resultCache.key(archive, {**PARAMETERS, 'BBCLHC': 3}, {'model': 'abc'}, 'v1')
+    assert key != resultCache.key(archive, PARAMETERS, {'model': 'abd'}, 'v1')
+    assert key != resultCache.key(archive, PARAMETERS, {'model': 'abc'}, 'v2')
+    # -- the name of the archive does not matter, its content does --
+    copy = writeFile(str(tmp_path / 'b.tar.bz2'), b'archive')
+    assert key == resultCache.key(copy, PARAMETERS, {'model': 'abc'}, 'v1')
+    writeFile(copy, b'another archive')
+    assert key != resultCache.key(copy, PARAMETERS, {'model': 'abc'}, 'v1')
+
+
+def test_put_and_get(tmp_path):
+    cache = resultCache(str(tmp_path / 'cache'))
+    reduced = writeFile(str(tmp_path / 'G32.fits'), b'reduced')
+    target = tmp_path / 'target'
+    target.mkdir()
+    assert cache.get('key', str(target)) is None
+    cache.put('key', reduced)
+    filename = cache.get('key', str(target))
+    assert os.path.basename(filename) == 'G32.fits'
+    with open(filename, 'rb') as f:
+        assert f.read() == b'reduced'
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = resultCache(str(tmp_path / 'cache'), max_bytes = 250)
+    target = tmp_path / 'target'
+    target.mkdir()
+    for i, key in enumerate(['first', 'second']):
+        cache.put(key, writeFile(str(tmp_path / f'{key}.fits'), b'x' * 100))
+        os.utime(os.path.join(cache.cacheDirectory, key), (i, i))
+    # -- reading marks the first entry as recently used, so the second one goes --
+    cache.get('first', str(target))
+    cache.put('third', writeFile(str(tmp_path / 'third.fits'), b'x' * 100))
+    assert cache.get('second', str(target)) is None
+    assert cache.get('first', str(target)) is not None
+    assert cache.get('third', str(target)) is not None
+    assert cache.size() <= 250
@@ -0,0 +1,76 @@
+"""
+Streaming stack, compared with the list of residuals and np.mean it replaced
+"""
+
+import numpy as np
+import pytest
+from data.stackAccumulator import stackAccumulator
+
+
+def residuals(n_scans, n_channels = 256, seed = 0):
+    return np.random.default_rng(seed).normal(0.0, 10.0, (n_scans, n_channels))
+
+
+def test_mean_agrees_with_mean_of_the_list():
+    scans = residuals(20)
+    stack = stackAccumulator()
+    for i in range(10):
+        stack.add(i, scans[i])
+    stack.addMany(list(range(10, 20)), scans[10:])
+    np.testing.assert_allclose(stack.mean(), np.mean(scans, axis = 0), rtol = 1e-12, atol = 1e-12)
+    assert stack.scanIndices == list(range(20))
+
+
+@pytest.mark.parametrize("keepScans", [False, True])
+def test_removing_scans_agrees_with_popping_them(keepScans):
+    scans = residuals(12)
+    stack = stackAccumulator(keepScans = keepScans)
+    stack.addMany(list(range(12)), scans)
+    kept = list(range(12))
+    for i in [3, 0, 11, 7]:
+        stack.remove(i, None if keepScans else scans[i])
+        kept.remove(i)
+        assert i not in stack
+        np.testing.assert_allclose(stack.mean(), np.mean(scans[kept], axis = 0), rtol = 1e-12, atol = 1e-12)
+    assert stack.scanIndices == kept
+
+
+def test_removing_the_last_scan_empties_the_stack():
+    scans = residuals(2)
+    stack = stackAccumulator()
+    stack.add(0, scans[0])
+    stack.add(1, scans[1])
+    stack.remove(0, scans[0])
+    stack.remove(1, scans[1])
+    assert len(stack) == 0 and stack.mean() is None
+    stack.add(2, scans[1])
+    np.testing.assert_array_equal(stack.mean(), scans[1])
+
+
+def test_weighted_mean():
+    scans = residuals(3)
+    weights = np.array([1.0, 2.0, 0.5])
+    stack = stackAccumulator()
+    stack.addMany([0, 1, 2], scans, weights)
+    np.testing.assert_allclose(stack.mean(), np.average(scans, axis = 0, weights = weights), rtol = 1e-12)
+
+
+def test_invalid_operations():
+    scans = residuals(2)
+    stack = stackAccumulator()
+    stack.add(0, scans[0])
+    with pytest.raises(ValueError):
+        stack.add(0, scans[1])
+    with pytest.raises(ValueError):
+        stack.add(1, scans[1][:10])
+    with pytest.raises(ValueError):
+        stack.remove(0)
+    with pytest.raises(KeyError):
+        stack.remove(1, scans[1])
+
+
+def test_mean_is_a_new_array():
+    stack = stackAccumulator()
+    stack.add(0, residuals(1)[0])
+    stack.mean()[:] = 0.0
+    assert np.any(stack.mean() != 0.0)
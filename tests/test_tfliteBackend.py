@@ -0,0 +1,46 @@
+"""
+Parity of the TFLite backend with Keras, on stand-in models and a synthetic archive (no network needed)
+"""
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from data.modelLoader import load_models_from_directory
+from data.standInModels import saveStandInModels
+from data.syntheticArchive import writeSyntheticArchive, syntheticScanSet
+from data.tfliteBackend import compareBackends, exportTFLite, BACKEND_KERAS, BACKEND_TFLITE, QUANTIZATION_NONE, QUANTIZATIONS
+
+
+@pytest.fixture(scope = "module")
+def models_directory(tmp_path_factory):
+    return saveStandInModels(str(tmp_path_factory.mktemp("models")))
+
+
+@pytest.fixture(scope = "module")
+def spectra(tmp_path_factory):
+    archive = writeSyntheticArchive(str(tmp_path_factory.mktemp("archives") / "synthetic.tar.bz2"), scans = 8, seed = 1)
+    observation = syntheticScanSet(archive)
+    return np.asarray([np.asarray(scan.pols)[bbc] for scan in observation.mergedScans for bbc in range(4)], dtype = np.float32)
+
+
+@pytest.mark.parametrize("quantization", QUANTIZATIONS)
+def test_tflite_agrees_with_keras(models_directory, spectra, quantization):
+    keras_models = load_models_from_directory(models_directory, backend = BACKEND_KERAS)
+    tflite_models = load_models_from_directory(models_directory, backend = BACKEND_TFLITE, quantization = quantization)
+    half = spectra.shape[1] // 2
+    report = compareBackends(keras_models, tflite_models, spectra, (spectra[:, :half] - spectra[:, half:]) / 2.0)
+    assert set(report) == {"single_scan_annotator", "broken_scans", "final_scan_annotator"}
+    for name, result in report.items():
+        assert result["agreement"] >= 0.99, name
+
+
+def test_export_leaves_no_temporary_files(models_directory, tmp_path):
+    from tensorflow import keras
+    model = keras.models.load_model(
+        os.path.join(models_directory, "00_broken_scans.keras"), compile = False)
+    filename = exportTFLite(model, str(tmp_path / "model.tflite"), QUANTIZATION_NONE)
+    assert os.listdir(tmp_path) == ["model.tflite"]
+    assert os.path.getsize(filename) > 0